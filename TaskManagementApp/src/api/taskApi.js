@@ -1,3 +1,4 @@
+import AsyncStorage from '@react-native-async-storage/async-storage';
 import api from './api';
 
 export const getTask = async (taskId) => {
@@ -9,15 +10,83 @@ export const getTask = async (taskId) => {
     }
 };
 
-export const getTasks = async () => {
+// Last response per query, revalidated with If-None-Match so an unchanged
+// list costs a 304 instead of the whole payload
+const taskListCache = new Map();
+
+export const getTasks = async (params = {}) => {
+    const key = JSON.stringify(params);
+    const cached = taskListCache.get(key);
     try {
-        const response = await api.get('/tasks');
+        const response = await api.get('/tasks', {
+            params,
+            headers: cached ? { 'If-None-Match': cached.etag } : {},
+            validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+        });
+        if (response.status === 304 && cached) {
+            return cached.data;
+        }
+        if (response.headers.etag) {
+            taskListCache.set(key, { etag: response.headers.etag, data: response.data });
+        }
         return response.data;
     } catch (error) {
         console.error('Error fetching tasks', error);
     }
 };
 
+// Changes since the last sync token: apply `deleted`, then `changed`, then
+// keep `next_token`. No token (or `reset`) means a full snapshot.
+export const getTaskChanges = async (since) => {
+    try {
+        const response = await api.get('/tasks/changes', { params: since ? { since } : {} });
+        return response.data;
+    } catch (error) {
+        console.error('Error fetching task changes', error);
+    }
+};
+
+// Id of the last task event received, so the next subscription only gets what
+// was missed in between
+let lastEventId = '';
+
+// Pushes { type: 'tasks', seq, changed, deleted } whenever the user's tasks
+// change on any device, and { type: 'resync' } when events were missed and
+// the tasks need syncing. Returns the socket; close() it to stop listening.
+export const subscribeTaskEvents = async (onEvent) => {
+    const token = await AsyncStorage.getItem('access_token');
+    const url = api.defaults.baseURL.replace(/^http/, 'ws').replace(/\/api\/v1$/, '');
+    const socket = new WebSocket(
+        `${url}/ws/tasks?token=${encodeURIComponent(token)}&resume=${encodeURIComponent(lastEventId)}`
+    );
+    socket.onmessage = (message) => {
+        const frame = JSON.parse(message.data);
+        // The server closes sockets that stop answering its pings
+        if (frame.type === 'ping') {
+            socket.send(JSON.stringify({ type: 'pong' }));
+            return;
+        }
+        if (frame.id) {
+            lastEventId = frame.id;
+        }
+        if (frame.type === 'message') {
+            onEvent(JSON.parse(frame.data));
+        } else if (frame.type === 'resync') {
+            onEvent(frame);
+        }
+    };
+    return socket;
+};
+
+export const getTaskStats = async () => {
+    try {
+        const response = await api.get('/tasks/stats');
+        return response.data;
+    } catch (error) {
+        console.error('Error fetching task stats', error);
+    }
+};
+
 export const createTask = async (task) => {
     try {
         const response = await api.post(
@@ -55,6 +124,24 @@ export const updateTask = async (taskId, task) => {
     }
 };
 
+// Sends only the changed fields
+export const patchTask = async (taskId, changes) => {
+    try {
+        const response = await api.patch(
+            `/tasks/${taskId}`,
+            changes,
+            {
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+            }
+        );
+        return response.data;
+    } catch (error) {
+        console.error('Error patching task', error);
+    }
+};
+
 export const deleteTask = async (taskId) => {
     try {
         const response = await api.delete(`/tasks/${taskId}`);
@@ -63,3 +150,21 @@ export const deleteTask = async (taskId) => {
         console.error('Error deleting task', error);
     }
 };
+
+// operations: { create: [task], update: [{ id, ...fields }], delete: [id], fetch: [id] }
+export const bulkTasks = async (operations) => {
+    try {
+        const response = await api.post(
+            '/tasks/bulk',
+            operations,
+            {
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+            }
+        );
+        return response.data;
+    } catch (error) {
+        console.error('Error running bulk task operations', error);
+    }
+};
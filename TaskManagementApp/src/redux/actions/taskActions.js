@@ -3,7 +3,9 @@ import {
     getTask as fetchTaskFromApi, 
     createTask as createTaskApi, 
     updateTask as updateTaskApi, 
-    deleteTask as deleteTaskApi 
+    deleteTask as deleteTaskApi,
+    getTaskChanges as fetchTaskChangesFromApi,
+    subscribeTaskEvents
 } from '../../api/taskApi'; 
 
 
@@ -23,6 +25,43 @@ export const fetchTasks = () => {
 };
 
 
+// Brings the store up to date with only what changed since the last sync
+export const syncTasks = () => {
+    return async (dispatch, getState) => {
+        try {
+            let since = getState().tasks.syncToken;
+            let hasMore = true;
+            while (hasMore) {
+                const changes = await fetchTaskChangesFromApi(since);
+                if (!changes) {
+                    return;
+                }
+                dispatch({
+                    type: 'APPLY_TASK_CHANGES',
+                    payload: { ...changes, reset: changes.reset || !since },
+                });
+                since = changes.next_token;
+                hasMore = changes.has_more;
+            }
+        } catch (error) {
+            console.error('Error syncing tasks', error);
+        }
+    };
+};
+
+// Syncs whenever the server reports a change instead of polling. Events
+// missed while disconnected are replayed on reconnect, or a resync is asked
+// for when there were too many.
+export const watchTaskEvents = () => {
+    return async (dispatch) => {
+        try {
+            return await subscribeTaskEvents(() => dispatch(syncTasks()));
+        } catch (error) {
+            console.error('Error subscribing to task events', error);
+        }
+    };
+};
+
 export const fetchTask = (taskId) => {
     return async (dispatch) => {
         try {
@@ -3,6 +3,7 @@ import { ADD_TASK, REMOVE_TASK, UPDATE_TASK, SET_TASKS, SET_TASK, DELETE_TASK }
 const initialState = {
     tasks: [],
     currentTask: null,
+    syncToken: null,
 };
 
 const taskReducer = (state = initialState, action) => {
@@ -13,6 +14,19 @@ const taskReducer = (state = initialState, action) => {
                 ...state,
                 tasks: action.payload, 
             };
+        case 'APPLY_TASK_CHANGES': {
+            const { changed, deleted, next_token, reset } = action.payload;
+            const changedIds = new Set(changed.map(task => task.id));
+            const deletedIds = new Set(deleted);
+            const kept = reset ? [] : state.tasks.filter(
+                task => !deletedIds.has(task.id) && !changedIds.has(task.id)
+            );
+            return {
+                ...state,
+                tasks: [...kept, ...changed],
+                syncToken: next_token,
+            };
+        }
         case SET_TASK:
             return {
                 ...state,
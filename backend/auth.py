@@ -1,11 +1,15 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from . import models
-from .dependencies import get_db
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import get_history
+from . import models, crud
+from .cache import PrincipalCache
+from .hashing import PasswordHasher
+from .dependencies import get_db, get_runner
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from typing import Union
+from typing import Optional, Tuple, Union
 import os
 from passlib.context import CryptContext
 from dotenv import load_dotenv
@@ -14,10 +18,30 @@ load_dotenv()
 
 ALGORITHM = os.getenv("ALGORITHM")
 SECRET_KEY = os.getenv("SECRET_KEY")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Put the user id in issued tokens so a principal cache miss is a primary key lookup
+TOKEN_INCLUDE_USER_ID = os.getenv("TOKEN_INCLUDE_USER_ID", "true").lower() in ("1", "true", "yes")
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+PRINCIPAL_FIELDS = ("id", "email", "full_name", "is_active")
+
+# bcrypt work factor. Hashes made with any other cost are rehashed on the
+# next successful login, so the cost can be moved either way without an outage.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+password_hasher = PasswordHasher(pwd_context, workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+principal_cache = PrincipalCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -37,20 +61,89 @@ def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
-    credentials_exception = HTTPException(
+def token_claims(user: models.User) -> dict:
+    claims = {"sub": user.email}
+    if TOKEN_INCLUDE_USER_ID:
+        claims["uid"] = user.id
+    return claims
+
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _decode_token(token: str) -> Tuple[str, Optional[int]]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        user = db.query(models.User).filter(models.User.email == email).first()
-        if user is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    email: str = payload.get("sub")
+    if email is None:
+        raise _credentials_exception()
+    user_id = payload.get("uid")
+    return email, user_id if isinstance(user_id, int) else None
+
+# Cached principals are detached User instances rebuilt from a few columns;
+# they carry identity and profile fields only, not relationships.
+def _principal(values: dict) -> models.User:
+    if values["is_active"] is False:
+        raise _credentials_exception()
+    user = models.User(**values)
+    make_transient_to_detached(user)
     return user
+
+def _load_principal(db: Session, email: str, user_id: Optional[int]) -> models.User:
+    if user_id is not None:
+        user = crud.get_user(db, user_id)
+        if user is not None and user.email != email:
+            user = None
+    else:
+        user = crud.get_user_by_email(db, email)
+    if user is None:
+        raise _credentials_exception()
+    values = {field: getattr(user, field) for field in PRINCIPAL_FIELDS}
+    principal_cache.put(email, values)
+    return _principal(values)
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
+    email, user_id = _decode_token(token)
+    values = principal_cache.get(email)
+    if values is not None:
+        return _principal(values)
+    return _load_principal(db, email, user_id)
+
+# Route dependency: a cache hit is answered on the event loop without touching
+# the database; only misses go through the configured database mode.
+async def current_user(token: str = Depends(oauth2_scheme), db=Depends(get_runner)) -> models.User:
+    return await user_from_token(token, db)
+
+# Also used by WebSocket routes, which take the token as a query parameter
+async def user_from_token(token: str, db) -> models.User:
+    email, user_id = _decode_token(token)
+    values = principal_cache.get(email)
+    if values is not None:
+        return _principal(values)
+    return await db.run(_load_principal, email, user_id)
+
+# Drop cached principals whenever a user row changes through the ORM: once at
+# flush and again after commit, so a concurrent miss that re-read the old row
+# before the commit doesn't survive it.
+def _invalidate_user(mapper, connection, target: models.User):
+    emails = {target.email, *get_history(target, "email").deleted}
+    for email in emails:
+        if email:
+            principal_cache.invalidate(email)
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("invalidated_principals", set()).update(emails)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session):
+    for email in session.info.pop("invalidated_principals", ()):
+        if email:
+            principal_cache.invalidate(email)
+
+event.listen(models.User, "after_update", _invalidate_user)
+event.listen(models.User, "after_delete", _invalidate_user)
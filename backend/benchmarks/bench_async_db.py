@@ -0,0 +1,77 @@
+# Concurrent request throughput on GET /api/v1/tasks with the blocking engine
+# (queries run in Starlette's threadpool) and with DB_ASYNC=1 (async engine).
+# Each mode runs in its own process because the mode is fixed at import time.
+#
+#   python -m backend.benchmarks.bench_async_db --requests 2000 --concurrency 200
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import date
+
+
+async def _drive(app, token, requests, concurrency):
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                response = await client.get("/api/v1/tasks", headers=headers, params={"limit": 20})
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - start
+
+
+def run_mode(args):
+    from backend.benchmarks.common import create_user
+
+    from sqlalchemy import insert
+
+    from backend import database, models
+    from backend.main import app
+
+    # ASGITransport doesn't run the app's lifespan, which creates the schema
+    database.create_schema(models.Base.metadata)
+    owner_id, token = create_user(database.SessionLocal)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Task), [
+            {"title": f"Task {i}", "description": "Benchmark task", "owner_id": owner_id,
+             "status": models.TaskStatus.pending, "due_date": date(2024, 8, 21)}
+            for i in range(200)
+        ])
+    elapsed = asyncio.run(_drive(app, token, args.requests, args.concurrency))
+    print(json.dumps({"elapsed": elapsed, "rps": args.requests / elapsed}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_mode(args)
+        return
+
+    print(f"{'mode':>6} {'req/s':>10} {'seconds':>9}")
+    for mode in ("sync", "async"):
+        env = dict(os.environ, DB_ASYNC="1" if mode == "async" else "0")
+        output = subprocess.run(
+            [sys.executable, "-m", "backend.benchmarks.bench_async_db", "--worker",
+             "--requests", str(args.requests), "--concurrency", str(args.concurrency)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>6} {result['rps']:>10.1f} {result['elapsed']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
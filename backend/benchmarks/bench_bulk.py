@@ -0,0 +1,64 @@
+# Tasks per second through the single-item routes vs /api/v1/tasks/bulk, for
+# creating and then deleting the same number of tasks.
+#
+#   python -m backend.benchmarks.bench_bulk --tasks 2000 --batch 500
+import argparse
+import time
+
+from backend.benchmarks.common import bench_database, create_user, use_database
+
+from fastapi.testclient import TestClient
+
+from backend.main import app
+
+TASK = {"title": "Benchmark task", "description": "Benchmark task", "status": "pending", "due_date": "2024-08-21"}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+
+    engine, SessionLocal = bench_database("bulk")
+    _, token = create_user(SessionLocal)
+    use_database(app, SessionLocal)
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def timed(fn):
+        start = time.perf_counter()
+        result = fn()
+        return result, args.tasks / (time.perf_counter() - start)
+
+    def single_create():
+        return [client.post("/api/v1/tasks", headers=headers, json=TASK).json()["id"] for _ in range(args.tasks)]
+
+    def single_delete(ids):
+        for task_id in ids:
+            client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+
+    def bulk_create():
+        ids = []
+        for start in range(0, args.tasks, args.batch):
+            count = min(args.batch, args.tasks - start)
+            response = client.post("/api/v1/tasks/bulk", headers=headers, json={"create": [TASK] * count})
+            ids.extend(item["id"] for item in response.json()["created"])
+        return ids
+
+    def bulk_delete(ids):
+        for start in range(0, len(ids), args.batch):
+            client.post("/api/v1/tasks/bulk", headers=headers, json={"delete": ids[start:start + args.batch]})
+
+    ids, single_create_rate = timed(single_create)
+    _, single_delete_rate = timed(lambda: single_delete(ids))
+    ids, bulk_create_rate = timed(bulk_create)
+    _, bulk_delete_rate = timed(lambda: bulk_delete(ids))
+
+    print(f"{'route':>8} {'create/s':>10} {'delete/s':>10}")
+    print(f"{'single':>8} {single_create_rate:>10.0f} {single_delete_rate:>10.0f}")
+    print(f"{'bulk':>8} {bulk_create_rate:>10.0f} {bulk_delete_rate:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Export throughput per format and chunk size. Each chunk is one fetch of
+# yield_per rows and one body message, so small chunks cost round trips and
+# large ones cost memory.
+#
+#   python -m backend.benchmarks.bench_export --rows 100000
+import argparse
+from datetime import date
+
+from backend.benchmarks.common import bench_database, create_user, median_ms, use_database
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+from backend import export, models
+from backend.main import app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine, SessionLocal = bench_database("export")
+    owner_id, token = create_user(SessionLocal)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Task), [
+            {"title": f"Task {i}", "description": "Benchmark task with a typical description", "owner_id": owner_id,
+             "status": models.TaskStatus.pending, "due_date": date(2024, 8, 21)}
+            for i in range(args.rows)
+        ])
+
+    use_database(app, SessionLocal)
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {token}"}
+    print(f"{args.rows} rows")
+    print(f"{'format':>8} {'chunk':>7} {'ms':>10} {'rows/s':>12}")
+    for export_format in export.FORMATS:
+        for chunk_size in (100, 1000, 10000):
+            export.CHUNK_SIZE = chunk_size
+            ms = median_ms(
+                lambda: client.get("/api/v1/tasks/export", headers=headers, params={"format": export_format}),
+                args.repeat,
+            )
+            print(f"{export_format:>8} {chunk_size:>7} {ms:>10.1f} {args.rows / ms * 1000:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
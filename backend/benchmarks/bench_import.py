@@ -0,0 +1,51 @@
+# Import throughput in rows/s: one POST /tasks per row against an NDJSON
+# upload imported in chunks of various sizes. The test client runs the
+# background import before returning, so each timing covers the whole job.
+#
+#   python -m backend.benchmarks.bench_import --rows 50000
+import argparse
+import json
+import time
+
+from backend.benchmarks.common import bench_database, create_user, use_database
+
+from fastapi.testclient import TestClient
+
+from backend import imports
+from backend.main import app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--single-rows", type=int, default=500)
+    args = parser.parse_args()
+
+    engine, SessionLocal = bench_database("import")
+    _, token = create_user(SessionLocal)
+    use_database(app, SessionLocal)
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {token}"}
+    task = {"title": "Imported task", "description": "Benchmark task with a typical description",
+            "status": "pending", "due_date": "2024-08-21"}
+    body = b"".join(json.dumps(dict(task, title=f"Task {i}")).encode() + b"\n" for i in range(args.rows))
+
+    print(f"{'method':>16} {'rows':>8} {'seconds':>9} {'rows/s':>10}")
+    start = time.perf_counter()
+    for _ in range(args.single_rows):
+        client.post("/api/v1/tasks", headers=headers, json=task)
+    seconds = time.perf_counter() - start
+    print(f"{'POST /tasks':>16} {args.single_rows:>8} {seconds:>9.2f} {args.single_rows / seconds:>10.0f}")
+
+    for chunk_size in (100, 1000, 5000):
+        imports.CHUNK_SIZE = chunk_size
+        start = time.perf_counter()
+        response = client.post("/api/v1/tasks/import", headers=headers, content=body)
+        job = client.get(response.headers["location"], headers=headers).json()
+        seconds = time.perf_counter() - start
+        assert job["inserted"] == args.rows, job
+        print(f"{f'import/{chunk_size}':>16} {args.rows:>8} {seconds:>9.2f} {args.rows / seconds:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Page latency of offset vs keyset paging on GET /api/v1/tasks as the
+# requested page gets deeper. Keyset pages should stay flat.
+#
+#   python -m backend.benchmarks.bench_pagination --tasks 100000
+import argparse
+from datetime import date
+
+from backend.benchmarks.common import bench_database, create_user, median_ms, use_database
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+
+from backend import models
+from backend.main import app
+from backend.pagination import encode_cursor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine, SessionLocal = bench_database("pagination")
+    owner_id, token = create_user(SessionLocal)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Task), [
+            {"title": f"Task {i}", "description": "Benchmark task", "owner_id": owner_id,
+             "status": models.TaskStatus.pending, "due_date": date(2024, 8, 21)}
+            for i in range(args.tasks)
+        ])
+        ids = conn.execute(select(models.Task.id).order_by(models.Task.id)).scalars().all()
+
+    use_database(app, SessionLocal)
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    print(f"{'depth':>8} {'offset ms':>10} {'keyset ms':>10}")
+    for fraction in (0.0, 0.25, 0.5, 0.75, 0.99):
+        skip = int(args.tasks * fraction)
+        cursor = encode_cursor({"id": ids[skip - 1]}) if skip else ""
+        offset_ms = median_ms(
+            lambda: client.get("/api/v1/tasks", headers=headers, params={"skip": skip, "limit": args.limit}),
+            args.repeat,
+        )
+        keyset_ms = median_ms(
+            lambda: client.get("/api/v1/tasks", headers=headers, params={"cursor": cursor, "limit": args.limit}),
+            args.repeat,
+        )
+        print(f"{skip:>8} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
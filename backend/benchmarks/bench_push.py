@@ -0,0 +1,65 @@
+# Push throughput against a simulated FCM with a fixed round trip per
+# request: the old one-device-per-call loop against the dispatcher, and how
+# long the caller is held up in each case.
+#
+#   python -m backend.benchmarks.bench_push --tokens 2000 --rtt-ms 50
+import argparse
+import asyncio
+import time
+
+from backend.notifications import SENT, PushDispatcher
+
+
+class SimulatedFCM:
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+
+    def notify_single_device(self, token: str, message: str):
+        time.sleep(self.rtt)
+
+    # One request per token, as with FCM HTTP v1, all in flight at once
+    async def send(self, tokens, message):
+        await asyncio.gather(*(asyncio.sleep(self.rtt) for _ in tokens))
+        return {token: SENT for token in tokens}
+
+
+def serial(fcm, tokens):
+    start = time.perf_counter()
+    for token in tokens:
+        fcm.notify_single_device(token, "due soon")
+    return time.perf_counter() - start, time.perf_counter() - start
+
+
+async def dispatched(fcm, tokens):
+    dispatcher = PushDispatcher(fcm, queue_size=len(tokens))
+    start = time.perf_counter()
+    for token in tokens:
+        dispatcher.submit(token, "due soon")
+    submitted = time.perf_counter() - start
+    await dispatcher.join()
+    seconds = time.perf_counter() - start
+    await dispatcher.stop()
+    return submitted, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--rtt-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    fcm = SimulatedFCM(args.rtt_ms / 1000)
+    tokens = [f"token {i}" for i in range(args.tokens)]
+    print(f"{args.tokens} tokens, {args.rtt_ms:.0f} ms per FCM request")
+    print(f"{'':>10} {'caller ms':>10} {'total s':>9} {'pushes/s':>10}")
+    # The serial loop is too slow to run in full; time a slice and scale up
+    sample = tokens[: max(1, min(len(tokens), int(2 / fcm.rtt)))]
+    blocked, seconds = serial(fcm, sample)
+    scale = len(tokens) / len(sample)
+    print(f"{'serial':>10} {blocked * scale * 1000:>10.0f} {seconds * scale:>9.2f} {len(sample) / seconds:>10.0f}")
+    submitted, seconds = asyncio.run(dispatched(fcm, tokens))
+    print(f"{'dispatcher':>10} {submitted * 1000:>10.2f} {seconds:>9.2f} {len(tokens) / seconds:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
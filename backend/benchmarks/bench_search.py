@@ -0,0 +1,72 @@
+# Latency of GET /api/v1/tasks/search against the LIKE '%term%' scan it
+# replaces, for rare and common terms. Ranking needs every match, so the LIKE
+# side reads all matching rows too.
+#
+#   python -m backend.benchmarks.bench_search --tasks 1000000
+import argparse
+import random
+from datetime import date
+
+from backend.benchmarks.common import bench_database, create_user, median_ms, use_database
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, or_, select
+
+from backend import models
+from backend.main import app
+
+WORDS = [f"word{i}" for i in range(5000)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=200_000)
+    parser.add_argument("--owners", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine, SessionLocal = bench_database("search")
+    owner_id, token = create_user(SessionLocal)
+    others = [create_user(SessionLocal, f"bench{i}@example.com")[0] for i in range(args.owners - 1)]
+    owners = [owner_id] + others
+    rng = random.Random(0)
+    # Word frequency is skewed so low-numbered words are common
+    pick = lambda: WORDS[min(int(rng.expovariate(1 / 300)), len(WORDS) - 1)]
+    batch = 10_000
+    with engine.begin() as conn:
+        for start in range(0, args.tasks, batch):
+            conn.execute(insert(models.Task), [
+                {"title": " ".join(pick() for _ in range(4)), "description": " ".join(pick() for _ in range(12)),
+                 "owner_id": owners[i % len(owners)], "status": models.TaskStatus.pending, "due_date": date(2024, 8, 21)}
+                for i in range(start, min(start + batch, args.tasks))
+            ])
+
+    use_database(app, SessionLocal)
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    print(f"{'term':>10} {'fts ms':>10} {'like ms':>10}")
+    for term in ("word0", "word50", "word900", "word3000"):
+        fts_ms = median_ms(
+            lambda: client.get("/api/v1/tasks/search", headers=headers, params={"q": term, "limit": 20}),
+            args.repeat,
+        )
+
+        def like_scan():
+            db = SessionLocal()
+            try:
+                pattern = f"%{term}%"
+                db.scalars(
+                    select(models.Task)
+                    .where(models.Task.owner_id == owner_id,
+                           or_(models.Task.title.like(pattern), models.Task.description.like(pattern)))
+                ).all()
+            finally:
+                db.close()
+
+        like_ms = median_ms(like_scan, args.repeat)
+        print(f"{term:>10} {fts_ms:>10.2f} {like_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
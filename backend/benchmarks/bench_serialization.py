@@ -0,0 +1,72 @@
+# Per-row cost of building a task listing response: ORM objects validated
+# against response_model and encoded the way FastAPI does it, against plain
+# column rows encoded directly (FAST_JSON), plus end-to-end page latency.
+#
+#   python -m backend.benchmarks.bench_serialization --rows 500
+import argparse
+import asyncio
+from datetime import date
+from typing import List
+
+from backend.benchmarks.common import bench_database, create_user, median_ms, use_database
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.testclient import TestClient
+from fastapi.utils import create_response_field
+from sqlalchemy import insert
+
+from backend import crud, models, schemas, serialization
+from backend import main as backend_main
+from backend.main import app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    engine, SessionLocal = bench_database("serialization")
+    owner_id, token = create_user(SessionLocal)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Task), [
+            {"title": f"Task {i}", "description": "Benchmark task with a typical description", "owner_id": owner_id,
+             "status": models.TaskStatus.pending, "due_date": date(2024, 8, 21)}
+            for i in range(args.rows)
+        ])
+
+    params = schemas.TaskListParams()
+    field = create_response_field(name="Response_read_tasks", type_=List[schemas.Task], mode="serialization")
+
+    def response_model_path():
+        with SessionLocal() as db:
+            tasks = crud.list_tasks(db, owner_id, params, 0, args.rows)
+        content = asyncio.run(serialize_response(field=field, response_content=tasks))
+        return JSONResponse(content).body
+
+    def fast_path():
+        with SessionLocal() as db:
+            rows = crud.list_task_rows(db, owner_id, params, 0, args.rows)
+        return serialization.dumps(serialization.task_rows(rows))
+
+    assert response_model_path() == fast_path()
+    encoder = "orjson" if serialization.orjson is not None else "pydantic-core"
+    print(f"{args.rows} rows, fast path encoder: {encoder}")
+    print(f"{'path':>16} {'page ms':>10} {'us/row':>10}")
+    for name, fn in (("response_model", response_model_path), ("fast json", fast_path)):
+        ms = median_ms(fn, args.repeat)
+        print(f"{name:>16} {ms:>10.2f} {ms * 1000 / args.rows:>10.2f}")
+
+    use_database(app, SessionLocal)
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {token}"}
+    print(f"{'GET /tasks':>16} {'page ms':>10}")
+    for name, fast in (("response_model", False), ("fast json", True)):
+        backend_main.FAST_JSON = fast
+        ms = median_ms(lambda: client.get("/api/v1/tasks", headers=headers, params={"limit": args.rows}), args.repeat)
+        print(f"{name:>16} {ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
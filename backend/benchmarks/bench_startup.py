@@ -0,0 +1,76 @@
+# Time from launching a worker until it has served its first request:
+# uvicorn is started in a fresh process and polled until GET /metrics
+# answers. With DB_CREATE_SCHEMA the lifespan checks the database and creates
+# the tables first; without it the worker doesn't touch the database at all
+# before its first request.
+#
+#   python -m backend.benchmarks.bench_startup --runs 5
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def first_request_seconds(env: dict) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("server exited before serving a request")
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                conn.request("GET", "/metrics")
+                if conn.getresponse().status == 200:
+                    return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def import_seconds(env: dict) -> float:
+    script = "import time; start = time.perf_counter(); import backend.main; print(time.perf_counter() - start)"
+    return float(subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True).stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="task-bench-")
+    base = dict(os.environ, SECRET_KEY="benchmark-secret", ALGORITHM="HS256")
+    print(f"{'':>24} {'median ms':>10} {'min ms':>8}")
+    cases = [
+        ("import backend.main", import_seconds, {}),
+        ("first request, schema", first_request_seconds, {"DB_CREATE_SCHEMA": "true"}),
+        ("first request, no schema", first_request_seconds, {"DB_CREATE_SCHEMA": "false"}),
+    ]
+    for name, measure, extra in cases:
+        samples = []
+        for run in range(args.runs):
+            # A new database each run, so the schema case creates the tables
+            url = f"sqlite:///{directory}/{name.replace(' ', '_').replace(',', '')}_{run}.db"
+            samples.append(measure(dict(base, DATABASE_URL=url, **extra)) * 1000)
+        print(f"{name:>24} {statistics.median(samples):>10.0f} {min(samples):>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
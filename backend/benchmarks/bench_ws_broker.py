@@ -0,0 +1,80 @@
+# Cross-worker fan-out through the Redis broker: several managers (one per
+# simulated worker) on a shared in-memory Redis stand-in, clients spread over
+# them, broadcasts from one worker. Shows how batching cuts the number of
+# PUBLISH round trips and the time until every client has every message.
+# Pass --redis-url to run against a real server instead.
+#
+#   python -m backend.benchmarks.bench_ws_broker --workers 4 --clients 10000
+import argparse
+import asyncio
+import time
+
+from backend.broker import RedisBroker
+from backend.connections import ConnectionManager
+
+
+class SimulatedClient:
+    def __init__(self):
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.received += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def redis_client(args, server):
+    if args.redis_url:
+        from redis import asyncio as redis
+
+        return redis.from_url(args.redis_url)
+    import fakeredis
+
+    return fakeredis.aioredis.FakeRedis(server=server)
+
+
+async def run(args, batch_size: int):
+    server = None if args.redis_url else __import__("fakeredis").FakeServer()
+    brokers = [RedisBroker(redis_client(args, server), channel="bench:fanout", batch_size=batch_size)
+               for _ in range(args.workers)]
+    managers = [ConnectionManager(queue_size=args.messages, broker=broker, max_connections=args.clients) for broker in brokers]
+    clients = [SimulatedClient() for _ in range(args.clients)]
+    for i, client in enumerate(clients):
+        await managers[i % args.workers].connect(client, user_id=i)
+
+    start = time.perf_counter()
+    for i in range(args.messages):
+        await managers[0].broadcast(f"message {i}")
+    while any(client.received < args.messages for client in clients):
+        await asyncio.sleep(0.001)
+    seconds = time.perf_counter() - start
+
+    for manager in managers:
+        await manager.stop()
+    batches = brokers[0].stats()["batches"]
+    for broker in brokers:
+        await broker.close()
+    return seconds, batches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=10_000)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--redis-url", default="")
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers, {args.clients} clients, {args.messages} broadcasts")
+    print(f"{'batch size':>10} {'publishes':>10} {'seconds':>9} {'deliveries/s':>14}")
+    for batch_size in (1, 50, 200):
+        seconds, batches = asyncio.run(run(args, batch_size))
+        print(f"{batch_size:>10} {batches:>10} {seconds:>9.2f} {args.clients * args.messages / seconds:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Fan-out latency to simulated WebSocket clients: the time from a broadcast
+# until each client has the message, with a few stalled clients among them.
+# "serial" is the old broadcast that awaited every send in turn. Also times a
+# send to one user's sockets and a connect/disconnect cycle at that scale.
+#
+#   python -m backend.benchmarks.bench_ws_fanout --clients 10000 --stalled 10
+import argparse
+import asyncio
+import statistics
+import time
+
+from backend.connections import ConnectionManager
+
+
+class SimulatedClient:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.latencies = []
+        self.sent_at = 0.0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            await asyncio.sleep(0)
+        self.latencies.append(time.perf_counter() - self.sent_at)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def report(name: str, clients):
+    latencies = sorted(latency * 1000 for client in clients if not client.delay for latency in client.latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{name:>12} {statistics.median(latencies):>10.2f} {p99:>10.2f} {latencies[-1]:>10.2f}")
+
+
+async def serial(clients, messages: int):
+    for _ in range(messages):
+        for client in clients:
+            client.sent_at = time.perf_counter()
+        for client in clients:
+            await client.send_text("message")
+
+
+async def queued(clients, messages: int, policy: str):
+    manager = ConnectionManager(queue_size=64, policy=policy, max_connections=len(clients))
+    for client in clients:
+        await manager.connect(client)
+    for _ in range(messages):
+        now = time.perf_counter()
+        for client in clients:
+            client.sent_at = now
+        await manager.broadcast("message")
+        # Let the writers run before the next message
+        while any(connection.queue.qsize() for websocket, connection in manager.active_connections.items() if not websocket.delay):
+            await asyncio.sleep(0)
+    for client in clients:
+        manager.disconnect(client)
+
+
+async def targeted(clients):
+    manager = ConnectionManager(max_connections=len(clients) + 1)
+    for i, client in enumerate(clients):
+        await manager.connect(client, user_id=i // 2, rooms=[f"room {i // 100}"])
+    rounds = 1000
+    start = time.perf_counter()
+    for i in range(rounds):
+        await manager.send_to_user(i, "message")
+    user_us = (time.perf_counter() - start) / rounds * 1e6
+    start = time.perf_counter()
+    for i in range(rounds):
+        await manager.send_to_room(f"room {i % 100}", "message")
+    room_us = (time.perf_counter() - start) / rounds * 1e6
+    extra = SimulatedClient(0)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await manager.connect(extra, user_id=0, rooms=["room 0"])
+        manager.disconnect(extra)
+    cycle_us = (time.perf_counter() - start) / rounds * 1e6
+    for client in clients:
+        manager.disconnect(client)
+    print(f"send_to_user (2 sockets) {user_us:.1f} us, send_to_room (100 sockets) {room_us:.1f} us, "
+          f"connect+disconnect {cycle_us:.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=10_000)
+    parser.add_argument("--stalled", type=int, default=10)
+    parser.add_argument("--stall-ms", type=float, default=200)
+    parser.add_argument("--messages", type=int, default=5)
+    args = parser.parse_args()
+
+    def make_clients():
+        return [SimulatedClient(args.stall_ms / 1000 if i < args.stalled else 0) for i in range(args.clients)]
+
+    print(f"{args.clients} clients, {args.stalled} stalled for {args.stall_ms:.0f} ms, {args.messages} messages")
+    print(f"{'fan-out':>12} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    clients = make_clients()
+    asyncio.run(serial(clients, args.messages))
+    report("serial", clients)
+    for policy in ("drop_oldest", "disconnect"):
+        clients = make_clients()
+        asyncio.run(queued(clients, args.messages, policy))
+        report(policy, clients)
+    asyncio.run(targeted(make_clients()))
+
+
+if __name__ == "__main__":
+    main()
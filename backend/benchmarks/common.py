@@ -0,0 +1,60 @@
+import os
+import statistics
+import tempfile
+import time
+
+# The backend reads its settings from the environment at import time, so give
+# the benchmarks throwaway defaults before anything from backend is imported.
+_BENCH_DIR = tempfile.mkdtemp(prefix="task-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_BENCH_DIR}/app.db")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+os.environ.setdefault("FIREBASE_SERVICE_ACCOUNT_FILE", f"{_BENCH_DIR}/firebase.json")
+os.environ.setdefault("FIREBASE_PROJECT_ID", "benchmark")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from backend import models  # noqa: E402
+from backend.auth import create_access_token  # noqa: E402
+from backend.database import Base  # noqa: E402
+from backend.dependencies import get_db  # noqa: E402
+
+
+def bench_database(name: str):
+    engine = create_engine(f"sqlite:///{_BENCH_DIR}/{name}.db")
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+
+def use_database(app, SessionLocal):
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+
+
+def create_user(SessionLocal, email: str = "bench@example.com"):
+    db = SessionLocal()
+    try:
+        user = models.User(email=email, hashed_password="x", full_name="Bench User")
+        db.add(user)
+        db.commit()
+        return user.id, create_access_token(data={"sub": email})
+    finally:
+        db.close()
+
+
+def median_ms(fn, repeat: int = 20) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+from typing import Callable, Dict, List, Optional
+
+# Fan-out between worker processes. Every ConnectionManager delivers to its
+# own sockets directly and hands the same message to its broker, which
+# carries it to the managers of the other workers; each delivers to the
+# sockets it has. A manager subscribes with an origin id and never gets its
+# own messages back.
+#
+# Envelopes are small dicts naming the recipients ("all", a user or a room)
+# and the message text.
+
+WS_BROKER_URL = os.getenv("WS_BROKER_URL", "")
+WS_BROKER_CHANNEL = os.getenv("WS_BROKER_CHANNEL", "ws:fanout")
+# Messages published within this many seconds of each other go to the other
+# workers as one batch
+WS_BROKER_BATCH_DELAY = float(os.getenv("WS_BROKER_BATCH_DELAY", "0.005"))
+WS_BROKER_BATCH_SIZE = int(os.getenv("WS_BROKER_BATCH_SIZE", "200"))
+
+Deliver = Callable[[List[dict]], None]
+
+# Managers in the same process, e.g. several apps in one test or benchmark
+class InProcessBroker:
+    def __init__(self):
+        self._subscribers: Dict[str, Deliver] = {}
+        self.published = 0
+
+    async def subscribe(self, origin: str, deliver: Deliver):
+        self._subscribers[origin] = deliver
+
+    async def unsubscribe(self, origin: str):
+        self._subscribers.pop(origin, None)
+
+    async def publish(self, origin: str, envelope: dict):
+        self.published += 1
+        for subscriber, deliver in list(self._subscribers.items()):
+            if subscriber != origin:
+                deliver([envelope])
+
+    async def close(self):
+        self._subscribers.clear()
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self._subscribers), "published": self.published}
+
+# Workers connected through a Redis (or Redis-compatible) server's pub/sub.
+# One broker per manager: it publishes batches tagged with the manager's
+# origin and skips its own when they come back.
+class RedisBroker:
+    def __init__(self, client, channel: str = WS_BROKER_CHANNEL,
+                 batch_delay: float = WS_BROKER_BATCH_DELAY, batch_size: int = WS_BROKER_BATCH_SIZE):
+        self.client = client
+        self.channel = channel
+        self.batch_delay = batch_delay
+        self.batch_size = batch_size
+        self._origin = None
+        self._pubsub = None
+        self._reader = None
+        self._pending: List[dict] = []
+        self._flusher = None
+        # Held while a batch is taken and published, so batches go out in
+        # the order their messages were published
+        self._flushing = asyncio.Lock()
+        self.published = 0
+        self.batches = 0
+        self.received = 0
+        self.errors = 0
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs):
+        from redis import asyncio as redis
+
+        return cls(redis.from_url(url), **kwargs)
+
+    async def subscribe(self, origin: str, deliver: Deliver):
+        self._origin = origin
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        self._reader = asyncio.create_task(self._read(deliver))
+
+    async def unsubscribe(self, origin: str):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def _read(self, deliver: Deliver):
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Redis went away; redis-py reconnects and resubscribes on the
+                # next read
+                self.errors += 1
+                await asyncio.sleep(1.0)
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            try:
+                batch = json.loads(message["data"])
+                if batch["origin"] == self._origin:
+                    continue
+                self.received += len(batch["messages"])
+                deliver(batch["messages"])
+            except Exception:
+                # A malformed batch or a failed delivery loses that batch,
+                # not the subscription
+                self.errors += 1
+
+    async def publish(self, origin: str, envelope: dict):
+        self._pending.append(envelope)
+        self.published += 1
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+        elif self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.batch_delay)
+        self._flusher = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._flushing:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            self.batches += 1
+            try:
+                await self.client.publish(self.channel, json.dumps({"origin": self._origin, "messages": batch}))
+            except Exception:
+                # Other workers miss this batch; their clients catch up on reconnect
+                self.errors += 1
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+        await self.unsubscribe(self._origin)
+        await self.client.aclose()
+
+    def stats(self) -> dict:
+        return {"published": self.published, "batches": self.batches, "received": self.received, "errors": self.errors}
+
+_in_process: Dict[str, InProcessBroker] = {}
+
+# No URL: a single worker and no broker. "memory://": managers in this
+# process share one broker per channel. "redis://..." (or rediss://,
+# unix://): a broker shared by every worker connected to that server.
+# Managers that serve different kinds of sockets need different channels.
+def broker_from_url(url: Optional[str] = WS_BROKER_URL, channel: str = WS_BROKER_CHANNEL):
+    if not url:
+        return None
+    if url == "memory://":
+        return _in_process.setdefault(channel, InProcessBroker())
+    return RedisBroker.from_url(url, channel=channel)
@@ -0,0 +1,46 @@
+import threading
+from typing import Optional
+from cachetools import TTLCache
+
+# Bounded LRU + TTL cache of authenticated principals keyed by token subject.
+# Each worker process has its own copy, so the TTL is the upper bound on how
+# long another process can keep serving a changed user.
+class PrincipalCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self._lock = threading.Lock()
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, subject: str) -> Optional[dict]:
+        with self._lock:
+            values = self._entries.get(subject)
+            if values is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return values
+
+    def put(self, subject: str, values: dict):
+        with self._lock:
+            self._entries[subject] = values
+
+    def invalidate(self, subject: str):
+        with self._lock:
+            if self._entries.pop(subject, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": int(self._entries.maxsize),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
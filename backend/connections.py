@@ -1,20 +1,342 @@
+import asyncio
+import json
+import os
+import uuid
+from typing import Dict, Iterable, Optional, Set
 from fastapi import WebSocket
-from typing import List
+from .replay import WS_REPLAY_BYTES, WS_REPLAY_MESSAGES, ReplayBuffer
 
+# Messages waiting to be written to one client
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# What to do when a client's queue is full: "drop_oldest" keeps the client and
+# loses its oldest undelivered message, "disconnect" closes the client.
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "disconnect")
+# 1013 "Try Again Later"; the client should reconnect and resync
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# Heartbeat: every interval the server sends PING to each socket, and closes
+# sockets it hasn't heard anything from (a PONG or any other message) within
+# the idle timeout. That's how half-open connections get noticed.
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))
+PING = json.dumps({"type": "ping"})
+IDLE_CLOSE_CODE = 1001
+
+# Admission limits, per worker; connections beyond them are accepted and
+# closed right away with REJECTED_CLOSE_CODE so the client sees why
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+WS_MAX_CONNECTIONS_PER_USER = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", "10"))
+REJECTED_CLOSE_CODE = 1013
+
+# Clients that connect with a resume id get every message framed with the id
+# it has in the replay buffer:
+#
+#   {"type": "message", "id": "<epoch>:<seq>", "data": "<message>"}
+#
+# and, after anything replayed, a frame saying where they stand:
+#
+#   {"type": "replay", "id": ..., "replayed": 3}   the gap was sent above
+#   {"type": "resync", "id": ...}                  the gap is gone; refetch
+#
+# The epoch is the manager's origin, so ids from another worker or from
+# before a restart always mean resync.
+def _message_frame(message_id: str, message: str) -> str:
+    return json.dumps({"type": "message", "id": message_id, "data": message})
+
+def _is_pong(message: str) -> bool:
+    if not message.startswith("{") or "pong" not in message:
+        return False
+    try:
+        return json.loads(message).get("type") == "pong"
+    except (ValueError, AttributeError):
+        return False
+
+# Removes a member from an index entry, dropping the entry once it's empty
+def _discard(index: Dict, key, websocket: WebSocket):
+    members = index.get(key)
+    if members is not None:
+        members.discard(websocket)
+        if not members:
+            del index[key]
+
+class _Connection:
+    def __init__(self, websocket: WebSocket, queue_size: int, user_id: Optional[int], framed: bool = False):
+        self.websocket = websocket
+        self.framed = framed
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.writer = None
+        self.user_id = user_id
+        self.rooms: Set[str] = set()
+        self.last_seen = asyncio.get_running_loop().time()
+
+# Every connection has a bounded outbound queue drained by a writer task of
+# its own. Sending only enqueues, so a fan-out never waits on a socket and a
+# slow or failed client only affects itself.
+#
+# Connections are also indexed by user (a user may have several sockets open)
+# and by the rooms they joined, so a targeted send only touches its
+# recipients and joining, leaving or disconnecting costs the same however
+# many clients are connected.
+#
+# With a broker (see broker.py) every send also reaches the clients of the
+# other workers' managers.
+#
+# Every message sent is also kept for a while in a replay buffer (see
+# replay.py) so reconnecting clients can catch up.
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY, broker=None,
+                 ping_interval: float = WS_PING_INTERVAL, idle_timeout: float = WS_IDLE_TIMEOUT,
+                 max_connections: int = WS_MAX_CONNECTIONS, max_per_user: int = WS_MAX_CONNECTIONS_PER_USER,
+                 replay_messages: int = WS_REPLAY_MESSAGES, replay_bytes: int = WS_REPLAY_BYTES):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy '{policy}'")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.broker = broker
+        self.origin = uuid.uuid4().hex
+        self._subscribed = False
+        self._start_lock = asyncio.Lock()
+        self.active_connections: Dict[WebSocket, _Connection] = {}
+        self.user_connections: Dict[int, Set[WebSocket]] = {}
+        self.rooms: Dict[str, Set[WebSocket]] = {}
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        self._heartbeat = None
+        self.replay = ReplayBuffer(replay_messages, replay_bytes)
+        self._framed = 0
+        self._closing = set()
+        self.sent = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self.send_errors = 0
+        self.pings = 0
+        self.evicted = 0
+        self.rejected = 0
+        self.replayed = 0
+        self.resyncs = 0
 
-    async def connect(self, websocket: WebSocket):
+    # Starts the heartbeat and subscribes to the broker on first use
+    async def start(self):
+        # A heartbeat left on a loop that has since stopped never runs again
+        if self._heartbeat is None or self._heartbeat.get_loop() is not asyncio.get_running_loop():
+            self._heartbeat = asyncio.create_task(self._beat())
+        if self.broker is None or self._subscribed:
+            return
+        async with self._start_lock:
+            if not self._subscribed:
+                await self.broker.subscribe(self.origin, self._receive)
+                self._subscribed = True
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        if self._subscribed:
+            self._subscribed = False
+            await self.broker.unsubscribe(self.origin)
+        for websocket in list(self.active_connections):
+            self.disconnect(websocket)
+
+    # Returns False when the connection was turned away by the limits. resume
+    # is the id of the last message the client saw, "" when it has none.
+    async def connect(self, websocket: WebSocket, user_id: Optional[int] = None, rooms: Iterable[str] = (),
+                      resume: Optional[str] = None) -> bool:
+        await self.start()
         await websocket.accept()
-        self.active_connections.append(websocket)
+        if len(self.active_connections) >= self.max_connections or (
+            user_id is not None and len(self.user_connections.get(user_id, ())) >= self.max_per_user
+        ):
+            self.rejected += 1
+            await self._close(websocket, REJECTED_CLOSE_CODE)
+            return False
+        connection = _Connection(websocket, self.queue_size, user_id, framed=resume is not None)
+        rooms = list(rooms)
+        if resume is not None:
+            # Queued before the connection is indexed, and without awaiting,
+            # so nothing sent meanwhile is missed or comes out of order
+            channels = ["all"] + ([f"user:{user_id}"] if user_id is not None else []) + [f"room:{room}" for room in rooms]
+            for frame in self._catch_up(resume, channels):
+                connection.queue.put_nowait(frame)
+            self._framed += 1
+        self.active_connections[websocket] = connection
+        if user_id is not None:
+            self.user_connections.setdefault(user_id, set()).add(websocket)
+        for room in rooms:
+            self.join(websocket, room)
+        connection.writer = asyncio.create_task(self._write(connection))
+        return True
+
+    def _catch_up(self, resume: str, channels):
+        epoch, _, seq = resume.partition(":")
+        missed = None
+        if epoch == self.origin and seq.isdigit():
+            missed = self.replay.since(channels, int(seq))
+        # Leave room in the queue for what's sent while the client catches up
+        if missed is not None and len(missed) < self.queue_size // 2:
+            self.replayed += len(missed)
+            frames = [_message_frame(f"{self.origin}:{entry_seq}", message) for entry_seq, message in missed]
+            status = {"type": "replay", "id": self._current_id(), "replayed": len(missed)}
+        else:
+            self.resyncs += 1
+            frames = []
+            status = {"type": "resync", "id": self._current_id()}
+        frames.append(json.dumps(status))
+        return frames
+
+    def _current_id(self) -> str:
+        return f"{self.origin}:{self.replay.seq}"
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        if connection.framed:
+            self._framed -= 1
+        for room in connection.rooms:
+            _discard(self.rooms, room, websocket)
+        if connection.user_id is not None:
+            _discard(self.user_connections, connection.user_id, websocket)
+        if connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    def join(self, websocket: WebSocket, room: str):
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            connection.rooms.add(room)
+            self.rooms.setdefault(room, set()).add(websocket)
+
+    def leave(self, websocket: WebSocket, room: str):
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            connection.rooms.discard(room)
+            _discard(self.rooms, room, websocket)
+
+    async def _write(self, connection: _Connection):
+        try:
+            while True:
+                message = await connection.queue.get()
+                await connection.websocket.send_text(message)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The peer is gone; its receive loop sees the disconnect as well
+            self.send_errors += 1
+            self.disconnect(connection.websocket)
+
+    def _evict(self, connection: _Connection, code: int):
+        self.disconnect(connection.websocket)
+        task = asyncio.create_task(self._close(connection.websocket, code))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            self.heartbeat()
+
+    # One heartbeat round: evict the sockets that went quiet, ping the rest
+    def heartbeat(self):
+        cutoff = asyncio.get_running_loop().time() - self.idle_timeout
+        for connection in list(self.active_connections.values()):
+            if connection.last_seen < cutoff:
+                self.evicted += 1
+                self._evict(connection, IDLE_CLOSE_CODE)
+            else:
+                self.pings += 1
+                self._enqueue(connection, PING)
+
+    # Receive loops read through this so every message counts as a sign of
+    # life; pongs are consumed here.
+    async def receive_text(self, websocket: WebSocket) -> str:
+        while True:
+            message = await websocket.receive_text()
+            connection = self.active_connections.get(websocket)
+            if connection is not None:
+                connection.last_seen = asyncio.get_running_loop().time()
+            if not _is_pong(message):
+                return message
+
+    def _enqueue(self, connection: _Connection, message: str):
+        try:
+            connection.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if self.policy == "disconnect":
+                self.slow_disconnects += 1
+                self._evict(connection, SLOW_CONSUMER_CLOSE_CODE)
+                return
+            connection.queue.get_nowait()
+            connection.queue.put_nowait(message)
+            self.dropped += 1
 
     async def send_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            await websocket.send_text(message)
+        else:
+            self._enqueue(connection, message)
+
+    def _send_all(self, websockets: Iterable[WebSocket], message: str, frame: Optional[str]):
+        for websocket in list(websockets):
+            connection = self.active_connections.get(websocket)
+            if connection is not None:
+                self._enqueue(connection, frame if connection.framed else message)
+
+    def _deliver(self, envelope: dict):
+        target, message = envelope["to"], envelope["message"]
+        if target == "all":
+            channel, websockets = "all", self.active_connections
+        elif target == "user":
+            channel, websockets = f"user:{envelope['key']}", self.user_connections.get(envelope["key"], ())
+        elif target == "room":
+            channel, websockets = f"room:{envelope['key']}", self.rooms.get(envelope["key"], ())
+        else:
+            return
+        seq = self.replay.append(channel, message)
+        frame = _message_frame(f"{self.origin}:{seq}", message) if self._framed else None
+        self._send_all(websockets, message, frame)
+
+    def _receive(self, envelopes):
+        for envelope in envelopes:
+            self._deliver(envelope)
+
+    async def _publish(self, envelope: dict):
+        self._deliver(envelope)
+        if self.broker is not None:
+            await self.start()
+            await self.broker.publish(self.origin, envelope)
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
\ No newline at end of file
+        await self._publish({"to": "all", "message": message})
+
+    async def send_to_user(self, user_id: int, message: str):
+        await self._publish({"to": "user", "key": user_id, "message": message})
+
+    async def send_to_room(self, room: str, message: str):
+        await self._publish({"to": "room", "key": room, "message": message})
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.active_connections),
+            "evicted": self.evicted,
+            "rejected": self.rejected,
+            "pings": self.pings,
+            "users": len(self.user_connections),
+            "rooms": len(self.rooms),
+            "queued": sum(connection.queue.qsize() for connection in self.active_connections.values()),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "send_errors": self.send_errors,
+            "replay": dict(self.replay.stats(), replayed=self.replayed, resyncs=self.resyncs),
+            "broker": self.broker.stats() if self.broker is not None else None,
+        }
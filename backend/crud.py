@@ -0,0 +1,341 @@
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import and_, delete, insert, or_, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.orm import Session
+from . import models, schemas, search, serialization, stats, sync
+
+# Plain synchronous queries shared by both database modes. The sync path runs
+# them in the threadpool, the async path through AsyncSession.run_sync, so
+# everything a route needs must be loaded before returning.
+
+def get_user(db: Session, user_id: int) -> Optional[models.User]:
+    return db.get(models.User, user_id)
+
+def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
+    return db.query(models.User).filter(models.User.email == email).first()
+
+def create_user(db: Session, email: str, hashed_password: str, full_name: str) -> models.User:
+    db_user = models.User(email=email, hashed_password=hashed_password, full_name=full_name)
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
+
+def update_password_hash(db: Session, user_id: int, hashed_password: str):
+    db.execute(update(models.User).where(models.User.id == user_id).values(hashed_password=hashed_password))
+    db.commit()
+
+# Writes are single statements with RETURNING where the dialect has it, so
+# create/update/delete each cost one round trip instead of select + write +
+# refresh. Dialects without RETURNING fall back to the ORM.
+def _returning(db: Session, kind: str) -> bool:
+    dialect = db.get_bind().dialect
+    return getattr(dialect, f"{kind}_returning")
+
+def create_task(db: Session, owner_id: int, data: dict) -> models.Task:
+    values = dict(data, owner_id=owner_id)
+    if _returning(db, "insert"):
+        db_task = db.scalars(insert(models.Task).values(**values).returning(models.Task)).one()
+    else:
+        db_task = models.Task(**values)
+        db.add(db_task)
+        db.flush()
+    db.commit()
+    return db_task
+
+TASK_SORT_COLUMNS = {
+    "id": models.Task.id,
+    "due_date": models.Task.due_date,
+    "title": models.Task.title,
+}
+
+# A column the query planner mustn't seek on. SQLite otherwise prefers a
+# due date range over the index that delivers the sort order, and then sorts
+# the whole range for every page; unary + is its way of ruling an index out.
+# Other databases get the plain column and choose from their statistics.
+class _unindexed(FunctionElement):
+    inherit_cache = True
+
+    def __init__(self, column):
+        super().__init__(column)
+        self.type = column.type
+
+@compiles(_unindexed)
+def _compile_unindexed(element, compiler, **kw):
+    return compiler.process(element.clauses, **kw)
+
+@compiles(_unindexed, "sqlite")
+def _compile_unindexed_sqlite(element, compiler, **kw):
+    return "+" + compiler.process(element.clauses, **kw)
+
+def _listing(owner_id: int, params: schemas.TaskListParams, columns=(models.Task,)):
+    statement = select(*columns).where(models.Task.owner_id == owner_id)
+    if params.status is not None:
+        statement = statement.where(models.Task.status == params.status)
+    # Unless the listing is sorted by due date, the range is a filter on the
+    # rows the sort index yields, so a page reads about as many rows as it
+    # returns instead of the whole range
+    due_date = models.Task.due_date if params.sort == "due_date" else _unindexed(models.Task.due_date)
+    if params.due_before is not None:
+        statement = statement.where(due_date < params.due_before)
+    if params.due_after is not None:
+        statement = statement.where(due_date > params.due_after)
+    descending = params.order == "desc"
+    keys = [TASK_SORT_COLUMNS[params.sort]]
+    if params.sort != "id":
+        keys.append(models.Task.id)
+    return statement.order_by(*(key.desc() if descending else key.asc() for key in keys))
+
+# Keyset condition for "rows after (value, last_id)" in the listing order.
+# Row values let the index seek straight to the position. NULL sort values
+# are ordered the way the database orders them natively (lowest on SQLite,
+# highest on Postgres) so the index order can still be used.
+def _after(db: Session, params: schemas.TaskListParams, value: Any, last_id: int):
+    descending = params.order == "desc"
+    if params.sort == "id":
+        return models.Task.id < last_id if descending else models.Task.id > last_id
+    column = TASK_SORT_COLUMNS[params.sort]
+    nulls_low = db.get_bind().dialect.name != "postgresql"
+    id_after = models.Task.id < last_id if descending else models.Task.id > last_id
+    if value is None:
+        condition = and_(column.is_(None), id_after)
+        # NULLs sort first in this direction, so every non-NULL value follows
+        if nulls_low != descending:
+            condition = or_(condition, column.is_not(None))
+        return condition
+    keys, position = tuple_(column, models.Task.id), tuple_(value, last_id)
+    condition = keys < position if descending else keys > position
+    # The NULL block comes after the non-NULL values in this direction
+    if nulls_low == descending:
+        condition = or_(condition, column.is_(None))
+    return condition
+
+def list_tasks(db: Session, owner_id: int, params: schemas.TaskListParams, skip: int, limit: int) -> List[models.Task]:
+    return db.scalars(_listing(owner_id, params).offset(skip).limit(limit)).all()
+
+def list_tasks_after(db: Session, owner_id: int, params: schemas.TaskListParams, after: Optional[Tuple[Any, int]], limit: int) -> List[models.Task]:
+    return db.scalars(_listing_after(db, owner_id, params, after).limit(limit)).all()
+
+def _listing_after(db: Session, owner_id: int, params: schemas.TaskListParams, after: Optional[Tuple[Any, int]], columns=(models.Task,)):
+    statement = _listing(owner_id, params, columns)
+    if after is not None:
+        statement = statement.where(_after(db, params, *after))
+    return statement
+
+# Same listings as plain rows of the response columns (see serialization.py)
+def list_task_rows(db: Session, owner_id: int, params: schemas.TaskListParams, skip: int, limit: int) -> list:
+    return db.execute(_listing(owner_id, params, serialization.TASK_COLUMNS).offset(skip).limit(limit)).all()
+
+def list_task_rows_after(db: Session, owner_id: int, params: schemas.TaskListParams, after: Optional[Tuple[Any, int]], limit: int) -> list:
+    return db.execute(_listing_after(db, owner_id, params, after, serialization.TASK_COLUMNS).limit(limit)).all()
+
+def search_tasks(db: Session, owner_id: int, query: str, skip: int, limit: int) -> List[models.Task]:
+    statement = search.search_statement(db.get_bind().dialect.name, owner_id, query, skip, limit)
+    if statement is None:
+        return []
+    return db.scalars(statement).all()
+
+def task_stats(db: Session, owner_id: int) -> dict:
+    return stats.task_stats(db, owner_id)
+
+def task_changes(db: Session, owner_id: int, since: int, limit: int) -> dict:
+    return sync.task_changes(db, owner_id, since, limit)
+
+def get_task(db: Session, owner_id: int, task_id: int) -> Optional[models.Task]:
+    return db.query(models.Task).filter(models.Task.id == task_id, models.Task.owner_id == owner_id).first()
+
+def get_task_version(db: Session, owner_id: int, task_id: int) -> Optional[int]:
+    return db.scalar(select(models.Task.version).where(models.Task.id == task_id, models.Task.owner_id == owner_id))
+
+# Version of the owner's whole task set; changes whenever any of their tasks do
+def task_list_version(db: Session, owner_id: int) -> int:
+    return db.scalar(select(models.TaskCounts.version).where(models.TaskCounts.owner_id == owner_id)) or 0
+
+def task_list_versions(db: Session, owner_ids: List[int]) -> Dict[int, int]:
+    return dict(db.execute(
+        select(models.TaskCounts.owner_id, models.TaskCounts.version).where(models.TaskCounts.owner_id.in_(owner_ids))
+    ).all())
+
+# expected_version makes the write conditional on the row version (If-Match);
+# a mismatch looks like a missing task, and the caller tells the two apart.
+def _versioned(statement, task_id: int, owner_id: int, expected_version: Optional[int]):
+    statement = statement.where(models.Task.id == task_id, models.Task.owner_id == owner_id)
+    if expected_version is not None:
+        statement = statement.where(models.Task.version == expected_version)
+    return statement
+
+def update_task(db: Session, owner_id: int, task_id: int, data: dict, expected_version: Optional[int] = None) -> Optional[models.Task]:
+    if not data:
+        db_task = get_task(db, owner_id, task_id)
+        if db_task is not None and expected_version not in (None, db_task.version):
+            return None
+        return db_task
+    statement = _versioned(
+        update(models.Task).values(**data, version=models.Task.version + 1),
+        task_id, owner_id, expected_version,
+    )
+    if _returning(db, "update"):
+        db_task = db.scalars(statement.returning(models.Task)).one_or_none()
+    else:
+        matched = db.execute(statement).rowcount
+        db_task = get_task(db, owner_id, task_id) if matched else None
+    db.commit()
+    return db_task
+
+def delete_task(db: Session, owner_id: int, task_id: int, expected_version: Optional[int] = None) -> Optional[models.Task]:
+    statement = _versioned(delete(models.Task), task_id, owner_id, expected_version)
+    if _returning(db, "delete"):
+        db_task = db.scalars(statement.returning(models.Task)).one_or_none()
+    else:
+        db_task = get_task(db, owner_id, task_id)
+        if db_task is not None and expected_version not in (None, db_task.version):
+            db_task = None
+        if db_task is not None:
+            db.execute(statement)
+    db.commit()
+    return db_task
+
+# Bulk operations run in one transaction with one statement per kind of
+# operation: creates and updates are executemany batches, deletes and
+# fetches use IN lists. Items that don't exist or belong to someone else are
+# reported per item instead of failing the batch.
+def bulk_tasks(db: Session, owner_id: int, create: List[dict], patch: List[dict], delete_ids: List[int], fetch_ids: List[int]) -> Dict[str, list]:
+    results = {"created": [], "updated": [], "deleted": [], "fetched": []}
+
+    if create:
+        dialect = db.get_bind().dialect
+        if dialect.insert_executemany_returning_sort_by_parameter_order:
+            created = db.scalars(
+                insert(models.Task).returning(models.Task, sort_by_parameter_order=True),
+                [dict(data, owner_id=owner_id) for data in create],
+            ).all()
+        else:
+            # One INSERT per task, which is how the ids come back without
+            # RETURNING
+            created = [models.Task(**data, owner_id=owner_id) for data in create]
+            db.add_all(created)
+            db.flush()
+        results["created"] = [{"id": task.id, "status": "created", "task": task} for task in created]
+
+    if patch:
+        owned = _owned_ids(db, owner_id, [item["id"] for item in patch])
+        # executemany needs the same columns in every row, so group patches
+        # by the set of fields they change.
+        groups = defaultdict(dict)
+        for item in patch:
+            if item["id"] in owned:
+                groups[frozenset(item)][item["id"]] = item
+        for rows in groups.values():
+            db.execute(update(models.Task).values(version=models.Task.version + 1), list(rows.values()))
+        updated = _tasks_by_id(db, owner_id, owned)
+        results["updated"] = [
+            {"id": item["id"], "status": "updated", "task": updated[item["id"]]}
+            if item["id"] in owned else {"id": item["id"], "status": "not_found"}
+            for item in patch
+        ]
+
+    if delete_ids:
+        statement = delete(models.Task).where(models.Task.id.in_(delete_ids), models.Task.owner_id == owner_id)
+        if _returning(db, "delete"):
+            deleted = set(db.scalars(statement.returning(models.Task.id)))
+        else:
+            deleted = _owned_ids(db, owner_id, delete_ids)
+            db.execute(statement)
+        results["deleted"] = [
+            {"id": task_id, "status": "deleted" if task_id in deleted else "not_found"}
+            for task_id in delete_ids
+        ]
+
+    if fetch_ids:
+        found = _tasks_by_id(db, owner_id, fetch_ids)
+        results["fetched"] = [
+            {"id": task_id, "status": "found", "task": found[task_id]}
+            if task_id in found else {"id": task_id, "status": "not_found"}
+            for task_id in fetch_ids
+        ]
+
+    db.commit()
+    return results
+
+def _owned_ids(db: Session, owner_id: int, task_ids: List[int]) -> set:
+    return set(db.scalars(select(models.Task.id).where(models.Task.id.in_(task_ids), models.Task.owner_id == owner_id)))
+
+def _tasks_by_id(db: Session, owner_id: int, task_ids) -> Dict[int, models.Task]:
+    if not task_ids:
+        return {}
+    tasks = db.scalars(
+        select(models.Task)
+        .where(models.Task.id.in_(list(task_ids)), models.Task.owner_id == owner_id)
+        .execution_options(populate_existing=True)
+    )
+    return {task.id: task for task in tasks}
+
+# One chunk of an import (see imports.py), already validated against TaskImport
+def import_tasks(db: Session, owner_id: int, tasks: List[dict]) -> int:
+    db.execute(insert(models.Task), [dict(data, owner_id=owner_id) for data in tasks])
+    return len(tasks)
+
+# Reminders (see reminders.py). Tasks due in [start, end] whose reminder
+# hasn't fired, in (due_date, id) order from after on, through the due date
+# index.
+def _due_reminders(start: date, end: date, after: Optional[Tuple[date, int]], limit: int):
+    Task, Reminder = models.Task, models.TaskReminder
+    statement = (
+        select(Task.id, Task.owner_id, Task.title, Task.due_date)
+        .outerjoin(Reminder, and_(Reminder.task_id == Task.id, Reminder.due_date == Task.due_date))
+        .where(Task.due_date >= start, Task.due_date <= end, Task.status != models.TaskStatus.completed, Reminder.task_id.is_(None))
+        .order_by(Task.due_date, Task.id)
+        .limit(limit)
+    )
+    if after is not None:
+        statement = statement.where(tuple_(Task.due_date, Task.id) > tuple_(*after))
+    return statement
+
+def due_reminders(db: Session, start: date, end: date, after: Optional[Tuple[date, int]], limit: int) -> list:
+    return db.execute(_due_reminders(start, end, after, limit)).all()
+
+# Claims the reminders of these (task id, due date) pairs that are still due
+# and haven't fired, and returns the claimed tasks' (id, owner_id, title).
+# Another worker claiming the same reminder makes the insert fail here.
+def claim_reminders(db: Session, reminders: List[Tuple[int, date]]) -> list:
+    wanted = dict(reminders)
+    current = db.execute(
+        select(models.Task.id, models.Task.owner_id, models.Task.title, models.Task.due_date)
+        .where(models.Task.id.in_(list(wanted)), models.Task.status != models.TaskStatus.completed)
+    ).all()
+    claimed = []
+    for task in current:
+        if task.due_date != wanted[task.id]:
+            continue
+        try:
+            with db.begin_nested():
+                db.execute(insert(models.TaskReminder).values(task_id=task.id, due_date=task.due_date))
+        except IntegrityError:
+            continue
+        claimed.append((task.id, task.owner_id, task.title))
+    return claimed
+
+def prune_reminders(db: Session, before: date) -> int:
+    return db.execute(delete(models.TaskReminder).where(models.TaskReminder.due_date < before)).rowcount
+
+def device_tokens(db: Session, user_ids: List[int]) -> Dict[int, List[str]]:
+    tokens = defaultdict(list)
+    rows = db.execute(select(models.DeviceToken.user_id, models.DeviceToken.token).where(models.DeviceToken.user_id.in_(user_ids)))
+    for user_id, token in rows:
+        tokens[user_id].append(token)
+    return dict(tokens)
+
+# A token belongs to the user who registered it last
+def add_device_token(db: Session, user_id: int, token: str):
+    db.execute(delete(models.DeviceToken).where(models.DeviceToken.token == token))
+    db.execute(insert(models.DeviceToken).values(user_id=user_id, token=token))
+
+def delete_device_tokens(db: Session, tokens: List[str], user_id: Optional[int] = None) -> int:
+    statement = delete(models.DeviceToken).where(models.DeviceToken.token.in_(tokens))
+    if user_id is not None:
+        statement = statement.where(models.DeviceToken.user_id == user_id)
+    return db.execute(statement).rowcount
@@ -1,8 +1,13 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy_utils import database_exists, create_database
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,16 +15,263 @@ load_dotenv()
 # Load the database URL from environment variables
 database_url = os.getenv("DATABASE_URL")
 
-# Create the database engine
-engine = create_engine(database_url)
+# Serve requests through the async engine instead of the threadpool
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
 
-# Check if the database exists, and create it if it doesn't
-if not database_exists(engine.url):
-    create_database(engine.url)
-    print(f"Database '{engine.url.database}' created.")
+# Create the database and any missing tables when the app starts. Turn off
+# where the schema is managed separately (see migrations.py) so starting a
+# worker never touches it.
+DB_CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "true").lower() in ("1", "true", "yes")
 
-# Create a configured "Session" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def async_database_url(url: str):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}' databases")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+def pool_settings() -> dict:
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "-1")),
+        "pool_pre_ping": _env_flag("DB_POOL_PRE_PING", False),
+    }
+
+# Applied to every new SQLite connection. WAL lets readers run alongside the
+# single writer, synchronous=NORMAL is durable enough under WAL, and the
+# busy timeout makes writers queue instead of failing with "database is locked".
+def sqlite_pragmas() -> dict:
+    return {
+        "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-20000")),  # negative: KiB
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+        "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    }
+
+def postgres_settings() -> dict:
+    settings = {}
+    if os.getenv("DB_STATEMENT_TIMEOUT_MS"):
+        settings["statement_timeout"] = int(os.getenv("DB_STATEMENT_TIMEOUT_MS"))
+    if os.getenv("DB_IDLE_IN_TRANSACTION_TIMEOUT_MS"):
+        settings["idle_in_transaction_session_timeout"] = int(os.getenv("DB_IDLE_IN_TRANSACTION_TIMEOUT_MS"))
+    return settings
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.checked_out = 0
+            self.peak_checked_out = 0
+            self.wait_count = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def record_checkin(self):
+        with self._lock:
+            self.checkins += 1
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_invalidate(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self, pool=None) -> dict:
+        with self._lock:
+            stats = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "checked_out": self.checked_out,
+                "peak_checked_out": self.peak_checked_out,
+                "wait_avg_ms": (self.wait_total / self.wait_count * 1000) if self.wait_count else 0.0,
+                "wait_max_ms": self.wait_max * 1000,
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(pool_size=pool.size(), overflow=pool.overflow(), checked_in=pool.checkedin())
+        return stats
+
+
+# Times how long each checkout waits for a connection. The stats live on the
+# class because the pool recreates itself from its class on dispose().
+class _TimedPoolMixin:
+    stats: PoolStats
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - start, timed_out)
+
+def _timed_pool_class(base, stats: PoolStats):
+    return type(f"Timed{base.__name__}", (_TimedPoolMixin, base), {"stats": stats})
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+def _engine_options(url, queue_pool, stats: PoolStats) -> dict:
+    settings = pool_settings()
+    options = {"pool_recycle": settings["pool_recycle"], "pool_pre_ping": settings["pool_pre_ping"]}
+    # In-memory SQLite needs its single-connection pool; everything else gets
+    # a sized queue pool.
+    if not _is_memory_sqlite(url):
+        options.update(
+            poolclass=_timed_pool_class(queue_pool, stats),
+            pool_size=settings["pool_size"],
+            max_overflow=settings["max_overflow"],
+            pool_timeout=settings["pool_timeout"],
+        )
+    return options
+
+def _install_listeners(sync_engine, stats: PoolStats):
+    backend = sync_engine.url.get_backend_name()
+
+    @event.listens_for(sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        stats.record_connect()
+        if backend == "sqlite":
+            cursor = dbapi_connection.cursor()
+            for name, value in sqlite_pragmas().items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+        elif backend == "postgresql":
+            settings = postgres_settings()
+            if settings:
+                cursor = dbapi_connection.cursor()
+                for name, value in settings.items():
+                    cursor.execute(f"SET {name} = {int(value)}")
+                cursor.close()
+                # Otherwise the pool's reset-on-return rollback undoes the SETs
+                dbapi_connection.commit()
+
+    @event.listens_for(sync_engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        stats.record_checkout()
+
+    @event.listens_for(sync_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        stats.record_checkin()
+
+    @event.listens_for(sync_engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        stats.record_invalidate()
+
+def build_engine(url, stats: PoolStats = None):
+    stats = stats or PoolStats()
+    url = make_url(url)
+    new_engine = create_engine(url, **_engine_options(url, QueuePool, stats))
+    _install_listeners(new_engine, stats)
+    return new_engine
+
+def build_async_engine(url, stats: PoolStats = None):
+    stats = stats or PoolStats()
+    url = async_database_url(url)
+    new_engine = create_async_engine(url, **_engine_options(url, AsyncAdaptedQueuePool, stats))
+    _install_listeners(new_engine.sync_engine, stats)
+    return new_engine
+
+sync_pool_stats = PoolStats()
+async_pool_stats = PoolStats()
+
+# The engines and session factories are built on first use rather than at
+# import, so importing the app needs neither a database nor DATABASE_URL.
+# They're read as module attributes (database.engine, database.SessionLocal,
+# and, with DB_ASYNC, database.async_engine and database.AsyncSessionLocal).
+_built = {}
+_build_lock = threading.Lock()
+
+def _build(name: str):
+    with _build_lock:
+        if name in _built:
+            return _built[name]
+        if not database_url:
+            raise RuntimeError("DATABASE_URL is not set")
+        if name in ("engine", "SessionLocal"):
+            sync_engine = build_engine(database_url, sync_pool_stats)
+            _built["engine"] = sync_engine
+            # Loaded objects stay usable after commit: routes keep them after
+            # their transaction ends (see dependencies.py)
+            _built["SessionLocal"] = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=sync_engine)
+        elif DB_ASYNC:
+            async_engine = build_async_engine(database_url, async_pool_stats)
+            _built["async_engine"] = async_engine
+            _built["AsyncSessionLocal"] = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+        else:
+            return None
+        return _built[name]
+
+def __getattr__(name: str):
+    if name in ("engine", "SessionLocal", "async_engine", "AsyncSessionLocal"):
+        return _build(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Creates the database if it doesn't exist yet, then any missing tables
+def create_schema(metadata):
+    from sqlalchemy_utils import create_database, database_exists
+
+    sync_engine = _build("engine")
+    if not database_exists(sync_engine.url):
+        create_database(sync_engine.url)
+        print(f"Database '{sync_engine.url.database}' created.")
+    metadata.create_all(bind=sync_engine)
+
+# Closes the pooled connections, e.g. when the app shuts down
+async def dispose():
+    if "engine" in _built:
+        _built["engine"].dispose()
+    if "async_engine" in _built:
+        await _built["async_engine"].dispose()
+
+def pool_stats() -> dict:
+    stats = {"sync": sync_pool_stats.snapshot(_built["engine"].pool if "engine" in _built else None)}
+    if "async_engine" in _built:
+        stats["async"] = async_pool_stats.snapshot(_built["async_engine"].pool)
+    return stats
 
 # Base class for declarative class definitions
 Base = declarative_base()
@@ -1,9 +1,105 @@
+from contextlib import asynccontextmanager
+from fastapi import Depends
+from typing import Union
 from sqlalchemy.orm import Session
-from .database import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from .database import DB_ASYNC
+from . import database
 
 def get_db():
-    db = SessionLocal()
+    db = database.SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+# Routes hand their queries (plain functions taking a Session, see crud.py)
+# to a runner instead of touching the session directly, so the same route
+# works on both the blocking and the async engine. Every run is its own short
+# transaction: a request never keeps a pooled connection while it waits for
+# a thread or for the event loop, which would starve the pool under load.
+def _unit_of_work(session: Session, fn, *args, **kwargs):
+    try:
+        result = fn(session, *args, **kwargs)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return result
+
+# Streams are the exception: they read a statement in chunks of yield_per
+# rows (a server-side cursor where the driver has one) and hand each chunk
+# to transform, so memory stays flat however many rows there are. They use
+# a session of their own because the request's session is closed before a
+# streaming body is sent.
+def _partitions(session_factory, statement, chunk_size: int, transform):
+    with session_factory() as session:
+        result = session.execute(statement.execution_options(yield_per=chunk_size))
+        for partition in result.partitions():
+            yield transform(partition)
+
+# Results are used after their transaction ends, so runners expect sessions
+# made with expire_on_commit=False; expiring them on commit would turn every
+# attribute access into a refresh query.
+class SyncSessionRunner:
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def run(self, fn, *args, **kwargs):
+        return await run_in_threadpool(_unit_of_work, self.session, fn, *args, **kwargs)
+
+    # Both the reads and transform run in the threadpool
+    async def stream(self, statement, chunk_size: int, transform):
+        factory = lambda: Session(bind=self.session.get_bind())
+        async for chunk in iterate_in_threadpool(_partitions(factory, statement, chunk_size, transform)):
+            yield chunk
+
+    # A runner on a session of its own, for background work that outlives
+    # the request
+    @asynccontextmanager
+    async def detached(self):
+        with Session(bind=self.session.get_bind(), expire_on_commit=False) as session:
+            yield SyncSessionRunner(session)
+
+class AsyncSessionRunner:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def run(self, fn, *args, **kwargs):
+        return await self.session.run_sync(_unit_of_work, fn, *args, **kwargs)
+
+    async def stream(self, statement, chunk_size: int, transform):
+        async with AsyncSession(bind=self.session.bind) as session:
+            result = await session.stream(statement.execution_options(yield_per=chunk_size))
+            async for partition in result.partitions():
+                yield transform(partition)
+
+    @asynccontextmanager
+    async def detached(self):
+        async with AsyncSession(bind=self.session.bind, expire_on_commit=False) as session:
+            yield AsyncSessionRunner(session)
+
+DbRunner = Union[SyncSessionRunner, AsyncSessionRunner]
+
+# A runner on a session of its own, for work that isn't part of a request
+@asynccontextmanager
+async def open_runner():
+    if DB_ASYNC:
+        async with database.AsyncSessionLocal() as session:
+            yield AsyncSessionRunner(session)
+    else:
+        with database.SessionLocal() as session:
+            yield SyncSessionRunner(session)
+
+def get_sync_runner(db: Session = Depends(get_db)) -> SyncSessionRunner:
+    return SyncSessionRunner(db)
+
+async def get_async_runner(db: AsyncSession = Depends(get_async_db)) -> AsyncSessionRunner:
+    return AsyncSessionRunner(db)
+
+get_runner = get_async_runner if DB_ASYNC else get_sync_runner
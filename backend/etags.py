@@ -0,0 +1,44 @@
+import hashlib
+import re
+from typing import Iterable, Optional, Tuple
+
+# Strong validators for task reads. A single task's tag comes from its row
+# version; a listing's tag comes from the owner's task version (bumped by
+# the task_counts triggers on every write, see stats.py) plus the query that
+# produced it. Both are known without loading or serializing any task.
+
+_TASK_TAG = re.compile(r'^"t(\d+)-v(\d+)"$')
+
+def task_etag(task_id: int, version: int) -> str:
+    return f'"t{task_id}-v{version}"'
+
+def list_etag(owner_id: int, version: int, query: Iterable[Tuple[str, str]]) -> str:
+    digest = hashlib.sha1(repr(sorted(query)).encode()).hexdigest()[:16]
+    return f'"l{owner_id}-v{version}-{digest}"'
+
+def _tags(header: str):
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+# If-None-Match uses the weak comparison, so W/ prefixes are ignored
+def none_match(header: Optional[str], etag: str) -> bool:
+    if header is None:
+        return True
+    tags = _tags(header)
+    if "*" in tags:
+        return False
+    return etag not in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+# Version the client expects the task to be at, from If-Match. None means
+# the header places no constraint (absent or "*"); -1 means it can never
+# match this task.
+def expected_version(header: Optional[str], task_id: int) -> Optional[int]:
+    if header is None:
+        return None
+    tags = _tags(header)
+    if "*" in tags:
+        return None
+    for tag in tags:
+        match = _TASK_TAG.match(tag)
+        if match and int(match.group(1)) == task_id:
+            return int(match.group(2))
+    return -1
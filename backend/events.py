@@ -0,0 +1,72 @@
+import asyncio
+import json
+import os
+from typing import Dict, Iterable, Tuple
+from . import crud
+
+# Task change events for /ws/tasks. Write routes record which tasks they
+# changed or deleted once their transaction has committed; changes an owner
+# makes within the window are merged and pushed to that owner's sockets as
+# one event:
+#
+#   {"type": "tasks", "seq": 42, "changed": [7, 9], "deleted": [3]}
+#
+# seq is the owner's task version after the changes (see stats.py), the same
+# number /tasks/changes tokens are made of. A client that has synced up to
+# seq can ignore the event; otherwise it fetches the tasks by id, or calls
+# /tasks/changes when it suspects it missed an event.
+
+TASK_EVENT_WINDOW = float(os.getenv("TASK_EVENT_WINDOW", "0.05"))
+
+class TaskEvents:
+    def __init__(self, manager, window: float = TASK_EVENT_WINDOW):
+        self.manager = manager
+        self.window = window
+        self._pending: Dict[int, Tuple[set, set]] = {}
+        self._runner = None
+        self._flusher = None
+        self.recorded = 0
+        self.published = 0
+        self.errors = 0
+
+    # Called with the request's runner, after the write has committed
+    def record(self, db, owner_id: int, changed: Iterable[int] = (), deleted: Iterable[int] = ()):
+        changed, deleted = set(changed), set(deleted)
+        if not changed and not deleted:
+            return
+        changed_ids, deleted_ids = self._pending.setdefault(owner_id, (set(), set()))
+        changed_ids.update(changed)
+        changed_ids.difference_update(deleted)
+        deleted_ids.update(deleted)
+        self.recorded += 1
+        self._runner = db
+        # A flusher left on a loop that has since stopped (a test client runs
+        # each request on its own loop) would never run
+        if self._flusher is None or self._flusher.get_loop() is not asyncio.get_running_loop():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._flusher = None
+        await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        runner, self._runner = self._runner, None
+        if not pending:
+            return
+        try:
+            # One lookup for every owner in the window
+            async with runner.detached() as db:
+                versions = await db.run(crud.task_list_versions, list(pending))
+        except Exception:
+            # Clients catch up through /tasks/changes on their next event
+            self.errors += 1
+            return
+        for owner_id, (changed, deleted) in pending.items():
+            event = {"type": "tasks", "seq": versions.get(owner_id, 0), "changed": sorted(changed), "deleted": sorted(deleted)}
+            await self.manager.send_to_user(owner_id, json.dumps(event))
+            self.published += 1
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "recorded": self.recorded, "published": self.published, "errors": self.errors}
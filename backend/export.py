@@ -0,0 +1,56 @@
+import csv
+import io
+from sqlalchemy import select
+from . import models
+from .serialization import TASK_COLUMNS, dumps
+
+# Full export of an owner's tasks as NDJSON or CSV. The rows are read with
+# yield_per (a server-side cursor on Postgres) and each chunk is encoded and
+# sent before the next one is fetched, so memory use depends on the chunk
+# size and not on how many tasks there are (see DbRunner.stream).
+
+CHUNK_SIZE = 1000
+
+FIELDS = [column.key for column in TASK_COLUMNS]
+
+def export_statement(owner_id: int):
+    return (
+        select(*TASK_COLUMNS)
+        .where(models.Task.owner_id == owner_id)
+        .order_by(models.Task.id)
+    )
+
+def ndjson_chunk(rows) -> bytes:
+    return b"".join(dumps(row._asdict()) + b"\n" for row in rows)
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, models.TaskStatus):
+        return value.value
+    return value
+
+def _csv_lines(rows) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+def csv_header() -> bytes:
+    return _csv_lines([FIELDS])
+
+def csv_chunk(rows) -> bytes:
+    return _csv_lines([_csv_value(value) for value in row] for row in rows)
+
+# format: (media type, file extension, chunk encoder, leading bytes)
+FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson", ndjson_chunk, b""),
+    "csv": ("text/csv; charset=utf-8", "csv", csv_chunk, csv_header()),
+}
+
+async def export_body(db, owner_id: int, export_format: str):
+    _, _, encode, head = FORMATS[export_format]
+    if head:
+        yield head
+    async for chunk in db.stream(export_statement(owner_id), CHUNK_SIZE, encode):
+        yield chunk
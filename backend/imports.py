@@ -0,0 +1,169 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime
+from typing import List, Optional
+from cachetools import TTLCache
+from pydantic import ValidationError
+from starlette.concurrency import iterate_in_threadpool
+from . import crud, schemas
+
+# Bulk import of tasks from NDJSON or CSV (the formats export.py writes, so
+# an export can be imported as is). The upload is spooled to a temporary
+# file, then a background job reads it back one chunk at a time: parsing and
+# validation against TaskImport run in the threadpool, and every chunk of
+# valid rows is inserted in one transaction of its own. Memory use depends on
+# the chunk size, not the upload size. Chunks already imported stay imported
+# if a later one fails.
+
+CHUNK_SIZE = 1000
+# Uploads larger than this stay on disk while they're read
+SPOOL_BYTES = 1024 * 1024
+
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(200 * 1024 * 1024)))
+IMPORT_MAX_ACTIVE = int(os.getenv("IMPORT_MAX_ACTIVE", "2"))
+IMPORT_JOB_TTL = float(os.getenv("IMPORT_JOB_TTL", "3600"))
+# Per-row errors kept on a job; the failed count keeps counting past it
+MAX_REPORTED_ERRORS = 1000
+
+class UploadTooLarge(Exception):
+    pass
+
+class ImportJob:
+    def __init__(self, owner_id: int, import_format: str):
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.format = import_format
+        self.status = "pending"
+        self.processed = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.detail = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("pending", "running")
+
+    def reject(self, row: int, errors: List[str]):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "errors": errors})
+
+    def finish(self, status: str, detail: Optional[str] = None):
+        self.status = status
+        self.detail = detail
+        self.finished_at = datetime.utcnow()
+
+# Jobs live in the worker process that accepted the upload, so progress has
+# to be asked of that process. Every update renews a job's TTL, so only jobs
+# that stopped moving expire.
+class ImportJobs:
+    def __init__(self, maxsize: int = 1000, ttl: float = IMPORT_JOB_TTL):
+        self._jobs = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def add(self, job: ImportJob):
+        self._jobs[job.id] = job
+
+    def touch(self, job: ImportJob):
+        self._jobs[job.id] = job
+
+    def discard(self, job: ImportJob):
+        self._jobs.pop(job.id, None)
+
+    def get(self, job_id: str, owner_id: int) -> Optional[ImportJob]:
+        job = self._jobs.get(job_id)
+        if job is None or job.owner_id != owner_id:
+            return None
+        return job
+
+    def active(self, owner_id: int) -> int:
+        return sum(1 for job in list(self._jobs.values()) if job.owner_id == owner_id and job.active)
+
+jobs = ImportJobs()
+
+async def spool_upload(chunks, max_bytes: int = IMPORT_MAX_BYTES):
+    upload = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge()
+            upload.write(chunk)
+    except BaseException:
+        upload.close()
+        raise
+    upload.seek(0)
+    return upload
+
+def _ndjson_records(text):
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield None, ["Invalid JSON"]
+            continue
+        if not isinstance(record, dict):
+            yield None, ["Expected a JSON object"]
+            continue
+        yield record, None
+
+def _csv_records(text):
+    for record in csv.DictReader(text):
+        yield record, None
+
+RECORDS = {"ndjson": _ndjson_records, "csv": _csv_records}
+
+def _messages(exc: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()]
+
+# Yields (valid rows, [(row number, errors)], rows read) per chunk
+def parse_chunks(upload, import_format: str, chunk_size: int):
+    text = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+    valid, rejected, read = [], [], 0
+    for row, (record, errors) in enumerate(RECORDS[import_format](text), start=1):
+        read += 1
+        if errors is None:
+            try:
+                valid.append(schemas.TaskImport.model_validate(record).model_dump())
+            except ValidationError as exc:
+                errors = _messages(exc)
+        if errors is not None:
+            rejected.append((row, errors))
+        if read == chunk_size:
+            yield valid, rejected, read
+            valid, rejected, read = [], [], 0
+    if read:
+        yield valid, rejected, read
+
+async def run_import(job: ImportJob, db, upload):
+    job.status = "running"
+    try:
+        async with db.detached() as runner:
+            async for valid, rejected, read in iterate_in_threadpool(parse_chunks(upload, job.format, CHUNK_SIZE)):
+                if valid:
+                    job.inserted += await runner.run(crud.import_tasks, job.owner_id, valid)
+                for row, errors in rejected:
+                    job.reject(row, errors)
+                job.processed += read
+                jobs.touch(job)
+    except UnicodeDecodeError:
+        job.finish("failed", f"Upload is not valid UTF-8 (after row {job.processed})")
+    except csv.Error as exc:
+        job.finish("failed", f"Invalid CSV after row {job.processed}: {exc}")
+    except Exception:
+        job.finish("failed", f"Import stopped after row {job.processed}")
+        raise
+    else:
+        job.finish("completed")
+    finally:
+        upload.close()
+        jobs.touch(job)
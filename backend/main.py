@@ -1,17 +1,45 @@
-from fastapi import Depends, FastAPI, HTTPException, WebSocketDisconnect, WebSocket, Query, APIRouter
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, WebSocketDisconnect, WebSocket, Query, APIRouter, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from typing import List
-from . import models, schemas, auth
-from .database import engine
-from .dependencies import get_db
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional, Union
+from datetime import date
+import json
+import os
+from . import models, schemas, auth, crud, etags, events, export, imports, notifications, reminders, sync
+from . import database
+from .dependencies import DbRunner, get_runner
+from .broker import WS_BROKER_CHANNEL, broker_from_url
 from .connections import ConnectionManager
+from .pagination import InvalidCursor, decode_keyset, encode_keyset
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from .hashing import HasherBusy
+from .serialization import FastJSONResponse, task_rows
 
-app = FastAPI()
+# Nothing touches the database or outside services at import; the schema is
+# checked once the server starts, and clients are created on first use.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if database.DB_CREATE_SCHEMA:
+        await run_in_threadpool(database.create_schema, models.Base.metadata)
+    if reminders.REMINDERS_ENABLED:
+        reminder_scheduler.start()
+    yield
+    await reminder_scheduler.stop()
+    await manager.stop()
+    await task_manager.stop()
+    await notifications.dispatcher.stop()
+    await database.dispose()
 
-# Create the database tables
-models.Base.metadata.create_all(bind=engine)
+app = FastAPI(lifespan=lifespan)
+
+# Upper bound on the number of items in one /tasks/bulk request
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "500"))
+
+# Serve task listings from plain rows instead of validating ORM objects
+# against response_model (see serialization.py)
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() in ("1", "true", "yes")
 
 # Set up CORS middleware
 app.add_middleware(
@@ -25,83 +53,344 @@ app.add_middleware(
 # Define an APIRouter for versioned API routes
 api_router = APIRouter()
 
+async def _hash_call(call):
+    try:
+        return await call
+    except HasherBusy:
+        raise HTTPException(status_code=503, detail="Too many authentication requests", headers={"Retry-After": "1"})
+
 @api_router.post("/register", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+async def create_user(user: schemas.UserCreate, db: DbRunner = Depends(get_runner)):
+    db_user = await db.run(crud.get_user_by_email, user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = auth.get_password_hash(user.password)
-    db_user = models.User(email=user.email, hashed_password=hashed_password, full_name=user.full_name)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    if not user.password:
+        raise HTTPException(status_code=422, detail="Password cannot be empty")
+    hashed_password = await _hash_call(auth.password_hasher.hash(user.password))
+    return await db.run(crud.create_user, user.email, hashed_password, user.full_name)
 
 @api_router.post("/login")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: DbRunner = Depends(get_runner)):
+    user = await db.run(crud.get_user_by_email, form_data.username)
+    valid = False
+    if user:
+        valid, new_hash = await _hash_call(auth.password_hasher.verify_and_update(form_data.password, user.hashed_password))
+    if not valid:
         raise HTTPException(status_code=401, detail="Incorrect username or password", headers={"WWW-Authenticate": "Bearer"})
-    access_token = auth.create_access_token(data={"sub": user.email})
+    if new_hash:
+        # Stored hash predates the current work factor
+        await db.run(crud.update_password_hash, user.id, new_hash)
+    access_token = auth.create_access_token(data=auth.token_claims(user))
     return {"access_token": access_token, "token_type": "bearer"}
 
 @api_router.post("/tasks", response_model=schemas.Task)
-def create_task(task: schemas.TaskCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    db_task = models.Task(**task.model_dump(), owner_id=current_user.id)
-    db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
+async def create_task(task: schemas.TaskCreate, db: DbRunner = Depends(get_runner), current_user: models.User = Depends(auth.current_user)):
+    db_task = await db.run(crud.create_task, current_user.id, task.model_dump())
+    task_events.record(db, current_user.id, changed=[db_task.id])
+    reminder_scheduler.task_changed(db_task)
     return db_task
 
-@api_router.get("/tasks", response_model=List[schemas.Task])
-def read_tasks(
+@api_router.post("/tasks/bulk", response_model=schemas.TaskBulkResponse)
+async def bulk_tasks(bulk: schemas.TaskBulkRequest, db: DbRunner = Depends(get_runner), current_user: models.User = Depends(auth.current_user)):
+    items = len(bulk.create) + len(bulk.update) + len(bulk.delete) + len(bulk.fetch)
+    if items > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ITEMS} items per bulk request")
+    results = await db.run(
+        crud.bulk_tasks,
+        current_user.id,
+        [task.model_dump() for task in bulk.create],
+        [patch.model_dump(exclude_none=True) for patch in bulk.update],
+        bulk.delete,
+        bulk.fetch,
+    )
+    task_events.record(
+        db,
+        current_user.id,
+        changed=[item["id"] for item in results["created"] + results["updated"] if item["status"] != "not_found"],
+        deleted=[item["id"] for item in results["deleted"] if item["status"] == "deleted"],
+    )
+    for item in results["created"] + results["updated"]:
+        if "task" in item:
+            reminder_scheduler.task_changed(item["task"])
+    for item in results["deleted"]:
+        if item["status"] == "deleted":
+            reminder_scheduler.task_deleted(item["id"])
+    return results
+
+# Conditional GETs are answered from the owner's task version alone, before
+# any task is loaded or serialized.
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    if not etags.none_match(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Authorization"})
+    return None
+
+def _set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Vary"] = "Authorization"
+
+@api_router.get("/tasks", response_model=Union[schemas.TaskPage, List[schemas.Task]])
+async def read_tasks(
+    request: Request,
+    response: Response,
     skip: int = Query(0, ge=0), 
     limit: int = Query(10, ge=1), 
-    db: Session = Depends(get_db), 
-    current_user: models.User = Depends(auth.get_current_user)
+    cursor: Optional[str] = Query(None),
+    params: schemas.TaskListParams = Depends(),
+    db: DbRunner = Depends(get_runner), 
+    current_user: models.User = Depends(auth.current_user)
+):
+    version = await db.run(crud.task_list_version, current_user.id)
+    etag = etags.list_etag(current_user.id, version, request.query_params.multi_items())
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    _set_etag(response, etag)
+
+    if cursor is None:
+        # Offset paging, kept for clients that don't send a cursor
+        if FAST_JSON:
+            rows = await db.run(crud.list_task_rows, current_user.id, params, skip, limit)
+            return FastJSONResponse(task_rows(rows), headers=dict(response.headers))
+        return await db.run(crud.list_tasks, current_user.id, params, skip, limit)
+
+    # Keyset paging: an empty cursor starts at the first page, every page
+    # seeks on (owner_id, sort key, id) so its cost doesn't depend on how
+    # deep it is. Filters must stay the same between pages.
+    after = None
+    if cursor:
+        try:
+            value, last_id = decode_keyset(cursor, params.sort, params.order)
+            if params.sort == "due_date" and value is not None:
+                value = date.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        after = (value, last_id)
+    list_after = crud.list_task_rows_after if FAST_JSON else crud.list_tasks_after
+    tasks = await db.run(list_after, current_user.id, params, after, limit + 1)
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        last = tasks[-1]
+        value = getattr(last, params.sort)
+        if isinstance(value, date):
+            value = value.isoformat()
+        next_cursor = encode_keyset(params.sort, params.order, value, last.id)
+    if FAST_JSON:
+        return FastJSONResponse({"items": task_rows(tasks), "next_cursor": next_cursor}, headers=dict(response.headers))
+    return {"items": tasks, "next_cursor": next_cursor}
+
+@api_router.get("/tasks/search", response_model=List[schemas.Task])
+async def search_tasks(
+    q: str = Query(..., min_length=1, max_length=200),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=100),
+    db: DbRunner = Depends(get_runner),
+    current_user: models.User = Depends(auth.current_user)
+):
+    try:
+        return await db.run(crud.search_tasks, current_user.id, q, skip, limit)
+    except ValueError as exc:
+        # The database has no full-text index this search can use
+        raise HTTPException(status_code=501, detail=str(exc))
+
+@api_router.get("/tasks/stats", response_model=schemas.TaskStats)
+async def read_task_stats(db: DbRunner = Depends(get_runner), current_user: models.User = Depends(auth.current_user)):
+    return await db.run(crud.task_stats, current_user.id)
+
+# Delta sync: apply "deleted" first, then "changed", then keep next_token.
+# Without a token (or after reset) the changes are a full snapshot.
+@api_router.get("/tasks/changes", response_model=schemas.TaskChanges)
+async def read_task_changes(
+    since: Optional[str] = Query(None),
+    limit: int = Query(500, ge=1, le=1000),
+    db: DbRunner = Depends(get_runner),
+    current_user: models.User = Depends(auth.current_user)
+):
+    try:
+        since_seq = sync.decode_token(since) if since else 0
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return await db.run(crud.task_changes, current_user.id, since_seq, limit)
+
+# Streams every task of the user, encoded chunk by chunk as it's read
+@api_router.get("/tasks/export")
+async def export_tasks(
+    format: Literal["ndjson", "csv"] = Query("ndjson"),
+    db: DbRunner = Depends(get_runner),
+    current_user: models.User = Depends(auth.current_user)
+):
+    media_type, extension, _, _ = export.FORMATS[format]
+    return StreamingResponse(
+        export.export_body(db, current_user.id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="tasks.{extension}"'},
+    )
+
+# Accepts an NDJSON or CSV upload (the export formats) and imports it in the
+# background; progress and per-row errors are at the Location returned.
+@api_router.post("/tasks/import", response_model=schemas.TaskImportJob, status_code=202)
+async def import_tasks(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    format: Literal["ndjson", "csv"] = Query("ndjson"),
+    db: DbRunner = Depends(get_runner),
+    current_user: models.User = Depends(auth.current_user)
 ):
-    tasks = db.query(models.Task).filter(models.Task.owner_id == current_user.id).offset(skip).limit(limit).all()
-    return tasks
+    too_large = HTTPException(status_code=413, detail=f"Uploads are limited to {imports.IMPORT_MAX_BYTES} bytes")
+    if int(request.headers.get("content-length") or 0) > imports.IMPORT_MAX_BYTES:
+        raise too_large
+    if imports.jobs.active(current_user.id) >= imports.IMPORT_MAX_ACTIVE:
+        raise HTTPException(status_code=429, detail="Too many imports in progress", headers={"Retry-After": "5"})
+    # Registered before the upload is read so concurrent uploads count
+    # against the limit
+    job = imports.ImportJob(current_user.id, format)
+    imports.jobs.add(job)
+    try:
+        upload = await imports.spool_upload(request.stream())
+    except imports.UploadTooLarge:
+        imports.jobs.discard(job)
+        raise too_large
+    except BaseException:
+        imports.jobs.discard(job)
+        raise
+    background_tasks.add_task(imports.run_import, job, db, upload)
+    # Imported tasks reach the reminder heap through a reload
+    background_tasks.add_task(reminder_scheduler.refresh)
+    response.headers["Location"] = f"{request.url.path}/{job.id}"
+    return job
+
+@api_router.get("/tasks/import/{job_id}", response_model=schemas.TaskImportJob)
+async def read_import(job_id: str, current_user: models.User = Depends(auth.current_user)):
+    job = imports.jobs.get(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return job
 
 @api_router.get("/tasks/{task_id}", response_model=schemas.Task) 
-def read_task(task_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    task = db.query(models.Task).filter(models.Task.id == task_id, models.Task.owner_id == current_user.id).first()
+async def read_task(task_id: int, request: Request, response: Response, db: DbRunner = Depends(get_runner), current_user: models.User = Depends(auth.current_user)):
+    if request.headers.get("if-none-match") is not None:
+        version = await db.run(crud.get_task_version, current_user.id, task_id)
+        if version is not None:
+            not_modified = _not_modified(request, etags.task_etag(task_id, version))
+            if not_modified is not None:
+                return not_modified
+    task = await db.run(crud.get_task, current_user.id, task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
+    _set_etag(response, etags.task_etag(task.id, task.version))
     return task
 
-@api_router.put("/tasks/{task_id}", response_model=schemas.Task) 
-def update_task(task_id: int, task: schemas.TaskCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    db_task = db.query(models.Task).filter(models.Task.id == task_id, models.Task.owner_id == current_user.id).first()
+# Writes honour If-Match: the version check is part of the write statement,
+# and only a failed write costs a second query to tell 412 from 404.
+async def _conditional_write(write, task_id: int, request: Request, response: Response, db: DbRunner, current_user: models.User, *args):
+    expected_version = etags.expected_version(request.headers.get("if-match"), task_id)
+    db_task = await db.run(write, current_user.id, task_id, *args, expected_version)
     if db_task is None:
+        if expected_version is not None and await db.run(crud.get_task_version, current_user.id, task_id) is not None:
+            raise HTTPException(status_code=412, detail="Task has been modified")
         raise HTTPException(status_code=404, detail="Task not found")
-    for key, value in task.model_dump().items():
-        setattr(db_task, key, value)
-    db.commit()
-    db.refresh(db_task)
+    _set_etag(response, etags.task_etag(db_task.id, db_task.version))
+    return db_task
+
+@api_router.put("/tasks/{task_id}", response_model=schemas.Task) 
+async def update_task(task_id: int, task: schemas.TaskCreate, request: Request, response: Response, db: DbRunner = Depends(get_runner), current_user: models.User = Depends(auth.current_user)):
+    db_task = await _conditional_write(crud.update_task, task_id, request, response, db, current_user, task.model_dump())
+    task_events.record(db, current_user.id, changed=[task_id])
+    reminder_scheduler.task_changed(db_task)
+    return db_task
+
+@api_router.patch("/tasks/{task_id}", response_model=schemas.Task)
+async def patch_task(task_id: int, task: schemas.TaskPatch, request: Request, response: Response, db: DbRunner = Depends(get_runner), current_user: models.User = Depends(auth.current_user)):
+    db_task = await _conditional_write(crud.update_task, task_id, request, response, db, current_user, task.model_dump(exclude_none=True))
+    task_events.record(db, current_user.id, changed=[task_id])
+    reminder_scheduler.task_changed(db_task)
     return db_task
 
 @api_router.delete("/tasks/{task_id}", response_model=schemas.Task) 
-def delete_task(task_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    db_task = db.query(models.Task).filter(models.Task.id == task_id, models.Task.owner_id == current_user.id).first()
-    if db_task is None:
-        raise HTTPException(status_code=404, detail="Task not found")
-    db.delete(db_task)
-    db.commit()
+async def delete_task(task_id: int, request: Request, response: Response, db: DbRunner = Depends(get_runner), current_user: models.User = Depends(auth.current_user)):
+    db_task = await _conditional_write(crud.delete_task, task_id, request, response, db, current_user)
+    task_events.record(db, current_user.id, deleted=[task_id])
+    reminder_scheduler.task_deleted(task_id)
     return db_task
 
+# FCM tokens of the user's devices, where due-date reminders are pushed
+@api_router.post("/devices", status_code=204)
+async def register_device(device: schemas.DeviceTokenCreate, db: DbRunner = Depends(get_runner), current_user: models.User = Depends(auth.current_user)):
+    await db.run(crud.add_device_token, current_user.id, device.token)
+    return Response(status_code=204)
 
-manager = ConnectionManager()
+@api_router.delete("/devices/{token}", status_code=204)
+async def unregister_device(token: str, db: DbRunner = Depends(get_runner), current_user: models.User = Depends(auth.current_user)):
+    await db.run(crud.delete_device_tokens, [token], current_user.id)
+    return Response(status_code=204)
 
+
+@app.get("/metrics")
+def read_metrics():
+    return {
+        "db_pool": database.pool_stats(),
+        "principal_cache": auth.principal_cache.stats(),
+        "password_hasher": auth.password_hasher.stats(),
+        "websockets": manager.stats(),
+        "task_events": dict(task_events.stats(), sockets=task_manager.stats()),
+        "push": notifications.dispatcher.stats(),
+        "reminders": reminder_scheduler.stats(),
+    }
+
+
+# Set WS_BROKER_URL when running more than one worker (see broker.py)
+manager = ConnectionManager(broker=broker_from_url())
+# Task events have their own manager and channel: chat sockets name their
+# user id themselves, task event sockets are authenticated
+task_manager = ConnectionManager(broker=broker_from_url(channel=f"{WS_BROKER_CHANNEL}:tasks"))
+task_events = events.TaskEvents(task_manager)
+
+# Due-date reminders, sent through the push dispatcher (see reminders.py)
+reminder_scheduler = reminders.ReminderScheduler(notifications.dispatcher)
+notifications.dispatcher.on_dead_token = reminder_scheduler.forget_device_token
+
+# Messages go to everyone connected, or only to the room's members when the
+# client joined one with ?room=. Clients that pass ?resume= get framed
+# messages and what they missed since that id (see connections.py).
 @app.websocket("/ws/chat/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, user_id: int, room: Optional[str] = None, resume: Optional[str] = None):
+    if not await manager.connect(websocket, user_id=user_id, rooms=[room] if room else (), resume=resume):
+        return
     try:
         while True:
-            data = await websocket.receive_text()
-            await manager.broadcast(f"User {user_id} says: {data}")
+            data = await manager.receive_text(websocket)
+            if room:
+                await manager.send_to_room(room, f"User {user_id} says: {data}")
+            else:
+                await manager.broadcast(f"User {user_id} says: {data}")
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
+# Pushes the user's task change events (see events.py). Browsers can't set
+# headers on a WebSocket, so the access token may come as ?token=. ?resume=
+# works as for chat.
+@app.websocket("/ws/tasks")
+async def task_events_endpoint(websocket: WebSocket, token: Optional[str] = None, resume: Optional[str] = None,
+                               db: DbRunner = Depends(get_runner)):
+    authorization = websocket.headers.get("authorization", "")
+    if token is None and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    try:
+        current_user = await auth.user_from_token(token or "", db)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    if not await task_manager.connect(websocket, user_id=current_user.id, resume=resume):
+        return
+    # Where the client stands: anything after this seq comes as events
+    version = await db.run(crud.task_list_version, current_user.id)
+    await task_manager.send_message(json.dumps({"type": "hello", "seq": version}), websocket)
+    try:
+        while True:
+            await task_manager.receive_text(websocket)
+    except WebSocketDisconnect:
+        task_manager.disconnect(websocket)
+
 
 app.include_router(api_router, prefix="/api/v1")
@@ -0,0 +1,229 @@
+import argparse
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import Column, DateTime, Enum, MetaData, String, Table, bindparam, inspect, select, text, update
+from sqlalchemy import Date as SADate
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .models import DeviceToken, TaskCounts, TaskReminder, TaskStatus, TaskTombstone, parse_status
+from . import search, stats
+
+# Schema changes that create_all can't apply to an existing database. Each
+# migration is idempotent and records itself in schema_migrations; data is
+# converted in bounded batches, each in its own transaction, so a large
+# table never sits behind one long lock and an interrupted run can resume.
+DEFAULT_BATCH_SIZE = 1000
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("name", String, primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+LEGACY_TASK_INDEXES = ("ix_tasks_id", "ix_tasks_title", "ix_tasks_description", "ix_tasks_status", "ix_tasks_due_date")
+
+
+def parse_legacy_status(value: Optional[str]) -> TaskStatus:
+    return parse_status(value) or TaskStatus.pending
+
+
+def parse_legacy_due_date(value) -> Optional[date]:
+    if value is None or isinstance(value, date):
+        return value
+    value = str(value).strip()
+    for parse in (date.fromisoformat, lambda v: datetime.fromisoformat(v).date()):
+        try:
+            return parse(value)
+        except ValueError:
+            continue
+    return None
+
+
+def _column_types(engine: Engine, table: str):
+    return {column["name"]: column["type"] for column in inspect(engine).get_columns(table)}
+
+
+def _typed_task_schema(engine: Engine, batch_size: int):
+    if not inspect(engine).has_table("tasks"):
+        return
+    columns = _column_types(engine, "tasks")
+    if isinstance(columns["due_date"], SADate) and "status_typed" not in columns:
+        return
+
+    status_type = Enum(TaskStatus, name="task_status")
+    with engine.begin() as conn:
+        status_type.create(conn, checkfirst=True)
+        type_sql = status_type.compile(dialect=conn.dialect)
+        if "status_typed" not in columns:
+            conn.execute(text(f"ALTER TABLE tasks ADD COLUMN status_typed {type_sql}"))
+        if "due_date_typed" not in columns:
+            conn.execute(text("ALTER TABLE tasks ADD COLUMN due_date_typed DATE"))
+
+    legacy = Table(
+        "tasks", MetaData(),
+        Column("id", primary_key=True),
+        Column("status"),
+        Column("due_date"),
+        Column("status_typed", status_type),
+        Column("due_date_typed", SADate),
+    )
+    # Binding through the typed columns stores the enum and date the way the
+    # dialect expects them.
+    convert = (
+        update(legacy)
+        .where(legacy.c.id == bindparam("row_id"))
+        .values(status_typed=bindparam("new_status"), due_date_typed=bindparam("new_due_date"))
+    )
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(legacy.c.id, legacy.c.status, legacy.c.due_date)
+                .where(legacy.c.id > last_id, legacy.c.status_typed.is_(None))
+                .order_by(legacy.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            conn.execute(convert, [
+                {
+                    "row_id": row.id,
+                    "new_status": parse_legacy_status(row.status),
+                    "new_due_date": parse_legacy_due_date(row.due_date),
+                }
+                for row in rows
+            ])
+            last_id = rows[-1].id
+
+    with engine.begin() as conn:
+        for statement in stats.DROP_TRIGGERS.get(conn.dialect.name, []):
+            conn.execute(text(statement))
+        for name in LEGACY_TASK_INDEXES + ("ix_tasks_owner_id_id", "ix_tasks_owner_id_status_due_date"):
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        conn.execute(text("ALTER TABLE tasks DROP COLUMN status"))
+        conn.execute(text("ALTER TABLE tasks DROP COLUMN due_date"))
+        conn.execute(text("ALTER TABLE tasks RENAME COLUMN status_typed TO status"))
+        conn.execute(text("ALTER TABLE tasks RENAME COLUMN due_date_typed TO due_date"))
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("ALTER TABLE tasks ALTER COLUMN status SET NOT NULL"))
+        conn.execute(text("CREATE INDEX ix_tasks_owner_id_id ON tasks (owner_id, id)"))
+        conn.execute(text("CREATE INDEX ix_tasks_owner_id_status_due_date ON tasks (owner_id, status, due_date)"))
+
+
+# Indexes behind the due_date and title sort orders of GET /tasks
+def _task_sort_indexes(engine: Engine, batch_size: int):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tasks_owner_id_due_date ON tasks (owner_id, due_date)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tasks_owner_id_title ON tasks (owner_id, title)"))
+
+
+# Full-text search index; rows that predate it are indexed by the rebuild
+def _task_search_index(engine: Engine, batch_size: int):
+    with engine.begin() as conn:
+        for statement in search.ddl(conn.dialect.name):
+            conn.execute(text(statement))
+        if conn.dialect.name == "sqlite":
+            conn.execute(text(search.SQLITE_REBUILD))
+
+
+# Per-owner counters; 0001 drops their triggers when it retypes tasks.status
+def _task_counts(engine: Engine, batch_size: int):
+    TaskCounts.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        for statement in stats.ddl(conn.dialect.name):
+            conn.execute(text(statement))
+    with Session(engine) as session:
+        stats.rebuild_task_counts(session)
+
+
+# Row versions and per-owner versions for ETags; the counter triggers are
+# recreated because they now bump the owner's version on every write.
+def _task_versions(engine: Engine, batch_size: int):
+    missing = [table for table in ("tasks", "task_counts") if "version" not in _column_types(engine, table)]
+    with engine.begin() as conn:
+        for table in missing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+        for statement in stats.DROP_TRIGGERS.get(conn.dialect.name, []) + stats.ddl(conn.dialect.name):
+            conn.execute(text(statement))
+
+
+# Change sequences and tombstones for delta sync. Existing rows are stamped
+# with their owner's current version so a first sync picks them all up.
+def _task_change_seq(engine: Engine, batch_size: int):
+    missing = {
+        table: column
+        for table, column in (("tasks", "change_seq"), ("task_counts", "pruned_seq"))
+        if column not in _column_types(engine, table)
+    }
+    TaskTombstone.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        for table, column in missing.items():
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tasks_owner_id_change_seq ON tasks (owner_id, change_seq)"))
+        for statement in stats.DROP_TRIGGERS.get(conn.dialect.name, []) + stats.ddl(conn.dialect.name):
+            conn.execute(text(statement))
+
+    stamp = text(
+        "UPDATE tasks SET change_seq = COALESCE("
+        "(SELECT version FROM task_counts WHERE task_counts.owner_id = tasks.owner_id), 0) "
+        "WHERE id > :last_id AND id <= :last_id + :batch_size AND change_seq = 0"
+    )
+    with engine.connect() as conn:
+        max_id = conn.execute(text("SELECT MAX(id) FROM tasks")).scalar() or 0
+    for last_id in range(0, max_id, batch_size):
+        with engine.begin() as conn:
+            conn.execute(stamp, {"last_id": last_id, "batch_size": batch_size})
+
+
+# Due-date index and the tables behind reminders.py
+def _task_reminders(engine: Engine, batch_size: int):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tasks_due_date_id ON tasks (due_date, id)"))
+    TaskReminder.__table__.create(bind=engine, checkfirst=True)
+    DeviceToken.__table__.create(bind=engine, checkfirst=True)
+
+
+# Status-filtered listings sorted by id or title
+def _task_status_sort_indexes(engine: Engine, batch_size: int):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tasks_owner_id_status_id ON tasks (owner_id, status, id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tasks_owner_id_status_title ON tasks (owner_id, status, title)"))
+
+
+MIGRATIONS = [
+    ("0001_typed_task_schema", _typed_task_schema),
+    ("0002_task_sort_indexes", _task_sort_indexes),
+    ("0003_task_search_index", _task_search_index),
+    ("0004_task_counts", _task_counts),
+    ("0005_task_versions", _task_versions),
+    ("0006_task_change_seq", _task_change_seq),
+    ("0007_task_reminders", _task_reminders),
+    ("0008_task_status_sort_indexes", _task_status_sort_indexes),
+]
+
+
+def run_migrations(engine: Engine, batch_size: int = DEFAULT_BATCH_SIZE):
+    migration_metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        applied = set(conn.execute(select(schema_migrations.c.name)).scalars())
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        migrate(engine, batch_size)
+        with engine.begin() as conn:
+            conn.execute(schema_migrations.insert().values(name=name, applied_at=datetime.utcnow()))
+        print(f"Applied migration {name}")
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    run_migrations(engine, batch_size=args.batch_size)
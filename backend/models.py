@@ -1,7 +1,38 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+import enum
+import re
+from typing import Optional
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index, Date, DateTime, Enum, func, text
 from sqlalchemy.orm import relationship
 from .database import Base
 
+class TaskStatus(str, enum.Enum):
+    pending = "pending"
+    in_progress = "in_progress"
+    completed = "completed"
+
+# Other spellings of the statuses, from the old free-form column and clients
+# that still send free text
+STATUS_ALIASES = {
+    "todo": TaskStatus.pending,
+    "to_do": TaskStatus.pending,
+    "open": TaskStatus.pending,
+    "new": TaskStatus.pending,
+    "in_progress": TaskStatus.in_progress,
+    "inprogress": TaskStatus.in_progress,
+    "doing": TaskStatus.in_progress,
+    "started": TaskStatus.in_progress,
+    "done": TaskStatus.completed,
+    "complete": TaskStatus.completed,
+    "completed": TaskStatus.completed,
+    "finished": TaskStatus.completed,
+}
+
+def parse_status(value: Optional[str]) -> Optional[TaskStatus]:
+    key = re.sub(r"[\s\-]+", "_", (value or "").strip().lower())
+    if key in TaskStatus.__members__:
+        return TaskStatus(key)
+    return STATUS_ALIASES.get(key)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -16,11 +47,74 @@ class User(Base):
 class Task(Base):
     __tablename__ = "tasks"
 
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
-    description = Column(String, index=True)
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    description = Column(String)
     owner_id = Column(Integer, ForeignKey('users.id'))
-    status = Column(String, index=True)
-    due_date = Column(String, index=True)
+    status = Column(Enum(TaskStatus, name="task_status"), nullable=False, default=TaskStatus.pending)
+    due_date = Column(Date)
+    # Bumped by every update; the task's ETag
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
+    # Owner's task version at the last write, stamped by triggers (see stats.py)
+    change_seq = Column(Integer, nullable=False, default=0, server_default=text("0"))
 
     owner = relationship("User", back_populates="tasks")
+
+    # Indexes follow the queries in main.py rather than individual columns;
+    # every extra index is paid for on each write.
+    __table_args__ = (
+        # owner_id = ? AND id > ? ORDER BY id (keyset pagination)
+        Index("ix_tasks_owner_id_id", "owner_id", "id"),
+        # owner_id = ? AND status = ? ORDER BY due_date / id / title
+        Index("ix_tasks_owner_id_status_due_date", "owner_id", "status", "due_date"),
+        Index("ix_tasks_owner_id_status_id", "owner_id", "status", "id"),
+        Index("ix_tasks_owner_id_status_title", "owner_id", "status", "title"),
+        # owner_id = ? [AND due_date range] ORDER BY due_date / ORDER BY title
+        Index("ix_tasks_owner_id_due_date", "owner_id", "due_date"),
+        Index("ix_tasks_owner_id_title", "owner_id", "title"),
+        # owner_id = ? AND change_seq > ? ORDER BY change_seq (delta sync)
+        Index("ix_tasks_owner_id_change_seq", "owner_id", "change_seq"),
+        # due_date BETWEEN ? AND ? ORDER BY due_date, id (reminders.py)
+        Index("ix_tasks_due_date_id", "due_date", "id"),
+    )
+
+# Maintained by triggers on tasks (see stats.py), never written directly
+class TaskCounts(Base):
+    __tablename__ = "task_counts"
+
+    owner_id = Column(Integer, ForeignKey('users.id'), primary_key=True, autoincrement=False)
+    pending = Column(Integer, nullable=False, default=0)
+    in_progress = Column(Integer, nullable=False, default=0)
+    completed = Column(Integer, nullable=False, default=0)
+    # Bumped by every write to the owner's tasks; the ETag of their listings
+    # and the delta sync sequence
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
+    # Tombstones up to here have been pruned; older sync tokens must resync
+    pruned_seq = Column(Integer, nullable=False, default=0, server_default=text("0"))
+
+# Deleted tasks, kept so delta sync can report deletions
+class TaskTombstone(Base):
+    __tablename__ = "task_tombstones"
+
+    owner_id = Column(Integer, ForeignKey('users.id'), primary_key=True, autoincrement=False)
+    change_seq = Column(Integer, primary_key=True, autoincrement=False)
+    task_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False, server_default=func.now())
+
+# Reminders that have fired, one per task and due date. A worker sends a
+# reminder only after inserting its row, so it goes out once however many
+# workers are running or restart.
+class TaskReminder(Base):
+    __tablename__ = "task_reminders"
+
+    task_id = Column(Integer, primary_key=True, autoincrement=False)
+    due_date = Column(Date, primary_key=True)
+    sent_at = Column(DateTime, nullable=False, server_default=func.now())
+
+# FCM registration tokens of a user's devices
+class DeviceToken(Base):
+    __tablename__ = "device_tokens"
+
+    token = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
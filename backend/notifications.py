@@ -1,10 +1,253 @@
-from pyfcm import FCMNotification
+import asyncio
 import os
+import random
+from typing import Callable, Dict, List, Optional, Tuple
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 load_dotenv()
-push_service = FCMNotification(api_key=os.getenv("FIREBASE_SERVER_KEY"))
 
-def send_push_notification(token: str, message: str):
-    result = push_service.notify_single_device(registration_id=token, message_body=message)
-    return result
+# Push notifications go through a dispatcher running on the event loop:
+# callers only enqueue, and a batcher groups the queued tokens that share a
+# message and hands each group to the sender, with at most PUSH_CONCURRENCY
+# groups in flight. Tokens that fail for a transient reason are retried with
+# exponential backoff; tokens FCM reports as unregistered are pruned.
+
+FIREBASE_SERVICE_ACCOUNT_FILE = os.getenv("FIREBASE_SERVICE_ACCOUNT_FILE", "")
+FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID", "")
+
+# Notifications waiting to be batched; beyond this, submit() refuses more
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", "10000"))
+PUSH_CONCURRENCY = int(os.getenv("PUSH_CONCURRENCY", "8"))
+PUSH_BATCH_SIZE = int(os.getenv("PUSH_BATCH_SIZE", "500"))
+# How long the batcher waits for more tokens after the first one arrives
+PUSH_BATCH_DELAY = float(os.getenv("PUSH_BATCH_DELAY", "0.01"))
+PUSH_MAX_ATTEMPTS = int(os.getenv("PUSH_MAX_ATTEMPTS", "5"))
+PUSH_RETRY_BASE = float(os.getenv("PUSH_RETRY_BASE", "0.5"))
+PUSH_RETRY_MAX = float(os.getenv("PUSH_RETRY_MAX", "30"))
+# Dead tokens are remembered long enough to drop what's already queued or
+# retrying for them; on_dead_token removes them from storage for good
+PUSH_DEAD_TOKEN_TTL = float(os.getenv("PUSH_DEAD_TOKEN_TTL", "3600"))
+PUSH_DEAD_TOKENS = int(os.getenv("PUSH_DEAD_TOKENS", "10000"))
+
+# What a sender reports for each token
+SENT = "sent"
+RETRY = "retry"     # transient; try again later
+DEAD = "dead"       # the token is no longer registered
+FAILED = "failed"   # permanent for this message, e.g. rejected payload
+
+# Sends one message to a group of tokens through FCM. The HTTP v1 API that
+# pyfcm speaks has no multicast, so the group's requests go out concurrently
+# on pyfcm's per-thread sessions. The client is only created on first use.
+class FCMSender:
+    def __init__(self, service_account_file: str = FIREBASE_SERVICE_ACCOUNT_FILE, project_id: str = FIREBASE_PROJECT_ID):
+        self.service_account_file = service_account_file
+        self.project_id = project_id
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from pyfcm import FCMNotification
+
+            self._client = FCMNotification(service_account_file=self.service_account_file, project_id=self.project_id)
+        return self._client
+
+    async def send(self, tokens: List[str], message: str) -> Dict[str, str]:
+        outcomes = await asyncio.gather(*(asyncio.to_thread(self._notify, token, message) for token in tokens))
+        return dict(zip(tokens, outcomes))
+
+    def _notify(self, token: str, message: str) -> str:
+        from pyfcm.errors import FCMError, FCMNotRegisteredError, FCMServerError, RetryAfterException
+        from requests import RequestException
+
+        try:
+            self.client.notify(fcm_token=token, notification_body=message)
+        except FCMNotRegisteredError:
+            return DEAD
+        except (FCMServerError, RetryAfterException, RequestException):
+            return RETRY
+        except FCMError:
+            return FAILED
+        return SENT
+
+# (message, token, attempts so far)
+_Item = Tuple[str, str, int]
+
+class PushDispatcher:
+    def __init__(self, sender, queue_size: int = PUSH_QUEUE_SIZE, concurrency: int = PUSH_CONCURRENCY,
+                 batch_size: int = PUSH_BATCH_SIZE, batch_delay: float = PUSH_BATCH_DELAY,
+                 max_attempts: int = PUSH_MAX_ATTEMPTS, retry_base: float = PUSH_RETRY_BASE,
+                 retry_max: float = PUSH_RETRY_MAX, on_dead_token: Optional[Callable[[str], None]] = None,
+                 dead_token_ttl: float = PUSH_DEAD_TOKEN_TTL, max_dead_tokens: int = PUSH_DEAD_TOKENS):
+        self.sender = sender
+        self.queue_size = queue_size
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        # Called with every token found dead, to remove it wherever it's stored
+        self.on_dead_token = on_dead_token
+        self.dead_tokens = TTLCache(maxsize=max_dead_tokens, ttl=dead_token_ttl)
+        self._queue = None
+        self._slots = None
+        self._batcher = None
+        self._sending = set()
+        self._retries = set()
+        # Submitted and not yet sent, failed or given up on
+        self._outstanding = 0
+        self._idle = None
+        self.submitted = 0
+        self.rejected = 0
+        self.batches = 0
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self.failed = 0
+        self.errors = 0
+
+    def _start(self):
+        # Everything is tied to the loop that starts it; a dispatcher left on
+        # a loop that has since stopped starts over
+        loop = asyncio.get_running_loop()
+        if self._batcher is not None and self._batcher.get_loop() is loop:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._outstanding = 0
+        self._sending.clear()
+        self._retries.clear()
+        self._batcher = asyncio.create_task(self._batch())
+
+    # Queues a notification without waiting; must be called on the event
+    # loop. Returns False when it was refused (queue full or dead token).
+    def submit(self, token: str, message: str) -> bool:
+        if token in self.dead_tokens:
+            return False
+        self._start()
+        try:
+            self._queue.put_nowait((message, token, 0))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.submitted += 1
+        self._outstanding += 1
+        self._idle.clear()
+        return True
+
+    async def _batch(self):
+        while True:
+            first = await self._queue.get()
+            # Let the tokens submitted along with the first one arrive
+            await asyncio.sleep(self.batch_delay)
+            groups: Dict[str, List[_Item]] = {first[0]: [first]}
+            for _ in range(self._queue.qsize()):
+                item = self._queue.get_nowait()
+                group = groups.setdefault(item[0], [])
+                group.append(item)
+                if len(group) >= self.batch_size:
+                    await self._launch(groups.pop(item[0]))
+            for group in groups.values():
+                await self._launch(group)
+
+    async def _launch(self, items: List[_Item]):
+        # Waiting for a slot holds the batcher back, so the queue fills and
+        # submit() starts refusing instead of work piling up in memory
+        await self._slots.acquire()
+        task = asyncio.create_task(self._send(items))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, items: List[_Item]):
+        try:
+            self.batches += 1
+            message = items[0][0]
+            try:
+                outcomes = await self.sender.send([token for _, token, _ in items], message)
+            except Exception:
+                self.errors += 1
+                outcomes = {}
+            for item in items:
+                self._settle(item, outcomes.get(item[1], RETRY))
+        finally:
+            self._slots.release()
+
+    def _settle(self, item: _Item, outcome: str):
+        message, token, attempts = item
+        if outcome == RETRY and attempts + 1 < self.max_attempts:
+            self.retried += 1
+            delay = min(self.retry_max, self.retry_base * 2 ** attempts) * random.uniform(0.5, 1)
+            task = asyncio.create_task(self._retry((message, token, attempts + 1), delay))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+            return
+        if outcome == SENT:
+            self.sent += 1
+        elif outcome == DEAD:
+            self._prune(token)
+        else:
+            self.failed += 1
+        self._finish()
+
+    async def _retry(self, item: _Item, delay: float):
+        await asyncio.sleep(delay)
+        if item[1] in self.dead_tokens:
+            self._finish()
+            return
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.failed += 1
+            self._finish()
+
+    def _prune(self, token: str):
+        if token in self.dead_tokens:
+            return
+        self.dead += 1
+        self.dead_tokens[token] = True
+        if self.on_dead_token is not None:
+            try:
+                self.on_dead_token(token)
+            except Exception:
+                self.errors += 1
+
+    def _finish(self):
+        self._outstanding -= 1
+        if self._outstanding == 0:
+            self._idle.set()
+
+    # Waits until everything submitted has been sent or given up on
+    async def join(self):
+        if self._idle is not None:
+            await self._idle.wait()
+
+    async def stop(self):
+        tasks = list(self._retries) + list(self._sending) + ([self._batcher] if self._batcher is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._batcher = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": len(self._sending),
+            "retrying": len(self._retries),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead": self.dead,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+dispatcher = PushDispatcher(FCMSender())
+
+def send_push_notification(token: str, message: str) -> bool:
+    return dispatcher.submit(token, message)
@@ -0,0 +1,44 @@
+import base64
+import json
+from typing import Any, Dict, Tuple
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Cursors are opaque to clients: url-safe base64 of the sort key values of the
+# last row on the previous page.
+def encode_cursor(values: Dict[str, Any]) -> str:
+    raw = json.dumps(values, separators=(",", ":"), sort_keys=True).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor("Invalid cursor") from exc
+    if not isinstance(values, dict):
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+
+# Keyset cursors remember the ordering they were issued for, so a cursor
+# can't be replayed against a different sort. Cursors from before sorting
+# existed ({"id": n}) are id-ascending cursors.
+def encode_keyset(sort: str, order: str, value: Any, last_id: int) -> str:
+    if sort == "id":
+        return encode_cursor({"id": last_id} if order == "asc" else {"id": last_id, "order": order})
+    return encode_cursor({"sort": sort, "order": order, "value": value, "id": last_id})
+
+
+def decode_keyset(cursor: str, sort: str, order: str) -> Tuple[Any, int]:
+    values = decode_cursor(cursor)
+    if values.get("sort", "id") != sort or values.get("order", "asc") != order:
+        raise InvalidCursor("Cursor was issued for a different sort order")
+    try:
+        return values.get("value"), int(values["id"])
+    except (KeyError, TypeError, ValueError) as exc:
+        raise InvalidCursor("Invalid cursor") from exc
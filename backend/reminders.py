@@ -0,0 +1,222 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from . import crud
+from .dependencies import open_runner
+from .models import TaskStatus
+
+# Due-date reminders. A task is reminded of at REMINDER_HOUR (UTC) on its due
+# date. Each worker keeps the reminders of the next REMINDER_WINDOW seconds
+# in a heap ordered by firing time and sleeps until the first one is due.
+# The heap is filled from the due date index a page at a time, so a busy day
+# never has to fit in memory at once.
+#
+# Task writes on this worker update the heap as they happen; writes on other
+# workers are picked up by the reload every REMINDER_RELOAD seconds. Before a
+# reminder is handed to the push dispatcher it's claimed in task_reminders,
+# so it goes out once even though every worker holds it, and a restarted
+# worker neither repeats the day's reminders nor skips the ones it missed.
+
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "true").lower() in ("1", "true", "yes")
+REMINDER_HOUR = int(os.getenv("REMINDER_HOUR", "9"))
+REMINDER_WINDOW = float(os.getenv("REMINDER_WINDOW", str(24 * 3600)))
+REMINDER_PAGE_SIZE = int(os.getenv("REMINDER_PAGE_SIZE", "1000"))
+REMINDER_RELOAD = float(os.getenv("REMINDER_RELOAD", "300"))
+# Wait after a failed round before reloading from the database
+REMINDER_RETRY = float(os.getenv("REMINDER_RETRY", "5"))
+
+def reminder_message(title: Optional[str]) -> str:
+    return f"Due today: {title}" if title else "A task is due today"
+
+# Claims the reminders and looks up where to send them in one transaction, so
+# a failed lookup doesn't leave reminders claimed but never sent
+def _claim(db, reminders: List[Tuple[int, date]]):
+    claimed = crud.claim_reminders(db, reminders)
+    tokens = crud.device_tokens(db, list({owner_id for _, owner_id, _ in claimed})) if claimed else {}
+    return claimed, tokens
+
+class ReminderScheduler:
+    def __init__(self, dispatcher, open_runner=open_runner, hour: int = REMINDER_HOUR, window: float = REMINDER_WINDOW,
+                 page_size: int = REMINDER_PAGE_SIZE, reload: float = REMINDER_RELOAD, clock=time.time):
+        self.dispatcher = dispatcher
+        self.open_runner = open_runner
+        self.hour = hour
+        self.window = window
+        self.page_size = page_size
+        self.reload = reload
+        self.clock = clock
+        # Entries are [fire at, tiebreak, task id, owner id, title, due date];
+        # an entry is live while _scheduled maps its task to it
+        self._heap: List[list] = []
+        self._scheduled: Dict[int, list] = {}
+        self._order = itertools.count()
+        # Due dates covered by the heap, and how far into them it's loaded
+        self._start: Optional[date] = None
+        self._end: Optional[date] = None
+        self._cursor: Optional[Tuple[date, int]] = None
+        self._complete = False
+        self._reload_at = 0.0
+        self._wake = None
+        self._runner = None
+        self._stopping = False
+        self._forgetting = set()
+        self.loads = 0
+        self.changes = 0
+        self.fired = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def remind_at(self, due_date: date) -> float:
+        return datetime(due_date.year, due_date.month, due_date.day, self.hour, tzinfo=timezone.utc).timestamp()
+
+    def start(self):
+        if self._runner is None or self._runner.get_loop() is not asyncio.get_running_loop():
+            self._wake = asyncio.Event()
+            self._stopping = False
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Cancelling doesn't interrupt a query running in the threadpool, so
+        # the loop also checks the flag once it returns
+        self._stopping = True
+        if self._wake is not None:
+            self._wake.set()
+        tasks = list(self._forgetting) + ([self._runner] if self._runner is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._runner = None
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                delay = await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Reminders popped in the failed round are still unclaimed in
+                # the database; the reload finds them again
+                self.errors += 1
+                self._reload_at = self.clock() + REMINDER_RETRY
+                delay = REMINDER_RETRY
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    # One round: reload or load the next page when due, fire what's due, and
+    # return how long to sleep before the next round
+    async def tick(self) -> float:
+        now = self.clock()
+        if now >= self._reload_at:
+            await self._reload(now)
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._scheduled.get(entry[2]) is entry:
+                del self._scheduled[entry[2]]
+                due.append(entry)
+        if due:
+            await self._fire(due)
+        # Pages come in due date order, so the next page only matters once
+        # everything loaded so far has fired
+        if not self._scheduled and not self._complete:
+            await self._load_page()
+            return 0.0
+        next_at = self._heap[0][0] if self._heap else self._reload_at
+        return max(0.0, min(next_at, self._reload_at) - self.clock())
+
+    # Reloads the heap on the next round, e.g. after tasks were written in
+    # bulk. A coroutine so background tasks run it on the event loop.
+    async def refresh(self):
+        self._reload_at = 0.0
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _reload(self, now: float):
+        self._heap, self._scheduled = [], {}
+        self._start = datetime.fromtimestamp(now, timezone.utc).date()
+        self._end = datetime.fromtimestamp(now + self.window, timezone.utc).date()
+        self._cursor, self._complete = None, False
+        self._reload_at = now + self.reload
+        async with self.open_runner() as db:
+            # Claims for earlier days can't matter any more
+            await db.run(crud.prune_reminders, self._start)
+        await self._load_page()
+
+    async def _load_page(self):
+        async with self.open_runner() as db:
+            rows = await db.run(crud.due_reminders, self._start, self._end, self._cursor, self.page_size)
+        self.loads += 1
+        for row in rows:
+            self._schedule(row.id, row.owner_id, row.title, row.due_date)
+        if rows:
+            self._cursor = (rows[-1].due_date, rows[-1].id)
+        self._complete = len(rows) < self.page_size
+
+    def _schedule(self, task_id: int, owner_id: int, title: Optional[str], due_date: date) -> list:
+        entry = [self.remind_at(due_date), next(self._order), task_id, owner_id, title, due_date]
+        self._scheduled[task_id] = entry
+        heapq.heappush(self._heap, entry)
+        return entry
+
+    # Whether a reminder for this task and due date belongs in the heap: in
+    # the window, and not past the last page loaded
+    def _covers(self, due_date: date, task_id: int) -> bool:
+        if self._start is None or not self._start <= due_date <= self._end:
+            return False
+        return self._complete or (self._cursor is not None and (due_date, task_id) <= self._cursor)
+
+    # Called by the write routes after their transaction has committed
+    def task_changed(self, task):
+        self._scheduled.pop(task.id, None)
+        if task.due_date is None or task.status == TaskStatus.completed or not self._covers(task.due_date, task.id):
+            return
+        self.changes += 1
+        entry = self._schedule(task.id, task.owner_id, task.title, task.due_date)
+        if self._heap[0] is entry and self._wake is not None:
+            self._wake.set()
+
+    def task_deleted(self, task_id: int):
+        if self._scheduled.pop(task_id, None) is not None:
+            self.changes += 1
+
+    async def _fire(self, due: List[list]):
+        async with self.open_runner() as db:
+            claimed, tokens = await db.run(_claim, [(entry[2], entry[5]) for entry in due])
+        # Claimed by another worker, or changed since it was loaded
+        self.skipped += len(due) - len(claimed)
+        for task_id, owner_id, title in claimed:
+            self.fired += 1
+            for token in tokens.get(owner_id, ()):
+                self.dispatcher.submit(token, reminder_message(title))
+
+    # The dispatcher's dead token hook: forget the token for good
+    def forget_device_token(self, token: str):
+        task = asyncio.create_task(self._forget(token))
+        self._forgetting.add(task)
+        task.add_done_callback(self._forgetting.discard)
+
+    async def _forget(self, token: str):
+        try:
+            async with self.open_runner() as db:
+                await db.run(crud.delete_device_tokens, [token])
+        except Exception:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        return {
+            "scheduled": len(self._scheduled),
+            "heap": len(self._heap),
+            "next_in": round(self._heap[0][0] - self.clock(), 3) if self._heap else None,
+            "loads": self.loads,
+            "changes": self.changes,
+            "fired": self.fired,
+            "skipped": self.skipped,
+            "errors": self.errors,
+        }
@@ -0,0 +1,90 @@
+import os
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+# Recent messages per channel ("all", "user:<id>", "room:<name>"), so a
+# client that reconnects can be sent what it missed instead of refetching
+# everything. Ids come from one counter for all channels, so a client needs
+# to remember a single id whatever it is subscribed to.
+#
+# The buffer as a whole is capped by message count and by size; the oldest
+# messages, whatever their channel, go first.
+
+WS_REPLAY_MESSAGES = int(os.getenv("WS_REPLAY_MESSAGES", "10000"))
+WS_REPLAY_BYTES = int(os.getenv("WS_REPLAY_BYTES", str(8 * 1024 * 1024)))
+# Rough per-message bookkeeping cost counted against WS_REPLAY_BYTES
+ENTRY_OVERHEAD = 100
+
+class _Channel:
+    def __init__(self, dropped: int):
+        self.entries: Deque[Tuple[int, str]] = deque()
+        # Highest id evicted from this channel (or from an earlier channel of
+        # the same name)
+        self.dropped = dropped
+
+class ReplayBuffer:
+    def __init__(self, max_messages: int = WS_REPLAY_MESSAGES, max_bytes: int = WS_REPLAY_BYTES):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.seq = 0
+        self._channels: Dict[str, _Channel] = {}
+        self._order: Deque[Tuple[str, int]] = deque()
+        self.bytes = 0
+        # Highest id evicted from a channel that has no entries left
+        self._forgotten = 0
+        self.evicted = 0
+
+    def append(self, channel: str, message: str) -> int:
+        self.seq += 1
+        if self.max_messages <= 0:
+            self._forgotten = self.seq
+            return self.seq
+        if channel not in self._channels:
+            self._channels[channel] = _Channel(self._forgotten)
+        self._channels[channel].entries.append((self.seq, message))
+        self._order.append((channel, len(message) + ENTRY_OVERHEAD))
+        self.bytes += len(message) + ENTRY_OVERHEAD
+        while len(self._order) > self.max_messages or self.bytes > self.max_bytes:
+            self._evict()
+        return self.seq
+
+    def _evict(self):
+        name, size = self._order.popleft()
+        channel = self._channels[name]
+        channel.dropped = channel.entries.popleft()[0]
+        self.bytes -= size
+        self.evicted += 1
+        if not channel.entries:
+            del self._channels[name]
+            self._forgotten = max(self._forgotten, channel.dropped)
+
+    # The messages on these channels after the given id, oldest first, or
+    # None when some of them have already been evicted
+    def since(self, channels: Iterable[str], seq: int) -> Optional[List[Tuple[int, str]]]:
+        if seq > self.seq:
+            return None
+        missed = []
+        for name in channels:
+            channel = self._channels.get(name)
+            if channel is None:
+                # Either it never had messages or they're all gone; only the
+                # latter matters and the two can't be told apart
+                if seq < self._forgotten:
+                    return None
+                continue
+            if seq < channel.dropped:
+                return None
+            for entry in reversed(channel.entries):
+                if entry[0] <= seq:
+                    break
+                missed.append(entry)
+        missed.sort()
+        return missed
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._channels),
+            "messages": len(self._order),
+            "bytes": self.bytes,
+            "evicted": self.evicted,
+        }
@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
+from typing import Dict, List, Literal, Optional
+from datetime import date
+from .models import TaskStatus, parse_status
 
 class UserBase(BaseModel):
     email: str
@@ -14,18 +17,114 @@ class User(UserBase):
     class ConfigDict:
         from_attributes = True
 
+# Clients send statuses as free text ("todo", "Done", "in progress"); known
+# spellings are accepted as their status, anything else is still a 422
+def _status_alias(value):
+    if isinstance(value, str):
+        return parse_status(value) or value
+    return value
+
 class TaskBase(BaseModel):
     title: str
     description: str
-    status: str
-    due_date: str
+    status: TaskStatus
+    due_date: date
+
+    _status = field_validator("status", mode="before")(_status_alias)
 
 class TaskCreate(TaskBase):
     pass
 
+# A row of an import (see imports.py). Exports write a missing due date as
+# null in NDJSON and as an empty cell in CSV; both read back as no due date.
+class TaskImport(TaskBase):
+    due_date: Optional[date]
+
+    @field_validator("due_date", mode="before")
+    @classmethod
+    def _empty_due_date(cls, value):
+        return None if value == "" else value
+
 class Task(TaskBase):
     id: int
     owner_id: int
+    # Rows converted from the old free-form column may have no parseable date
+    due_date: Optional[date]
+
+    class ConfigDict:
+        from_attributes = True
+
+# Filters and ordering for GET /tasks; every combination is served by one of
+# the owner_id-leading indexes on tasks.
+class TaskListParams(BaseModel):
+    status: Optional[TaskStatus] = None
+    due_before: Optional[date] = None
+    due_after: Optional[date] = None
+    sort: Literal["id", "due_date", "title"] = "id"
+    order: Literal["asc", "desc"] = "asc"
+
+class TaskPage(BaseModel):
+    items: List[Task]
+    next_cursor: Optional[str] = None
+
+class TaskChanges(BaseModel):
+    changed: List[Task]
+    deleted: List[int]
+    next_token: str
+    has_more: bool
+    reset: bool
+
+class TaskStats(BaseModel):
+    total: int
+    by_status: Dict[TaskStatus, int]
+    overdue: int
+
+# Partial update: fields left out (or null) keep their current value
+class TaskPatch(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    status: Optional[TaskStatus] = None
+    due_date: Optional[date] = None
+
+    _status = field_validator("status", mode="before")(_status_alias)
+
+class TaskBulkPatch(TaskPatch):
+    id: int
+
+class TaskBulkRequest(BaseModel):
+    create: List[TaskCreate] = []
+    update: List[TaskBulkPatch] = []
+    delete: List[int] = []
+    fetch: List[int] = []
+
+class TaskBulkItem(BaseModel):
+    id: Optional[int] = None
+    status: str
+    task: Optional[Task] = None
+
+class TaskBulkResponse(BaseModel):
+    created: List[TaskBulkItem]
+    updated: List[TaskBulkItem]
+    deleted: List[TaskBulkItem]
+    fetched: List[TaskBulkItem]
+
+class DeviceTokenCreate(BaseModel):
+    token: str = Field(min_length=1)
+
+class TaskImportError(BaseModel):
+    row: int
+    errors: List[str]
+
+# Progress of a bulk import; row numbers count records, not lines
+class TaskImportJob(BaseModel):
+    id: str
+    status: Literal["pending", "running", "completed", "failed"]
+    format: Literal["ndjson", "csv"]
+    processed: int
+    inserted: int
+    failed: int
+    errors: List[TaskImportError]
+    detail: Optional[str] = None
 
     class ConfigDict:
         from_attributes = True
@@ -0,0 +1,101 @@
+import re
+from typing import List, Optional
+from sqlalchemy import DDL, Select, column, event, func, literal_column, select, table
+from . import models
+
+# Full-text search over task titles and descriptions. SQLite keeps an FTS5
+# index over the tasks table, Postgres a generated tsvector column with a GIN
+# index. Both are maintained by the database itself (triggers / generated
+# column) inside the writing statement, so every write path, including bulk
+# executemany and RETURNING statements, keeps the index in sync.
+
+MAX_TERMS = 16
+
+# owner_id is indexed as a token so a query only walks the caller's postings;
+# its bm25 weight is 0 so it doesn't affect ranking. Titles weigh more than
+# descriptions.
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+    "owner_id, title, description, content='tasks', content_rowid='id', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+    "INSERT INTO tasks_fts(rowid, owner_id, title, description) "
+    "VALUES (new.id, new.owner_id, new.title, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, owner_id, title, description) "
+    "VALUES ('delete', old.id, old.owner_id, old.title, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF owner_id, title, description ON tasks BEGIN "
+    "INSERT INTO tasks_fts(tasks_fts, rowid, owner_id, title, description) "
+    "VALUES ('delete', old.id, old.owner_id, old.title, old.description); "
+    "INSERT INTO tasks_fts(rowid, owner_id, title, description) "
+    "VALUES (new.id, new.owner_id, new.title, new.description); END",
+    "INSERT INTO tasks_fts(tasks_fts, rank) VALUES ('rank', 'bm25(0.0, 10.0, 1.0)')",
+]
+
+# Rebuilds the SQLite index from the tasks table, for databases that had
+# rows before the index existed.
+SQLITE_REBUILD = "INSERT INTO tasks_fts(tasks_fts) VALUES ('rebuild')"
+
+POSTGRES_DDL = [
+    "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_tasks_search_vector ON tasks USING GIN (search_vector)",
+]
+
+def ddl(dialect_name: str) -> List[str]:
+    return {"sqlite": SQLITE_DDL, "postgresql": POSTGRES_DDL}.get(dialect_name, [])
+
+for statement in SQLITE_DDL:
+    event.listen(models.Task.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(models.Task.__table__, "before_drop", DDL("DROP TABLE IF EXISTS tasks_fts").execute_if(dialect="sqlite"))
+for statement in POSTGRES_DDL:
+    event.listen(models.Task.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+# User input never reaches the query syntax: only word characters are kept,
+# each term is quoted, and the last one matches as a prefix so results
+# follow the user as they type.
+def search_terms(query: str) -> List[str]:
+    return re.findall(r"\w+", query.lower())[:MAX_TERMS]
+
+def fts5_query(owner_id: int, terms: List[str]) -> str:
+    phrases = [f'"{term}"' for term in terms]
+    phrases[-1] += "*"
+    return f'owner_id : "{owner_id}" AND {{title description}} : ({" ".join(phrases)})'
+
+def tsquery(terms: List[str]) -> str:
+    return " & ".join(terms) + ":*"
+
+tasks_fts = table("tasks_fts", column("rowid"), column("rank"), column("tasks_fts"))
+
+# Ranked matches for one page. On SQLite the page is cut inside the FTS
+# query, so only the page's rows are read from tasks.
+def search_statement(dialect_name: str, owner_id: int, query: str, skip: int, limit: int) -> Optional[Select]:
+    terms = search_terms(query)
+    if not terms:
+        return None
+    if dialect_name == "sqlite":
+        matches = (
+            select(tasks_fts.c.rowid.label("task_id"), tasks_fts.c.rank)
+            .where(tasks_fts.c.tasks_fts.op("MATCH")(fts5_query(owner_id, terms)))
+            .order_by(tasks_fts.c.rank, tasks_fts.c.rowid)
+            .offset(skip)
+            .limit(limit)
+            .subquery()
+        )
+        return (
+            select(models.Task)
+            .join(matches, models.Task.id == matches.c.task_id)
+            .where(models.Task.owner_id == owner_id)
+            .order_by(matches.c.rank, models.Task.id)
+        )
+    if dialect_name == "postgresql":
+        vector = literal_column("tasks.search_vector")
+        ts_query = func.to_tsquery("english", tsquery(terms))
+        return (
+            select(models.Task)
+            .where(models.Task.owner_id == owner_id, vector.op("@@")(ts_query))
+            .order_by(func.ts_rank(vector, ts_query).desc(), models.Task.id)
+            .offset(skip)
+            .limit(limit)
+        )
+    raise ValueError(f"Task search is not available on '{dialect_name}' databases")
@@ -0,0 +1,37 @@
+from typing import Any
+from fastapi import Response
+from pydantic_core import to_json
+from . import models
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - pydantic-core's encoder is the fallback
+    orjson = None
+
+# Fast path for large task listings: the query selects only the columns of
+# schemas.Task, and the rows go straight to the JSON encoder instead of
+# being turned into ORM objects, revalidated against response_model and run
+# through jsonable_encoder. The output is byte-for-byte what the response
+# model would produce, so it has to follow schemas.Task's field order.
+TASK_COLUMNS = (
+    models.Task.title,
+    models.Task.description,
+    models.Task.status,
+    models.Task.due_date,
+    models.Task.id,
+    models.Task.owner_id,
+)
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return to_json(content)
+
+def task_rows(rows) -> list:
+    return [row._asdict() for row in rows]
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
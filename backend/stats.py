@@ -0,0 +1,166 @@
+import argparse
+from datetime import date, datetime
+from typing import List
+from sqlalchemy import DDL, case, event, func, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from . import models
+from .models import TaskStatus
+
+# Per-owner task counts by status, kept in task_counts by triggers on tasks.
+# The triggers see the old and new row of every insert, update and delete in
+# the writing transaction, so concurrent writes and bulk statements can't
+# make the counters drift. Overdue depends on today's date and can't be kept
+# incrementally; it's an index-only count instead. The same triggers bump the
+# owner's version on every write, which is what listing ETags and the delta
+# sync sequence are made of.
+
+STATUSES = [status.value for status in TaskStatus]
+OPEN_STATUSES = [TaskStatus.pending, TaskStatus.in_progress]
+
+# SQL that moves a row's status in or out of its owner's counters. Postgres
+# needs the booleans cast to integers, SQLite already treats them as 0/1.
+# Tasks without an owner aren't counted.
+def _add(row: str, cast: str = "", suffix: str = "") -> str:
+    values = ", ".join(f"({row}.status = '{status}'){cast}" for status in STATUSES)
+    return (
+        f"INSERT INTO task_counts (owner_id, {', '.join(STATUSES)}, version) "
+        f"SELECT {row}.owner_id, {values}, 1 WHERE {row}.owner_id IS NOT NULL "
+        "ON CONFLICT (owner_id) DO UPDATE SET "
+        + ", ".join(f"{status} = task_counts.{status} + excluded.{status}" for status in STATUSES)
+        + f", version = task_counts.version + 1{suffix};"
+    )
+
+def _remove(row: str, cast: str = "") -> str:
+    return (
+        "UPDATE task_counts SET "
+        + ", ".join(f"{status} = {status} - ({row}.status = '{status}'){cast}" for status in STATUSES)
+        + f", version = version + 1 WHERE owner_id = {row}.owner_id;"
+    )
+
+def _touch(row: str, suffix: str = "") -> str:
+    return f"UPDATE task_counts SET version = version + 1 WHERE owner_id = {row}.owner_id{suffix};"
+
+# The owner's version after the write doubles as the change sequence of the
+# written row (see sync.py): stamped on the task, or on a tombstone when the
+# task is deleted or leaves its owner.
+def _stamp(row: str) -> str:
+    return (
+        "UPDATE tasks SET change_seq = "
+        f"(SELECT version FROM task_counts WHERE owner_id = {row}.owner_id) "
+        f"WHERE id = {row}.id AND {row}.owner_id IS NOT NULL;"
+    )
+
+def _tombstone(row: str, condition: str = "") -> str:
+    return (
+        "INSERT INTO task_tombstones (owner_id, task_id, change_seq) "
+        f"SELECT owner_id, {row}.id, version FROM task_counts WHERE owner_id = {row}.owner_id{condition};"
+    )
+
+# SQLite can't assign NEW in a trigger, so the stamp is a second UPDATE of
+# the row; it only changes change_seq, which the touch trigger ignores.
+SQLITE_DDL = [
+    "CREATE TRIGGER IF NOT EXISTS task_counts_insert AFTER INSERT ON tasks "
+    f"WHEN new.owner_id IS NOT NULL BEGIN {_add('new')} {_stamp('new')} END",
+    "CREATE TRIGGER IF NOT EXISTS task_counts_delete AFTER DELETE ON tasks "
+    f"WHEN old.owner_id IS NOT NULL BEGIN {_remove('old')} {_tombstone('old')} END",
+    "CREATE TRIGGER IF NOT EXISTS task_counts_update AFTER UPDATE OF status, owner_id ON tasks "
+    "WHEN old.status IS NOT new.status OR old.owner_id IS NOT new.owner_id BEGIN "
+    f"{_remove('old')} {_tombstone('old', ' AND old.owner_id IS NOT new.owner_id')} "
+    f"{_add('new')} {_stamp('new')} END",
+    "CREATE TRIGGER IF NOT EXISTS task_counts_touch AFTER UPDATE ON tasks "
+    "WHEN old.status IS new.status AND old.owner_id IS new.owner_id AND old.change_seq IS new.change_seq "
+    f"BEGIN {_touch('new')} {_stamp('new')} END",
+]
+
+# On Postgres a BEFORE trigger stamps NEW directly, so RETURNING sees it
+POSTGRES_DDL = [
+    "CREATE OR REPLACE FUNCTION task_counts_apply() RETURNS trigger AS $$ BEGIN "
+    "IF TG_OP = 'DELETE' THEN "
+    f"IF OLD.owner_id IS NOT NULL THEN {_remove('OLD', '::int')} {_tombstone('OLD')} END IF; "
+    "RETURN OLD; END IF; "
+    "IF TG_OP = 'UPDATE' THEN "
+    "IF OLD.status IS NOT DISTINCT FROM NEW.status AND OLD.owner_id IS NOT DISTINCT FROM NEW.owner_id THEN "
+    f"{_touch('NEW', ' RETURNING version INTO NEW.change_seq')} RETURN NEW; END IF; "
+    f"IF OLD.owner_id IS NOT NULL THEN {_remove('OLD', '::int')} "
+    f"IF OLD.owner_id IS DISTINCT FROM NEW.owner_id THEN {_tombstone('OLD')} END IF; END IF; "
+    "END IF; "
+    f"IF NEW.owner_id IS NOT NULL THEN {_add('NEW', '::int', ' RETURNING version INTO NEW.change_seq')} END IF; "
+    "RETURN NEW; END $$ LANGUAGE plpgsql",
+    "CREATE OR REPLACE TRIGGER task_counts_apply BEFORE INSERT OR UPDATE OR DELETE ON tasks "
+    "FOR EACH ROW EXECUTE FUNCTION task_counts_apply()",
+]
+
+# The triggers read tasks.status, so schema changes to that column have to
+# drop them first (see migrations.py).
+DROP_TRIGGERS = {
+    "sqlite": [f"DROP TRIGGER IF EXISTS task_counts_{op}" for op in ("insert", "delete", "update", "touch")],
+    "postgresql": [
+        "DROP TRIGGER IF EXISTS task_counts_insert_delete ON tasks",
+        "DROP TRIGGER IF EXISTS task_counts_update ON tasks",
+        "DROP TRIGGER IF EXISTS task_counts_apply ON tasks",
+    ],
+}
+
+UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+def ddl(dialect_name: str) -> List[str]:
+    return {"sqlite": SQLITE_DDL, "postgresql": POSTGRES_DDL}.get(dialect_name, [])
+
+# Both tables have to exist first, so this hangs off the metadata rather
+# than either table.
+for statement in SQLITE_DDL:
+    event.listen(models.Base.metadata, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+for statement in POSTGRES_DDL:
+    event.listen(models.Base.metadata, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+# Served from (owner_id, status, due_date) without touching table rows
+def overdue_count(owner_id: int, today: date):
+    return (
+        select(func.count())
+        .select_from(models.Task)
+        .where(
+            models.Task.owner_id == owner_id,
+            models.Task.status.in_(OPEN_STATUSES),
+            models.Task.due_date < today,
+        )
+    )
+
+def task_stats(db: Session, owner_id: int) -> dict:
+    counts = db.get(models.TaskCounts, owner_id)
+    by_status = {status: getattr(counts, status) if counts else 0 for status in STATUSES}
+    overdue = db.scalar(overdue_count(owner_id, datetime.utcnow().date()))
+    return {"total": sum(by_status.values()), "by_status": by_status, "overdue": overdue}
+
+# Repair job: recomputes every owner's counters from the tasks table in one
+# transaction. On Postgres task writes wait for it so none are lost in between.
+# Versions only move forward so no ETag handed out before is reused.
+def rebuild_task_counts(db: Session):
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        db.execute(text("LOCK TABLE tasks IN SHARE MODE"))
+    db.execute(update(models.TaskCounts).values(
+        **{status: 0 for status in STATUSES}, version=models.TaskCounts.version + 1
+    ))
+    live = (
+        select(
+            models.Task.owner_id,
+            *(func.sum(case((models.Task.status == status, 1), else_=0)) for status in TaskStatus),
+        )
+        .where(models.Task.owner_id.is_not(None))
+        .group_by(models.Task.owner_id)
+    )
+    upsert = UPSERTS[dialect_name](models.TaskCounts).from_select(["owner_id", *STATUSES], live)
+    db.execute(upsert.on_conflict_do_update(
+        index_elements=[models.TaskCounts.owner_id],
+        set_={status: upsert.excluded[status] for status in STATUSES},
+    ))
+    db.commit()
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    argparse.ArgumentParser(description="Rebuild per-owner task counters from the tasks table").parse_args()
+    with SessionLocal() as session:
+        rebuild_task_counts(session)
+    print("Task counters rebuilt")
@@ -0,0 +1,105 @@
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, delete, func, select, update
+from sqlalchemy.orm import Session
+from . import models
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+
+# Delta sync for offline clients. Every write to an owner's tasks bumps their
+# task version and stamps it on the written row as change_seq, or on a
+# tombstone for deletes (triggers in stats.py). The counter is bumped under
+# the owner's row lock (SQLite: the write lock), so sequence numbers commit
+# in order and "everything after N" never skips a change. A sync reads only
+# the rows changed since the client's token, through (owner_id, change_seq).
+
+DEFAULT_TOMBSTONE_DAYS = 30
+
+def encode_token(seq: int) -> str:
+    return encode_cursor({"seq": seq})
+
+def decode_token(token: str) -> int:
+    try:
+        seq = int(decode_cursor(token)["seq"])
+    except (KeyError, TypeError, ValueError) as exc:
+        raise InvalidCursor("Invalid sync token") from exc
+    if seq < 0:
+        raise InvalidCursor("Invalid sync token")
+    return seq
+
+def changed_tasks(owner_id: int, since: int):
+    return (
+        select(models.Task)
+        .where(models.Task.owner_id == owner_id, models.Task.change_seq > since)
+        .order_by(models.Task.change_seq)
+    )
+
+def task_changes(db: Session, owner_id: int, since: int, limit: int) -> dict:
+    counts = db.get(models.TaskCounts, owner_id)
+    version = counts.version if counts else 0
+    pruned_seq = counts.pruned_seq if counts else 0
+    # Tokens older than the pruned tombstones (or from some other database)
+    # can't be brought up to date; the client starts over from a snapshot.
+    reset = since > version or 0 < since < pruned_seq
+    if reset:
+        since = 0
+
+    changed = db.scalars(changed_tasks(owner_id, since).limit(limit + 1)).all()
+    # A snapshot has nothing to delete
+    deleted = [] if since == 0 else db.execute(
+        select(models.TaskTombstone.change_seq, models.TaskTombstone.task_id)
+        .where(models.TaskTombstone.owner_id == owner_id, models.TaskTombstone.change_seq > since)
+        .order_by(models.TaskTombstone.change_seq)
+        .limit(limit + 1)
+    ).all()
+
+    merged = sorted(
+        [(task.change_seq, task, None) for task in changed]
+        + [(seq, None, task_id) for seq, task_id in deleted],
+        key=lambda change: change[0],
+    )
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    if has_more:
+        token_seq = merged[-1][0]
+    else:
+        token_seq = max([version, since] + [seq for seq, _, _ in merged])
+    return {
+        "changed": [task for _, task, _ in merged if task is not None],
+        "deleted": [task_id for _, _, task_id in merged if task_id is not None],
+        "next_token": encode_token(token_seq),
+        "has_more": has_more,
+        "reset": reset,
+    }
+
+# Retention job: drops tombstones older than the cutoff and records, per
+# owner, how far they were pruned so older tokens get a reset.
+def prune_tombstones(db: Session, older_than: datetime) -> int:
+    pruned = db.execute(
+        select(models.TaskTombstone.owner_id, func.max(models.TaskTombstone.change_seq))
+        .where(models.TaskTombstone.deleted_at < older_than)
+        .group_by(models.TaskTombstone.owner_id)
+    ).all()
+    if pruned:
+        db.execute(
+            update(models.TaskCounts.__table__)
+            .where(
+                models.TaskCounts.owner_id == bindparam("pruned_owner"),
+                models.TaskCounts.pruned_seq < bindparam("seq"),
+            )
+            .values(pruned_seq=bindparam("seq")),
+            [{"pruned_owner": owner_id, "seq": seq} for owner_id, seq in pruned],
+        )
+    removed = db.execute(delete(models.TaskTombstone).where(models.TaskTombstone.deleted_at < older_than)).rowcount
+    db.commit()
+    return removed
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Prune task tombstones older than the retention period")
+    parser.add_argument("--keep-days", type=int, default=DEFAULT_TOMBSTONE_DAYS)
+    args = parser.parse_args()
+    with SessionLocal() as session:
+        removed = prune_tombstones(session, datetime.utcnow() - timedelta(days=args.keep_days))
+    print(f"Pruned {removed} tombstones")
@@ -0,0 +1,126 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from backend import export, imports
+from backend.main import app
+from backend.database import Base, async_database_url
+from backend.dependencies import AsyncSessionRunner, get_runner
+from backend.models import User
+from backend.auth import get_password_hash, create_access_token
+import json
+import os
+
+from dotenv import load_dotenv
+load_dotenv()
+
+SQLALCHEMY_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "sqlite:///./test.db")
+
+client = TestClient(app)
+
+@pytest.fixture(scope="module")
+def token():
+    test_engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    Base.metadata.create_all(bind=test_engine)
+    db = sessionmaker(bind=test_engine)()
+    try:
+        user = db.query(User).filter(User.email == "asyncuser@example.com").first()
+        if not user:
+            db.add(User(email="asyncuser@example.com", hashed_password=get_password_hash("testpassword"), full_name="Async User"))
+            db.commit()
+    finally:
+        db.close()
+    yield create_access_token(data={"sub": "asyncuser@example.com"})
+    Base.metadata.drop_all(bind=test_engine)
+    test_engine.dispose()
+
+@pytest.fixture(scope="module", autouse=True)
+def async_mode():
+    # Route every request through the async engine for this module only
+    async_engine = create_async_engine(async_database_url(SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+    AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_runner():
+        async with AsyncTestingSessionLocal() as db:
+            yield AsyncSessionRunner(db)
+
+    app.dependency_overrides[get_runner] = override_get_runner
+    yield
+    del app.dependency_overrides[get_runner]
+
+def test_async_database_url():
+    assert str(async_database_url("sqlite:///./app.db")) == "sqlite+aiosqlite:///./app.db"
+    assert async_database_url("postgresql://u:p@db/tasks").drivername == "postgresql+asyncpg"
+    with pytest.raises(ValueError):
+        async_database_url("mysql://u:p@db/tasks")
+
+def test_task_crud_on_async_engine(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(
+        "/api/v1/tasks",
+        headers=headers,
+        json={"title": "Async Task", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"}
+    )
+    assert response.status_code == 200
+    task_id = response.json()["id"]
+
+    response = client.put(
+        f"/api/v1/tasks/{task_id}",
+        headers=headers,
+        json={"title": "Async Task", "description": "Updated", "status": "completed", "due_date": "2024-08-22"}
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == "completed"
+
+    response = client.get("/api/v1/tasks", headers=headers, params={"cursor": ""})
+    assert response.status_code == 200
+    assert [task["id"] for task in response.json()["items"]] == [task_id]
+
+    response = client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+    assert response.status_code == 200
+    assert client.get(f"/api/v1/tasks/{task_id}", headers=headers).status_code == 404
+
+def test_export_on_async_engine(token, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    monkeypatch.setattr(export, "CHUNK_SIZE", 2)
+    ids = [
+        client.post(
+            "/api/v1/tasks",
+            headers=headers,
+            json={"title": f"Async Export {i}", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"}
+        ).json()["id"]
+        for i in range(3)
+    ]
+
+    response = client.get("/api/v1/tasks/export", headers=headers)
+    assert response.status_code == 200
+    assert [json.loads(line)["id"] for line in response.content.splitlines()] == ids
+
+    response = client.get("/api/v1/tasks/export", headers=headers, params={"format": "csv"})
+    assert response.text.splitlines()[0] == "title,description,status,due_date,id,owner_id"
+    assert len(response.text.splitlines()) == 4
+
+    for task_id in ids:
+        client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+
+def test_import_on_async_engine(token, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    monkeypatch.setattr(imports, "CHUNK_SIZE", 2)
+    body = "title,description,status,due_date\n" + "".join(f"Async Import {i},Imported,pending,2024-08-21\n" for i in range(3))
+    body += "Async Import 3,Imported,pending,someday\n"
+    response = client.post("/api/v1/tasks/import", headers=headers, params={"format": "csv"}, content=body.encode())
+    assert response.status_code == 202
+    job = client.get(response.headers["location"], headers=headers).json()
+    assert (job["status"], job["inserted"], job["failed"]) == ("completed", 3, 1)
+    assert job["errors"][0]["row"] == 4
+
+    ids = [json.loads(line)["id"] for line in client.get("/api/v1/tasks/export", headers=headers).content.splitlines()]
+    assert len(ids) == 3
+    for task_id in ids:
+        client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+
+def test_invalid_token_on_async_engine():
+    response = client.get("/api/v1/tasks", headers={"Authorization": "Bearer invalid"})
+    assert response.status_code == 401
@@ -5,7 +5,7 @@ from fastapi import HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from backend.auth import create_access_token, get_current_user, verify_password, get_password_hash, pwd_context
+from backend.auth import create_access_token, get_current_user, verify_password, get_password_hash, pwd_context, principal_cache, token_claims
 from backend.models import User
 from backend.database import Base
 import os
@@ -87,4 +87,55 @@ def test_edge_cases():
     # Test token without 'sub'
     token = create_access_token({})
     with pytest.raises(HTTPException):
-        get_current_user(token=token, db=db)
\ No newline at end of file
+        get_current_user(token=token, db=db)
+
+
+# Principal cache
+def test_token_carries_user_id(db: Session):
+    user = User(email="uid@example.com", hashed_password="hashed")
+    db.add(user)
+    db.commit()
+
+    payload = jwt.decode(create_access_token(token_claims(user)), SECRET_KEY, algorithms=[ALGORITHM])
+    assert payload["sub"] == user.email
+    assert payload["uid"] == user.id
+
+def test_principal_cache_hit_skips_database(db: Session):
+    principal_cache.clear()
+    user = User(email="cached@example.com", hashed_password="hashed")
+    db.add(user)
+    db.commit()
+    token = create_access_token(token_claims(user))
+
+    before = principal_cache.stats()
+    assert get_current_user(token=token, db=db).id == user.id
+    # Served from the cache, so no session is needed at all
+    assert get_current_user(token=token, db=None).id == user.id
+    after = principal_cache.stats()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+def test_principal_cache_rejects_mismatched_user_id(db: Session):
+    principal_cache.clear()
+    user = User(email="mismatch@example.com", hashed_password="hashed")
+    db.add(user)
+    db.commit()
+    token = create_access_token({"sub": "someone-else@example.com", "uid": user.id})
+
+    with pytest.raises(HTTPException):
+        get_current_user(token=token, db=db)
+
+def test_principal_cache_invalidated_on_deactivation(db: Session):
+    principal_cache.clear()
+    user = User(email="deactivated@example.com", hashed_password="hashed")
+    db.add(user)
+    db.commit()
+    token = create_access_token(token_claims(user))
+    get_current_user(token=token, db=db)
+
+    user.is_active = False
+    db.commit()
+
+    with pytest.raises(HTTPException) as exc_info:
+        get_current_user(token=token, db=db)
+    assert exc_info.value.status_code == 401
@@ -0,0 +1,108 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from backend.main import app
+from backend.database import PoolStats, build_engine, pool_settings
+
+client = TestClient(app)
+
+@pytest.fixture
+def sqlite_url(tmp_path):
+    return f"sqlite:///{tmp_path}/pool.db"
+
+def test_pool_settings_from_env(monkeypatch, sqlite_url):
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "1")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "true")
+    assert pool_settings()["pool_pre_ping"] is True
+
+    engine = build_engine(sqlite_url)
+    assert engine.pool.size() == 3
+    assert engine.pool._max_overflow == 1
+    assert engine.pool._pre_ping is True
+    engine.dispose()
+
+def test_sqlite_pragmas_applied_on_connect(monkeypatch, sqlite_url):
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT_MS", "1234")
+    engine = build_engine(sqlite_url)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 1234
+        assert conn.execute(text("PRAGMA cache_size")).scalar() == -20000
+    engine.dispose()
+
+def test_pool_stats_track_checkouts_and_waits(monkeypatch, sqlite_url):
+    monkeypatch.setenv("DB_POOL_SIZE", "1")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_POOL_TIMEOUT", "0.05")
+    stats = PoolStats()
+    engine = build_engine(sqlite_url, stats)
+
+    conn = engine.connect()
+    snapshot = stats.snapshot(engine.pool)
+    assert snapshot["checkouts"] == 1
+    assert snapshot["checked_out"] == 1
+    assert snapshot["connects"] == 1
+
+    # The only connection is taken, so the next checkout waits and times out
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    conn.close()
+
+    snapshot = stats.snapshot(engine.pool)
+    assert snapshot["timeouts"] == 1
+    assert snapshot["wait_max_ms"] >= 50
+    assert snapshot["checked_out"] == 0
+    assert snapshot["checked_in"] == 1
+    engine.dispose()
+
+def test_metrics_endpoint():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "checkouts" in response.json()["db_pool"]["sync"]
+
+# Starts the app in a fresh interpreter with the given environment and
+# reports what exists before and after the lifespan has run
+STARTUP_SCRIPT = """
+import json
+import os
+from backend import database
+from backend.main import app
+result = {"built_on_import": sorted(database._built), "db_file_on_import": os.path.exists(os.environ.get("DB_FILE", ""))}
+if database.database_url:
+    from fastapi.testclient import TestClient
+    from sqlalchemy import inspect
+    with TestClient(app) as live:
+        result["status"] = live.get("/metrics").status_code
+    result["tables"] = sorted(inspect(database.engine).get_table_names())
+print(json.dumps(result))
+"""
+
+def run_startup(**env):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = {key: value for key, value in os.environ.items() if key != "DATABASE_URL"} | env
+    result = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=root, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def test_import_has_no_side_effects():
+    assert run_startup() == {"built_on_import": [], "db_file_on_import": False}
+
+def test_schema_created_on_startup(tmp_path):
+    db_file = str(tmp_path / "startup.db")
+    result = run_startup(DATABASE_URL=f"sqlite:///{db_file}", DB_FILE=db_file)
+    assert result["built_on_import"] == [] and result["db_file_on_import"] is False
+    assert result["status"] == 200
+    assert {"users", "tasks"} <= set(result["tables"])
+
+def test_schema_creation_opt_out(tmp_path):
+    db_file = str(tmp_path / "startup.db")
+    result = run_startup(DATABASE_URL=f"sqlite:///{db_file}", DB_FILE=db_file, DB_CREATE_SCHEMA="false")
+    assert result["status"] == 200
+    assert result["tables"] == []
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import pytest
+from passlib.context import CryptContext
+from passlib.hash import bcrypt
+from backend.hashing import HasherBusy, PasswordHasher
+
+context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=5, bcrypt__min_rounds=5, bcrypt__max_rounds=5)
+
+def test_hash_and_verify_off_the_event_loop():
+    hasher = PasswordHasher(context, workers=2, max_pending=4)
+
+    async def scenario():
+        hashed = await hasher.hash("secret")
+        return hashed, await hasher.verify_and_update("secret", hashed), await hasher.verify_and_update("wrong", hashed)
+
+    hashed, (valid, new_hash), (invalid, _) = asyncio.run(scenario())
+    assert hashed.startswith("$2b$05$")
+    assert valid and new_hash is None
+    assert not invalid
+    assert hasher.stats()["completed"] == 3
+    hasher.shutdown()
+
+def test_outdated_cost_is_rehashed():
+    hasher = PasswordHasher(context, workers=1, max_pending=1)
+    old_hash = bcrypt.using(rounds=4).hash("secret")
+
+    valid, new_hash = asyncio.run(hasher.verify_and_update("secret", old_hash))
+    assert valid
+    assert new_hash.startswith("$2b$05$")
+    assert hasher.stats()["rehashed"] == 1
+    hasher.shutdown()
+
+def test_rejects_work_beyond_queue_limit():
+    release = threading.Event()
+
+    class BlockingContext:
+        def hash(self, password):
+            release.wait(5)
+            return "hashed"
+
+    hasher = PasswordHasher(BlockingContext(), workers=1, max_pending=2)
+
+    async def scenario():
+        first = asyncio.ensure_future(hasher.hash("a"))
+        second = asyncio.ensure_future(hasher.hash("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(HasherBusy):
+            await hasher.hash("c")
+        release.set()
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(scenario()) == ["hashed", "hashed"]
+    assert hasher.stats()["rejected"] == 1
+    assert hasher.stats()["pending"] == 0
+    hasher.shutdown()
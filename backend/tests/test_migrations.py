@@ -0,0 +1,128 @@
+import pytest
+from datetime import date
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from backend.database import Base
+from backend import crud, sync
+from backend.migrations import MIGRATIONS, run_migrations, parse_legacy_status, parse_legacy_due_date
+from backend.models import Task, TaskCounts, TaskStatus
+
+# Schema of the tasks table before due_date/status were typed
+LEGACY_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR, hashed_password VARCHAR, full_name VARCHAR, is_active BOOLEAN)",
+    "CREATE TABLE tasks (id INTEGER PRIMARY KEY, title VARCHAR, description VARCHAR, owner_id INTEGER REFERENCES users (id), status VARCHAR, due_date VARCHAR)",
+    "CREATE INDEX ix_tasks_id ON tasks (id)",
+    "CREATE INDEX ix_tasks_title ON tasks (title)",
+    "CREATE INDEX ix_tasks_description ON tasks (description)",
+    "CREATE INDEX ix_tasks_status ON tasks (status)",
+    "CREATE INDEX ix_tasks_due_date ON tasks (due_date)",
+]
+
+LEGACY_ROWS = [
+    ("pending", "2024-08-21", TaskStatus.pending, date(2024, 8, 21)),
+    ("Completed", "2024-08-22T10:30:00", TaskStatus.completed, date(2024, 8, 22)),
+    ("In Progress", "2024-09-01", TaskStatus.in_progress, date(2024, 9, 1)),
+    ("done", "next week", TaskStatus.completed, None),
+    ("whatever", None, TaskStatus.pending, None),
+]
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO users (id, email) VALUES (1, 'legacy@example.com')"))
+        conn.execute(
+            text("INSERT INTO tasks (title, description, owner_id, status, due_date) VALUES (:title, 'd', 1, :status, :due_date)"),
+            [{"title": f"Task {i}", "status": row[0], "due_date": row[1]} for i, row in enumerate(LEGACY_ROWS)],
+        )
+    yield engine
+    engine.dispose()
+
+def test_parse_legacy_values():
+    assert parse_legacy_status("in-progress") == TaskStatus.in_progress
+    assert parse_legacy_status(None) == TaskStatus.pending
+    assert parse_legacy_due_date("2024-08-21") == date(2024, 8, 21)
+    assert parse_legacy_due_date("21/08/2024") is None
+
+def test_migration_converts_rows_in_batches(legacy_engine):
+    run_migrations(legacy_engine, batch_size=2)
+
+    columns = {column["name"]: column for column in inspect(legacy_engine).get_columns("tasks")}
+    assert "status_typed" not in columns and "due_date_typed" not in columns
+
+    indexes = {index["name"] for index in inspect(legacy_engine).get_indexes("tasks")}
+    assert indexes == {
+        "ix_tasks_owner_id_id",
+        "ix_tasks_owner_id_status_due_date",
+        "ix_tasks_owner_id_due_date",
+        "ix_tasks_owner_id_title",
+        "ix_tasks_owner_id_change_seq",
+        "ix_tasks_due_date_id",
+        "ix_tasks_owner_id_status_id",
+        "ix_tasks_owner_id_status_title",
+    }
+
+    db = sessionmaker(bind=legacy_engine)()
+    try:
+        tasks = db.query(Task).order_by(Task.id).all()
+        assert [(task.status, task.due_date) for task in tasks] == [row[2:] for row in LEGACY_ROWS]
+    finally:
+        db.close()
+
+def test_migration_is_idempotent(legacy_engine):
+    run_migrations(legacy_engine)
+    run_migrations(legacy_engine)
+    with legacy_engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM schema_migrations")).scalar() == len(MIGRATIONS)
+        assert conn.execute(text("SELECT count(*) FROM tasks")).scalar() == len(LEGACY_ROWS)
+
+def test_migration_indexes_existing_tasks_for_search(legacy_engine):
+    run_migrations(legacy_engine)
+    db = sessionmaker(bind=legacy_engine)()
+    try:
+        assert [task.title for task in crud.search_tasks(db, 1, "task 3", 0, 10)] == ["Task 3"]
+    finally:
+        db.close()
+
+def test_migration_builds_task_counts(legacy_engine):
+    run_migrations(legacy_engine)
+    db = sessionmaker(bind=legacy_engine)()
+    try:
+        counts = db.get(TaskCounts, 1)
+        expected = [row[2] for row in LEGACY_ROWS]
+        assert (counts.pending, counts.in_progress, counts.completed) == tuple(
+            expected.count(status) for status in (TaskStatus.pending, TaskStatus.in_progress, TaskStatus.completed)
+        )
+
+        # Counters follow writes made after the migration
+        db.query(Task).filter(Task.status == TaskStatus.pending).update({Task.status: TaskStatus.completed})
+        db.commit()
+        db.refresh(counts)
+        assert (counts.pending, counts.completed) == (0, len(expected) - expected.count(TaskStatus.in_progress))
+    finally:
+        db.close()
+
+def test_migration_stamps_tasks_for_sync(legacy_engine):
+    run_migrations(legacy_engine, batch_size=2)
+    db = sessionmaker(bind=legacy_engine)()
+    try:
+        assert db.query(Task).filter(Task.change_seq == 0).count() == 0
+        changes = sync.task_changes(db, 1, 0, 100)
+        assert len(changes["changed"]) == len(LEGACY_ROWS)
+    finally:
+        db.close()
+
+def test_migration_skips_new_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/fresh.db")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    columns = {column["name"] for column in inspect(engine).get_columns("tasks")}
+    assert "status_typed" not in columns
+    engine.dispose()
+
+def test_migration_adds_reminder_tables(legacy_engine):
+    run_migrations(legacy_engine)
+    tables = set(inspect(legacy_engine).get_table_names())
+    assert {"task_reminders", "device_tokens"} <= tables
@@ -1,8 +1,9 @@
 import pytest
+from datetime import date
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from backend.database import Base
-from backend.models import User, Task
+from backend.models import User, Task, TaskStatus
 import os
 
 # Load environment variables
@@ -61,8 +62,8 @@ def test_create_task(db):
         title="Test Task",
         description="Test Description",
         owner_id=new_user.id,
-        status="pending",
-        due_date="2024-08-21"
+        status=TaskStatus.pending,
+        due_date=date(2024, 8, 21)
     )
     db.add(new_task)
     db.commit()
@@ -0,0 +1,124 @@
+import asyncio
+from backend.notifications import DEAD, FAILED, RETRY, SENT, FCMSender, PushDispatcher
+
+# Records every call; a token's scripted outcomes are used up one per call,
+# and it's sent once they run out
+class FakeSender:
+    def __init__(self, outcomes=None, delay: float = 0):
+        self.outcomes = outcomes or {}
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send(self, tokens, message):
+        self.calls.append((message, list(tokens)))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            results = {}
+            for token in tokens:
+                scripted = self.outcomes.get(token)
+                outcome = scripted.pop(0) if scripted else SENT
+                if isinstance(outcome, Exception):
+                    raise outcome
+                results[token] = outcome
+            return results
+        finally:
+            self.in_flight -= 1
+
+def test_tokens_sharing_a_message_are_batched():
+    async def scenario():
+        sender = FakeSender()
+        dispatcher = PushDispatcher(sender, batch_size=3)
+        for i in range(5):
+            assert dispatcher.submit(f"token {i}", "due soon")
+        assert dispatcher.submit("token 9", "other")
+        await dispatcher.join()
+        assert sorted(len(tokens) for message, tokens in sender.calls if message == "due soon") == [2, 3]
+        assert ("other", ["token 9"]) in sender.calls
+        assert dispatcher.stats()["sent"] == 6 and dispatcher.stats()["batches"] == 3
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+
+def test_concurrency_and_queue_limits():
+    async def scenario():
+        sender = FakeSender(delay=0.02)
+        dispatcher = PushDispatcher(sender, queue_size=4, concurrency=2, batch_size=1)
+        accepted = sum(dispatcher.submit(f"token {i}", "hi") for i in range(6))
+        # Submitting never waits; what doesn't fit is refused
+        assert accepted == 4 and dispatcher.stats()["rejected"] == 2
+        await dispatcher.join()
+        assert sender.max_in_flight == 2
+        assert dispatcher.stats()["sent"] == 4
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+
+def test_retries_with_backoff():
+    async def scenario():
+        sender = FakeSender({"flaky": [RETRY, RETRY], "down": [RuntimeError("unreachable")] * 10, "bad": [FAILED]})
+        dispatcher = PushDispatcher(sender, max_attempts=3, retry_base=0.01)
+        dispatcher.submit("flaky", "hi")
+        dispatcher.submit("bad", "hi")
+        # A sender error fails its whole batch, so this one gets its own
+        dispatcher.submit("down", "other")
+        await dispatcher.join()
+        attempts = {token: sum(token in tokens for _, tokens in sender.calls) for token in ("flaky", "down", "bad")}
+        assert attempts == {"flaky": 3, "down": 3, "bad": 1}
+        stats = dispatcher.stats()
+        assert stats["sent"] == 1 and stats["failed"] == 2 and stats["retried"] == 4
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+
+def test_dead_tokens_are_pruned():
+    async def scenario():
+        pruned = []
+        sender = FakeSender({"gone": [DEAD]})
+        dispatcher = PushDispatcher(sender, on_dead_token=pruned.append)
+        dispatcher.submit("gone", "first")
+        dispatcher.submit("alive", "first")
+        await dispatcher.join()
+        assert pruned == ["gone"]
+        # Later notifications to it aren't even queued
+        assert not dispatcher.submit("gone", "second")
+        assert dispatcher.submit("alive", "second")
+        await dispatcher.join()
+        assert sender.calls[-1] == ("second", ["alive"])
+        assert dispatcher.stats()["dead"] == 1
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+
+def test_dead_tokens_are_forgotten():
+    async def scenario():
+        sender = FakeSender({f"gone {i}": [DEAD] for i in range(3)})
+        dispatcher = PushDispatcher(sender, max_dead_tokens=2)
+        for i in range(3):
+            dispatcher.submit(f"gone {i}", "hi")
+        await dispatcher.join()
+        # Only the most recent ones are kept; the rest are gone from storage
+        assert len(dispatcher.dead_tokens) == 2 and dispatcher.stats()["dead"] == 3
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+
+def test_fcm_sender_maps_errors(monkeypatch):
+    from pyfcm.errors import FCMNotRegisteredError, FCMServerError, InvalidDataError
+
+    errors = {"gone": FCMNotRegisteredError("Token not registered"), "busy": FCMServerError("unavailable"),
+              "bad": InvalidDataError("invalid")}
+
+    class Client:
+        def notify(self, fcm_token, notification_body):
+            if fcm_token in errors:
+                raise errors[fcm_token]
+            return {"name": "projects/test/messages/1"}
+
+    sender = FCMSender("unused.json", "test")
+    monkeypatch.setattr(sender, "_client", Client())
+    outcomes = asyncio.run(sender.send(["ok", "gone", "busy", "bad"], "hi"))
+    assert outcomes == {"ok": SENT, "gone": DEAD, "busy": RETRY, "bad": FAILED}
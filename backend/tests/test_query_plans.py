@@ -0,0 +1,71 @@
+import itertools
+import pytest
+from datetime import date
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from backend import crud, schemas, search, stats, sync
+from backend.database import Base
+from backend.models import TaskStatus
+
+# Every filter/sort/cursor combination GET /tasks supports must seek through
+# an index; "SCAN tasks" would mean reading the whole table.
+COMBINATIONS = list(itertools.product(
+    (None, TaskStatus.pending),                 # status
+    (None, date(2024, 12, 31)),                 # due_before
+    (None, date(2024, 1, 1)),                   # due_after
+    ("id", "due_date", "title"),                # sort
+    ("asc", "desc"),                            # order
+    ("first", "value", "null"),                 # cursor position
+))
+
+@pytest.fixture(scope="module")
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+def query_plan(db, statement):
+    sql = statement.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True})
+    return [row[3] for row in db.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+@pytest.mark.parametrize("status,due_before,due_after,sort,order,position", COMBINATIONS)
+def test_task_listing_uses_index(db, status, due_before, due_after, sort, order, position):
+    params = schemas.TaskListParams(status=status, due_before=due_before, due_after=due_after, sort=sort, order=order)
+    statement = crud._listing(1, params).limit(10)
+    if position != "first":
+        value = {"id": None, "due_date": date(2024, 6, 1), "title": "Task"}[sort] if position == "value" else None
+        statement = statement.where(crud._after(db, params, value, 42))
+
+    plan = query_plan(db, statement)
+    assert any(step.startswith("SEARCH tasks USING") for step in plan), plan
+    assert not any(step.startswith("SCAN tasks") for step in plan), plan
+    # The index delivers the order; a sort would read the whole filtered set
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+def test_task_search_uses_fts_index(db):
+    statement = search.search_statement("sqlite", 1, "weekly report", 0, 10)
+    plan = query_plan(db, statement)
+    assert any(step.startswith("SCAN tasks_fts VIRTUAL TABLE INDEX") for step in plan), plan
+    assert not any(step.startswith("SCAN tasks ") for step in plan), plan
+
+def test_task_search_needs_a_supported_database():
+    with pytest.raises(ValueError):
+        search.search_statement("mysql", 1, "weekly report", 0, 10)
+
+def test_overdue_count_uses_index(db):
+    statement = stats.overdue_count(1, date(2024, 6, 1))
+    plan = query_plan(db, statement)
+    assert any("COVERING INDEX ix_tasks_owner_id_status_due_date" in step for step in plan), plan
+
+def test_task_changes_use_index(db):
+    plan = query_plan(db, sync.changed_tasks(1, 42).limit(500))
+    assert any(step.startswith("SEARCH tasks USING INDEX ix_tasks_owner_id_change_seq") for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+def test_due_reminders_use_index(db):
+    statement = crud._due_reminders(date(2024, 6, 1), date(2024, 6, 2), (date(2024, 6, 1), 42), 1000)
+    plan = query_plan(db, statement)
+    assert any(step.startswith("SEARCH tasks USING INDEX ix_tasks_due_date_id") for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
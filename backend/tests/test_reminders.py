@@ -0,0 +1,205 @@
+import asyncio
+import pytest
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from backend.database import Base
+from backend.dependencies import SyncSessionRunner
+from backend.models import DeviceToken, Task, TaskReminder, TaskStatus, User
+from backend.reminders import ReminderScheduler, reminder_message
+
+TODAY = date(2030, 1, 15)
+TOMORROW = date(2030, 1, 16)
+
+def at(hour: int, day: date = TODAY) -> float:
+    return datetime(day.year, day.month, day.day, hour, tzinfo=timezone.utc).timestamp()
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+class RecordingDispatcher:
+    def __init__(self):
+        self.sent = []
+
+    def submit(self, token: str, message: str) -> bool:
+        self.sent.append((token, message))
+        return True
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'reminders.db'}")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        db.add(User(id=1, email="reminded@example.com", hashed_password="x", full_name="Reminded"))
+        db.add_all([DeviceToken(token="phone", user_id=1), DeviceToken(token="tablet", user_id=1)])
+        db.commit()
+    yield engine
+    engine.dispose()
+
+def add_tasks(engine, *tasks):
+    with Session(engine) as db:
+        for task_id, due_date, status in tasks:
+            db.add(Task(id=task_id, title=f"Task {task_id}", owner_id=1, due_date=due_date, status=status))
+        db.commit()
+
+def scheduler_for(engine, clock, **kwargs):
+    @asynccontextmanager
+    async def open_runner():
+        with Session(engine, expire_on_commit=False) as session:
+            yield SyncSessionRunner(session)
+
+    return ReminderScheduler(RecordingDispatcher(), open_runner, hour=9, window=24 * 3600, reload=24 * 3600, clock=clock, **kwargs)
+
+def test_reminders_fire_at_the_reminder_hour(engine):
+    add_tasks(
+        engine,
+        (1, TODAY, TaskStatus.pending),
+        (2, TODAY, TaskStatus.completed),
+        (3, TOMORROW, TaskStatus.in_progress),
+        (4, date(2030, 1, 20), TaskStatus.pending),
+        (5, None, TaskStatus.pending),
+    )
+
+    async def scenario():
+        clock = Clock(at(8))
+        scheduler = scheduler_for(engine, clock)
+        # Completed, undated and out-of-window tasks aren't loaded
+        assert await scheduler.tick() == pytest.approx(3600)
+        assert scheduler.stats()["scheduled"] == 2 and scheduler.dispatcher.sent == []
+
+        clock.now = at(9)
+        # Tomorrow's reminder is due after the next reload
+        assert await scheduler.tick() == pytest.approx(23 * 3600)
+        assert sorted(scheduler.dispatcher.sent) == [("phone", reminder_message("Task 1")), ("tablet", reminder_message("Task 1"))]
+
+        clock.now = at(9, TOMORROW)
+        await scheduler.tick()
+        assert len(scheduler.dispatcher.sent) == 4
+        assert scheduler.stats()["fired"] == 2
+
+    asyncio.run(scenario())
+
+def test_reminders_go_out_once_across_workers(engine):
+    add_tasks(engine, (1, TODAY, TaskStatus.pending), (2, TODAY, TaskStatus.pending))
+
+    async def scenario():
+        clock = Clock(at(8))
+        first, second = scheduler_for(engine, clock), scheduler_for(engine, clock)
+        await first.tick()
+        await second.tick()
+
+        clock.now = at(10)
+        await first.tick()
+        await second.tick()
+        assert first.stats()["fired"] == 2 and second.stats()["skipped"] == 2
+        assert second.dispatcher.sent == []
+
+        # A restarted worker neither repeats them nor loads them again
+        restarted = scheduler_for(engine, clock)
+        await restarted.tick()
+        assert restarted.stats()["scheduled"] == 0 and restarted.dispatcher.sent == []
+
+        # The claims are pruned once their day is over
+        clock.now = at(9, date(2030, 1, 17))
+        await restarted.tick()
+        with Session(engine) as db:
+            assert db.query(TaskReminder).count() == 0
+
+    asyncio.run(scenario())
+
+def test_reminders_load_a_page_at_a_time(engine):
+    add_tasks(engine, *((task_id, TODAY if task_id <= 5 else TOMORROW, TaskStatus.pending) for task_id in range(1, 8)))
+
+    async def scenario():
+        clock = Clock(at(8))
+        scheduler = scheduler_for(engine, clock, page_size=2)
+        await scheduler.tick()
+        assert scheduler.stats()["scheduled"] == 2
+
+        clock.now = at(9)
+        while await scheduler.tick() == 0:
+            pass
+        assert scheduler.stats()["fired"] == 5
+        # Each page is loaded once the one before has fired; the last one
+        # loaded also holds a task due tomorrow
+        assert scheduler.stats()["scheduled"] == 1 and scheduler.stats()["loads"] == 3
+
+        clock.now = at(9, TOMORROW)
+        while await scheduler.tick() == 0:
+            pass
+        assert scheduler.stats()["fired"] == 7
+        assert len({message for _, message in scheduler.dispatcher.sent}) == 7
+
+    asyncio.run(scenario())
+
+def test_write_hooks_update_the_schedule(engine):
+    add_tasks(engine, (1, TODAY, TaskStatus.pending), (2, TODAY, TaskStatus.pending), (3, None, TaskStatus.pending))
+
+    async def scenario():
+        clock = Clock(at(8))
+        scheduler = scheduler_for(engine, clock)
+        await scheduler.tick()
+        assert scheduler.stats()["scheduled"] == 2
+
+        with Session(engine, expire_on_commit=False) as db:
+            first, second, third = db.get(Task, 1), db.get(Task, 2), db.get(Task, 3)
+            first.status = TaskStatus.completed
+            third.due_date = TOMORROW
+            db.commit()
+        scheduler.task_changed(first)
+        scheduler.task_changed(third)
+        scheduler.task_deleted(second.id)
+        with Session(engine) as db:
+            db.delete(db.get(Task, 2))
+            db.commit()
+        assert scheduler.stats()["scheduled"] == 1 and scheduler.stats()["changes"] == 2
+
+        # A due date moved past the window stays out of the heap
+        with Session(engine, expire_on_commit=False) as db:
+            third = db.get(Task, 3)
+            third.due_date = date(2030, 2, 1)
+            db.commit()
+        scheduler.task_changed(third)
+        assert scheduler.stats()["scheduled"] == 0
+
+        clock.now = at(9, TOMORROW)
+        await scheduler.tick()
+        assert scheduler.dispatcher.sent == []
+
+    asyncio.run(scenario())
+
+def test_changes_made_elsewhere_are_skipped(engine):
+    add_tasks(engine, (1, TODAY, TaskStatus.pending))
+
+    async def scenario():
+        clock = Clock(at(8))
+        scheduler = scheduler_for(engine, clock)
+        await scheduler.tick()
+        # Another worker moves the task; this one still holds the old entry
+        with Session(engine) as db:
+            db.get(Task, 1).due_date = TOMORROW
+            db.commit()
+
+        clock.now = at(9)
+        await scheduler.tick()
+        assert scheduler.stats()["skipped"] == 1 and scheduler.dispatcher.sent == []
+
+    asyncio.run(scenario())
+
+def test_scheduler_stops_after_a_failed_round(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'empty.db'}")
+
+    async def scenario():
+        scheduler = scheduler_for(engine, Clock(at(8)))
+        scheduler.start()
+        while scheduler.stats()["errors"] == 0:
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(scheduler.stop(), timeout=5)
+
+    asyncio.run(scenario())
+    engine.dispose()
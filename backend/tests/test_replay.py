@@ -0,0 +1,39 @@
+from backend.replay import ENTRY_OVERHEAD, ReplayBuffer
+
+def test_replay_since():
+    buffer = ReplayBuffer()
+    assert buffer.append("all", "a") == 1
+    buffer.append("user:1", "b")
+    buffer.append("room:x", "c")
+    buffer.append("user:2", "d")
+    assert buffer.since(["all", "user:1", "room:x"], 0) == [(1, "a"), (2, "b"), (3, "c")]
+    assert buffer.since(["user:1", "room:x"], 2) == [(3, "c")]
+    assert buffer.since(["user:1"], 4) == []
+    # An id the buffer never handed out
+    assert buffer.since(["user:1"], 5) is None
+
+def test_replay_evicts_oldest_first():
+    buffer = ReplayBuffer(max_messages=3)
+    for i in range(5):
+        buffer.append("user:1" if i % 2 else "user:2", str(i))
+    assert buffer.stats()["messages"] == 3 and buffer.stats()["evicted"] == 2
+    # user:1 lost message 2; user:2 lost message 1
+    assert buffer.since(["user:1"], 1) is None
+    assert buffer.since(["user:1"], 2) == [(4, "3")]
+    assert buffer.since(["user:2"], 0) is None
+    assert buffer.since(["user:2"], 1) == [(3, "2"), (5, "4")]
+
+def test_replay_byte_cap():
+    buffer = ReplayBuffer(max_bytes=2 * (ENTRY_OVERHEAD + 10))
+    buffer.append("room:a", "x" * 10)
+    buffer.append("room:b", "y" * 10)
+    buffer.append("room:b", "z" * 10)
+    assert buffer.stats() == {"channels": 1, "messages": 2, "bytes": 2 * (ENTRY_OVERHEAD + 10), "evicted": 1}
+    # room:a is gone entirely; a client that missed its message must resync,
+    # and so must one asking about a channel that started over since
+    assert buffer.since(["room:a"], 0) is None
+    assert buffer.since(["room:c"], 0) is None
+    assert buffer.since(["room:a", "room:c"], 1) == []
+    buffer.append("room:a", "w")
+    assert buffer.since(["room:a"], 0) is None
+    assert buffer.since(["room:a"], 3) == [(4, "w")]
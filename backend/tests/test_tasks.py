@@ -1,14 +1,24 @@
 # test_tasks.js
 
 import pytest
+from fastapi import WebSocketDisconnect
 from fastapi.testclient import TestClient
+from backend import events, export, imports, main, search
 from backend.main import app
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, func
+from contextlib import contextmanager
 from sqlalchemy.orm import sessionmaker
 from backend.database import Base
-from backend.models import User
+from backend.models import DeviceToken, Task, TaskCounts, User
+from backend.stats import rebuild_task_counts
+from backend import sync
+from backend.sync import prune_tombstones
+from datetime import datetime, timedelta
 from backend.auth import get_password_hash, create_access_token
 from backend.dependencies import get_db
+import csv
+import io
+import json
 import os
 
 # Load environment variables
@@ -22,7 +32,7 @@ client = TestClient(app)
 SQLALCHEMY_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "sqlite:///./test.db")
 
 test_engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=True)
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=test_engine)
 
 # Dependency override
 def override_get_db():
@@ -68,11 +78,19 @@ def token():
 @pytest.fixture(scope="module", autouse=True)
 def setup_and_teardown():
     # Setup code before tests
+    # Other test modules install their own override on import; theirs is put
+    # back for the modules that run after this one
+    previous = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = override_get_db
     Base.metadata.create_all(bind=test_engine)  # Create the tables before tests
     
     yield
     # Teardown code after tests
     Base.metadata.drop_all(bind=test_engine)  # Drop all the tables after tests
+    if previous is None:
+        app.dependency_overrides.pop(get_db, None)
+    else:
+        app.dependency_overrides[get_db] = previous
     
 
 def test_create_task(token):
@@ -174,6 +192,27 @@ def test_create_task_with_invalid_due_date(token):
     )
     assert response.status_code == 422  # Expecting validation error
 
+def test_task_status_aliases(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    for sent, stored in (("todo", "pending"), ("Done", "completed"), ("in progress", "in_progress")):
+        response = client.post(
+            "/api/v1/tasks",
+            headers=headers,
+            json={"title": "Aliased", "description": "Test Description", "status": sent, "due_date": "2024-08-21"}
+        )
+        assert response.status_code == 200
+        assert response.json()["status"] == stored
+    task_id = response.json()["id"]
+    response = client.patch(f"/api/v1/tasks/{task_id}", headers=headers, json={"status": "finished"})
+    assert response.json()["status"] == "completed"
+
+    response = client.post(
+        "/api/v1/tasks",
+        headers=headers,
+        json={"title": "Aliased", "description": "Test Description", "status": "someday", "due_date": "2024-08-21"}
+    )
+    assert response.status_code == 422
+
 def test_create_task_with_long_title(token):
     long_title = "A" * 1000  # Assuming 1000 is longer than the allowed title length
     response = client.post(
@@ -245,6 +284,710 @@ def test_pagination_limits(token):
     assert isinstance(data, list)
     assert len(data) <= 10000  # Ensure it returns within a reasonable limit
 
+def test_cursor_pagination(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    created = []
+    for i in range(5):
+        response = client.post(
+            "/api/v1/tasks",
+            headers=headers,
+            json={"title": f"Paged Task {i}", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"}
+        )
+        created.append(response.json()["id"])
+
+    seen = []
+    cursor = ""
+    while True:
+        response = client.get("/api/v1/tasks", headers=headers, params={"cursor": cursor, "limit": 2})
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) <= 2
+        seen.extend(task["id"] for task in page["items"])
+        if page["next_cursor"] is None:
+            break
+        cursor = page["next_cursor"]
+
+    # Every task shows up exactly once, in id order
+    assert seen == sorted(seen)
+    assert len(seen) == len(set(seen))
+    assert set(created) <= set(seen)
+
+    for task_id in seen:
+        client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+
+def test_cursor_pagination_invalid_cursor(token):
+    response = client.get(
+        "/api/v1/tasks?cursor=not-a-cursor",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+def test_filter_and_sort_tasks(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    specs = [
+        ("Sorted C", "pending", "2024-03-01"),
+        ("Sorted A", "completed", "2024-01-15"),
+        ("Sorted B", "pending", "2024-03-01"),
+        ("Sorted E", "in_progress", "2024-02-10"),
+        ("Sorted D", "pending", "2024-05-20"),
+    ]
+    created = {}
+    for title, status, due_date in specs:
+        response = client.post(
+            "/api/v1/tasks",
+            headers=headers,
+            json={"title": title, "description": "Test Description", "status": status, "due_date": due_date}
+        )
+        created[response.json()["id"]] = response.json()
+
+    # Walk every ordering page by page; ties on the sort key fall back to id
+    for sort in ("id", "due_date", "title"):
+        for order in ("asc", "desc"):
+            seen = []
+            cursor = ""
+            while True:
+                response = client.get(
+                    "/api/v1/tasks",
+                    headers=headers,
+                    params={"cursor": cursor, "limit": 2, "sort": sort, "order": order}
+                )
+                assert response.status_code == 200
+                page = response.json()
+                seen.extend(task for task in page["items"] if task["id"] in created)
+                if page["next_cursor"] is None:
+                    break
+                cursor = page["next_cursor"]
+            expected = sorted(created.values(), key=lambda task: (task[sort], task["id"]), reverse=order == "desc")
+            assert [task["id"] for task in seen] == [task["id"] for task in expected]
+
+    response = client.get(
+        "/api/v1/tasks",
+        headers=headers,
+        params={"status": "pending", "due_after": "2024-02-01", "due_before": "2024-05-01", "sort": "title"}
+    )
+    assert response.status_code == 200
+    assert [task["title"] for task in response.json() if task["id"] in created] == ["Sorted B", "Sorted C"]
+
+    # A cursor only continues the ordering it was issued for
+    response = client.get("/api/v1/tasks", headers=headers, params={"cursor": "", "limit": 1, "sort": "title"})
+    cursor = response.json()["next_cursor"]
+    response = client.get("/api/v1/tasks", headers=headers, params={"cursor": cursor, "sort": "due_date"})
+    assert response.status_code == 400
+
+    response = client.get("/api/v1/tasks", headers=headers, params={"sort": "owner_id"})
+    assert response.status_code == 422
+
+    for task_id in created:
+        client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+
+def test_search_tasks(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    ids = []
+    for title, description in [
+        ("Groceries", "Buy oat milk and bread"),
+        ("Milk the goats", "Morning chores"),
+        ("Quarterly report", "Collect figures from finance"),
+    ]:
+        response = client.post(
+            "/api/v1/tasks",
+            headers=headers,
+            json={"title": title, "description": description, "status": "pending", "due_date": "2024-08-21"}
+        )
+        ids.append(response.json()["id"])
+
+    # Title matches rank above description matches
+    response = client.get("/api/v1/tasks/search", headers=headers, params={"q": "milk"})
+    assert response.status_code == 200
+    assert [task["id"] for task in response.json()] == [ids[1], ids[0]]
+
+    # The last term matches as a prefix; syntax characters are ignored
+    response = client.get("/api/v1/tasks/search", headers=headers, params={"q": 'quarterly "fin*'})
+    assert [task["id"] for task in response.json()] == [ids[2]]
+
+    response = client.get("/api/v1/tasks/search", headers=headers, params={"q": "milk", "limit": 1, "skip": 1})
+    assert [task["id"] for task in response.json()] == [ids[0]]
+
+    # The index follows updates and deletes
+    client.patch(f"/api/v1/tasks/{ids[1]}", headers=headers, json={"title": "Feed the goats"})
+    client.delete(f"/api/v1/tasks/{ids[0]}", headers=headers)
+    response = client.get("/api/v1/tasks/search", headers=headers, params={"q": "milk"})
+    assert response.json() == []
+    response = client.get("/api/v1/tasks/search", headers=headers, params={"q": "goats"})
+    assert [task["id"] for task in response.json()] == [ids[1]]
+
+    response = client.get("/api/v1/tasks/search", headers=headers, params={"q": "!!!"})
+    assert response.json() == []
+
+    for task_id in ids[1:]:
+        client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+
+def live_counts():
+    db = TestingSessionLocal()
+    try:
+        live = {
+            (owner_id, status.value): count
+            for owner_id, status, count in db.query(Task.owner_id, Task.status, func.count()).group_by(Task.owner_id, Task.status)
+        }
+        stored = {
+            (row.owner_id, status): getattr(row, status)
+            for row in db.query(TaskCounts) for status in ("pending", "in_progress", "completed")
+            if getattr(row, status)
+        }
+        return live, stored
+    finally:
+        db.close()
+
+def assert_counts_match():
+    live, stored = live_counts()
+    assert stored == live
+
+def test_task_stats(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    before = client.get("/api/v1/tasks/stats", headers=headers).json()
+
+    ids = []
+    for status, due_date in [("pending", "2000-01-01"), ("in_progress", "2000-01-02"), ("completed", "2000-01-03"), ("pending", "2999-01-01")]:
+        response = client.post(
+            "/api/v1/tasks",
+            headers=headers,
+            json={"title": "Counted", "description": "Test Description", "status": status, "due_date": due_date}
+        )
+        ids.append(response.json()["id"])
+    assert_counts_match()
+
+    response = client.get("/api/v1/tasks/stats", headers=headers)
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["total"] == before["total"] + 4
+    assert stats["by_status"]["pending"] == before["by_status"]["pending"] + 2
+    # Completed and future tasks aren't overdue
+    assert stats["overdue"] == before["overdue"] + 2
+
+    client.patch(f"/api/v1/tasks/{ids[0]}", headers=headers, json={"status": "completed"})
+    client.put(
+        f"/api/v1/tasks/{ids[1]}",
+        headers=headers,
+        json={"title": "Counted", "description": "Test Description", "status": "pending", "due_date": "2000-01-02"}
+    )
+    assert_counts_match()
+
+    response = client.post("/api/v1/tasks/bulk", headers=headers, json={
+        "create": [{"title": "Bulk counted", "description": "d", "status": "in_progress", "due_date": "2024-08-21"}],
+        "update": [{"id": ids[2], "status": "pending"}, {"id": ids[3], "title": "Renamed"}],
+        "delete": [ids[3]],
+    })
+    ids.append(response.json()["created"][0]["id"])
+    assert_counts_match()
+
+    for task_id in ids[:3] + ids[4:]:
+        client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+    assert_counts_match()
+    assert client.get("/api/v1/tasks/stats", headers=headers).json() == before
+
+def test_rebuild_task_counts(token):
+    db = TestingSessionLocal()
+    try:
+        db.query(TaskCounts).update({TaskCounts.pending: TaskCounts.pending + 7})
+        db.commit()
+        rebuild_task_counts(db)
+    finally:
+        db.close()
+    assert_counts_match()
+
+def sync_changes(headers, token=None, **params):
+    if token is not None:
+        params["since"] = token
+    response = client.get("/api/v1/tasks/changes", headers=headers, params=params)
+    assert response.status_code == 200
+    return response.json()
+
+def test_task_changes(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    ids = []
+    for i in range(3):
+        response = client.post(
+            "/api/v1/tasks",
+            headers=headers,
+            json={"title": f"Synced {i}", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"}
+        )
+        ids.append(response.json()["id"])
+
+    # Without a token the changes are a snapshot of every task
+    snapshot = sync_changes(headers)
+    assert set(ids) <= {task["id"] for task in snapshot["changed"]}
+    assert snapshot["deleted"] == [] and not snapshot["has_more"]
+    sync_token = snapshot["next_token"]
+    assert sync_changes(headers, sync_token)["changed"] == []
+
+    client.patch(f"/api/v1/tasks/{ids[0]}", headers=headers, json={"status": "completed"})
+    client.delete(f"/api/v1/tasks/{ids[1]}", headers=headers)
+    response = client.post("/api/v1/tasks/bulk", headers=headers, json={"update": [{"id": ids[2], "title": "Synced again"}]})
+    changes = sync_changes(headers, sync_token)
+    assert [task["id"] for task in changes["changed"]] == [ids[0], ids[2]]
+    assert changes["changed"][0]["status"] == "completed"
+    assert changes["deleted"] == [ids[1]]
+    assert not changes["reset"]
+
+    # Paging through the same changes yields them in sequence order
+    seen, page_token = [], sync_token
+    while True:
+        page = sync_changes(headers, page_token, limit=1)
+        seen.extend([("changed", task["id"]) for task in page["changed"]] + [("deleted", task_id) for task_id in page["deleted"]])
+        page_token = page["next_token"]
+        if not page["has_more"]:
+            break
+    assert seen == [("changed", ids[0]), ("deleted", ids[1]), ("changed", ids[2])]
+    assert page_token == changes["next_token"]
+
+    # Once the tombstones are pruned an older token can only start over
+    db = TestingSessionLocal()
+    try:
+        prune_tombstones(db, datetime.utcnow() + timedelta(days=1))
+    finally:
+        db.close()
+    changes = sync_changes(headers, sync_token)
+    assert changes["reset"] and changes["deleted"] == []
+    assert {ids[0], ids[2]} <= {task["id"] for task in changes["changed"]}
+
+    response = client.get("/api/v1/tasks/changes", headers=headers, params={"since": "not-a-token"})
+    assert response.status_code == 400
+
+    for task_id in (ids[0], ids[2]):
+        client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+
+def test_fast_json_listing_matches_response_model(token, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    ids = []
+    for i, due_date in enumerate(["2024-08-21", "2024-08-22", "2024-08-23"]):
+        response = client.post(
+            "/api/v1/tasks",
+            headers=headers,
+            json={"title": f"Fast ünïcode {i}", "description": "Test Description", "status": "in_progress", "due_date": due_date}
+        )
+        ids.append(response.json()["id"])
+
+    requests = [
+        {},
+        {"limit": 2, "sort": "due_date", "order": "desc"},
+        {"cursor": "", "limit": 2},
+        {"cursor": "", "limit": 2, "sort": "title", "status": "in_progress"},
+    ]
+    for params in requests:
+        monkeypatch.setattr(main, "FAST_JSON", False)
+        expected = client.get("/api/v1/tasks", headers=headers, params=params)
+        monkeypatch.setattr(main, "FAST_JSON", True)
+        response = client.get("/api/v1/tasks", headers=headers, params=params)
+        assert response.status_code == 200
+        assert response.content == expected.content
+        assert response.headers["ETag"] == expected.headers["ETag"]
+        assert response.headers["content-type"] == "application/json"
+
+    monkeypatch.setattr(main, "FAST_JSON", False)
+    for task_id in ids:
+        client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+
+def test_export_tasks(token, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    ids = []
+    for i, due_date in enumerate(["2024-08-21", "2024-08-22", "2024-08-23"]):
+        response = client.post(
+            "/api/v1/tasks",
+            headers=headers,
+            json={"title": f"Export, \"quoted\" {i}", "description": "Line one\nline two", "status": "completed", "due_date": due_date}
+        )
+        ids.append(response.json()["id"])
+    # Small chunks so the export spans several of them
+    monkeypatch.setattr(export, "CHUNK_SIZE", 2)
+    listed = client.get("/api/v1/tasks", headers=headers, params={"limit": 1000}).json()
+
+    response = client.get("/api/v1/tasks/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"] == 'attachment; filename="tasks.ndjson"'
+    lines = response.content.splitlines()
+    assert [json.loads(line) for line in lines] == sorted(listed, key=lambda task: task["id"])
+
+    response = client.get("/api/v1/tasks/export", headers=headers, params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == len(listed)
+    exported = {int(row["id"]): row for row in rows}
+    assert exported[ids[0]]["title"] == 'Export, "quoted" 0'
+    assert exported[ids[0]]["description"] == "Line one\nline two"
+    assert exported[ids[0]]["status"] == "completed"
+    assert exported[ids[0]]["due_date"] == "2024-08-21"
+
+    response = client.get("/api/v1/tasks/export", headers=headers, params={"format": "xml"})
+    assert response.status_code == 422
+    assert client.get("/api/v1/tasks/export").status_code == 401
+
+    for task_id in ids:
+        client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+
+def other_user_token(email):
+    db = TestingSessionLocal()
+    try:
+        if not db.query(User).filter(User.email == email).first():
+            db.add(User(email=email, hashed_password="x", full_name="Other User"))
+            db.commit()
+    finally:
+        db.close()
+    return create_access_token(data={"sub": email})
+
+def task_ids(headers):
+    return {task["id"] for task in client.get("/api/v1/tasks", headers=headers, params={"limit": 10000}).json()}
+
+def test_import_tasks(token, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    monkeypatch.setattr(imports, "CHUNK_SIZE", 2)
+    before = task_ids(headers)
+    records = [
+        {"title": "Imported 1", "description": "From NDJSON", "status": "pending", "due_date": "2024-08-21"},
+        {"title": "Imported 2", "description": "From NDJSON", "status": "someday", "due_date": "2024-08-21"},
+        "not json",
+        {"title": "Imported 3", "description": "From NDJSON", "status": "completed", "due_date": "2024-08-23", "id": 1},
+        [1, 2],
+        {"title": "Imported 4", "description": "From NDJSON", "status": "in_progress"},
+    ]
+    body = "\n".join(record if isinstance(record, str) else json.dumps(record) for record in records) + "\n\n"
+    response = client.post("/api/v1/tasks/import", headers=headers, content=body.encode())
+    assert response.status_code == 202
+    assert response.json()["status"] == "pending"
+    # The test client runs the background import before returning
+    response = client.get(response.headers["location"], headers=headers)
+    assert response.status_code == 200
+    job = response.json()
+    assert job["status"] == "completed"
+    assert (job["processed"], job["inserted"], job["failed"]) == (6, 2, 4)
+    assert [error["row"] for error in job["errors"]] == [2, 3, 5, 6]
+    assert job["errors"][0]["errors"] == ["status: Input should be 'pending', 'in_progress' or 'completed'"]
+    assert job["errors"][1]["errors"] == ["Invalid JSON"]
+    assert job["errors"][3]["errors"] == ["due_date: Field required"]
+    imported = task_ids(headers) - before
+    titles = {client.get(f"/api/v1/tasks/{task_id}", headers=headers).json()["title"] for task_id in imported}
+    assert titles == {"Imported 1", "Imported 3"}
+    assert_counts_match()
+
+    # An export imports as is, including tasks without a due date (rows the
+    # typed schema migration couldn't parse)
+    db = TestingSessionLocal()
+    try:
+        owner = db.query(User).filter(User.email == "testuser1@example.com").one()
+        undated = Task(title="Undated", description="Migrated", owner_id=owner.id, due_date=None)
+        db.add(undated)
+        db.commit()
+        imported.add(undated.id)
+    finally:
+        db.close()
+    exported = client.get("/api/v1/tasks/export", headers=headers, params={"format": "csv"}).content
+    response = client.post("/api/v1/tasks/import", headers=headers, params={"format": "csv"}, content=b"\xef\xbb\xbf" + exported)
+    job = client.get(response.headers["location"], headers=headers).json()
+    assert job["status"] == "completed"
+    assert job["inserted"] == job["processed"] == len(before) + 3
+    reimported = task_ids(headers) - before - imported
+    assert len(reimported) == len(before) + 3
+    undated_copies = [task for task in (client.get(f"/api/v1/tasks/{task_id}", headers=headers).json() for task_id in reimported) if task["title"] == "Undated"]
+    assert [task["due_date"] for task in undated_copies] == [None]
+    assert_counts_match()
+
+    exported = client.get("/api/v1/tasks/export", headers=headers, params={"format": "ndjson"}).content
+    response = client.post("/api/v1/tasks/import", headers=headers, content=exported)
+    job = client.get(response.headers["location"], headers=headers).json()
+    assert job["failed"] == 0 and job["inserted"] == job["processed"]
+    reimported = task_ids(headers) - before - imported
+
+    for task_id in imported | reimported:
+        client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+
+def test_import_tasks_errors(token, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post("/api/v1/tasks/import", headers=headers, params={"format": "csv"}, content=b"title,description\n\xff\xfe\n")
+    job = client.get(response.headers["location"], headers=headers).json()
+    assert job["status"] == "failed"
+    assert job["inserted"] == 0
+    assert job["detail"] == "Upload is not valid UTF-8 (after row 0)"
+
+    other_token = other_user_token("importer2@example.com")
+    assert client.get(response.headers["location"], headers={"Authorization": f"Bearer {other_token}"}).status_code == 404
+    assert client.get("/api/v1/tasks/import/unknown", headers=headers).status_code == 404
+
+    monkeypatch.setattr(imports, "IMPORT_MAX_BYTES", 10)
+    response = client.post("/api/v1/tasks/import", headers=headers, content=b"{}\n" * 10)
+    assert response.status_code == 413
+    monkeypatch.setattr(imports, "IMPORT_MAX_BYTES", 1000)
+    monkeypatch.setattr(imports, "IMPORT_MAX_ACTIVE", 0)
+    response = client.post("/api/v1/tasks/import", headers=headers, content=b"{}\n")
+    assert response.status_code == 429
+    response = client.post("/api/v1/tasks/import", headers=headers, params={"format": "xml"}, content=b"{}\n")
+    assert response.status_code == 422
+
+def test_task_events(token, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    other_headers = {"Authorization": f"Bearer {other_user_token('events2@example.com')}"}
+    # Nothing left over from other tests, and long enough a window for the
+    # writes below to land in one event
+    monkeypatch.setattr(main, "task_events", events.TaskEvents(main.task_manager, window=0.5))
+    task = {"title": "Evented", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"}
+
+    # One loop for the requests and the sockets
+    with TestClient(app) as live:
+        with live.websocket_connect(f"/ws/tasks?token={token}") as websocket, \
+                live.websocket_connect("/ws/tasks", headers=other_headers) as other_websocket:
+            hello = websocket.receive_json()
+            assert hello["type"] == "hello"
+            assert other_websocket.receive_json()["type"] == "hello"
+
+            first = live.post("/api/v1/tasks", headers=headers, json=task).json()["id"]
+            second = live.post("/api/v1/tasks", headers=headers, json=task).json()["id"]
+            live.patch(f"/api/v1/tasks/{first}", headers=headers, json={"status": "completed"})
+            live.delete(f"/api/v1/tasks/{second}", headers=headers)
+            event = websocket.receive_json()
+            assert event["type"] == "tasks"
+            assert event["changed"] == [first]
+            assert event["deleted"] == [second]
+            # seq is what a delta sync from the hello would end at
+            changes = live.get("/api/v1/tasks/changes", headers=headers, params={"since": sync.encode_token(hello["seq"])}).json()
+            assert sync.decode_token(changes["next_token"]) == event["seq"]
+
+            # The other user's sockets only hear about their own tasks
+            other = live.post("/api/v1/tasks", headers=other_headers, json=task).json()["id"]
+            assert other_websocket.receive_json()["changed"] == [other]
+            live.delete(f"/api/v1/tasks/{other}", headers=other_headers)
+            live.delete(f"/api/v1/tasks/{first}", headers=headers)
+            assert websocket.receive_json()["deleted"] == [first]
+            assert other_websocket.receive_json()["deleted"] == [other]
+
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            with live.websocket_connect("/ws/tasks?token=invalid") as websocket:
+                websocket.receive_json()
+        assert exc_info.value.code == 1008
+
+def test_bulk_tasks(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(
+        "/api/v1/tasks/bulk",
+        headers=headers,
+        json={"create": [
+            {"title": f"Bulk Task {i}", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"}
+            for i in range(3)
+        ]}
+    )
+    assert response.status_code == 200
+    created = response.json()["created"]
+    assert [item["status"] for item in created] == ["created"] * 3
+    ids = [item["id"] for item in created]
+    assert [item["task"]["title"] for item in created] == ["Bulk Task 0", "Bulk Task 1", "Bulk Task 2"]
+
+    response = client.post(
+        "/api/v1/tasks/bulk",
+        headers=headers,
+        json={
+            "update": [{"id": ids[0], "status": "completed"}, {"id": ids[1], "title": "Renamed"}, {"id": 999999, "title": "Missing"}],
+            "delete": [ids[2], 999999],
+            "fetch": ids,
+        }
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [item["status"] for item in data["updated"]] == ["updated", "updated", "not_found"]
+    assert data["updated"][0]["task"]["status"] == "completed"
+    assert data["updated"][0]["task"]["title"] == "Bulk Task 0"
+    assert data["updated"][1]["task"]["title"] == "Renamed"
+    assert [item["status"] for item in data["deleted"]] == ["deleted", "not_found"]
+    # Fetch runs last, so it sees the deletion
+    assert [item["status"] for item in data["fetched"]] == ["found", "found", "not_found"]
+
+    response = client.post("/api/v1/tasks/bulk", headers=headers, json={"delete": ids[:2]})
+    assert [item["status"] for item in response.json()["deleted"]] == ["deleted", "deleted"]
+
+def test_bulk_delete_keeps_other_owners_reminders(token):
+    db = TestingSessionLocal()
+    try:
+        other = User(email="reminded-owner@example.com", hashed_password=get_password_hash("testpassword"), full_name="Other")
+        db.add(other)
+        db.flush()
+        task = Task(title="Theirs", owner_id=other.id, due_date=datetime.utcnow().date())
+        db.add(task)
+        db.commit()
+        task_id, owner_id = task.id, other.id
+    finally:
+        db.close()
+
+    scheduler = main.reminder_scheduler
+    scheduler._schedule(task_id, owner_id, "Theirs", datetime.utcnow().date())
+    try:
+        response = client.post("/api/v1/tasks/bulk", headers={"Authorization": f"Bearer {token}"}, json={"delete": [task_id]})
+        assert response.json()["deleted"] == [{"id": task_id, "status": "not_found", "task": None}]
+        # Someone else's id doesn't unschedule the owner's reminder
+        assert task_id in scheduler._scheduled
+    finally:
+        scheduler.task_deleted(task_id)
+
+def test_bulk_tasks_item_limit(token):
+    response = client.post(
+        "/api/v1/tasks/bulk",
+        headers={"Authorization": f"Bearer {token}"},
+        json={"fetch": list(range(1, 502))}
+    )
+    assert response.status_code == 413
+
+def test_patch_task(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.post(
+        "/api/v1/tasks",
+        headers=headers,
+        json={"title": "Patch Me", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"}
+    )
+    task_id = response.json()["id"]
+
+    response = client.patch(f"/api/v1/tasks/{task_id}", headers=headers, json={"status": "in_progress"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "in_progress"
+    assert data["title"] == "Patch Me"
+    assert data["due_date"] == "2024-08-21"
+
+    assert client.patch("/api/v1/tasks/999999", headers=headers, json={"title": "Nope"}).status_code == 404
+    assert client.patch(f"/api/v1/tasks/{task_id}", headers=headers, json={"status": "bogus"}).status_code == 422
+    client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(test_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(test_engine, "before_cursor_execute", before_cursor_execute)
+
+def test_write_paths_use_one_statement(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    # Warm the principal cache so only the task statements are counted
+    client.get("/api/v1/tasks", headers=headers)
+
+    with count_queries() as statements:
+        response = client.post(
+            "/api/v1/tasks",
+            headers=headers,
+            json={"title": "Counted", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"}
+        )
+    assert response.status_code == 200
+    assert len(statements) == 1 and statements[0].startswith("INSERT")
+    task_id = response.json()["id"]
+
+    with count_queries() as statements:
+        response = client.patch(f"/api/v1/tasks/{task_id}", headers=headers, json={"title": "Counted again"})
+    assert response.json()["title"] == "Counted again"
+    assert len(statements) == 1 and statements[0].startswith("UPDATE")
+
+    with count_queries() as statements:
+        response = client.put(
+            f"/api/v1/tasks/{task_id}",
+            headers=headers,
+            json={"title": "Replaced", "description": "Test Description", "status": "completed", "due_date": "2024-08-22"}
+        )
+    assert response.json()["status"] == "completed"
+    assert len(statements) == 1 and statements[0].startswith("UPDATE")
+
+    with count_queries() as statements:
+        response = client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+    assert response.json()["id"] == task_id
+    assert len(statements) == 1 and statements[0].startswith("DELETE")
+
+def test_conditional_task_reads(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/api/v1/tasks", headers=headers)
+    list_etag = response.headers["ETag"]
+
+    with count_queries() as statements:
+        response = client.get("/api/v1/tasks", headers=dict(headers, **{"If-None-Match": list_etag}))
+    assert response.status_code == 304
+    assert response.content == b""
+    # Only the owner's version is read; no task is loaded
+    assert len(statements) == 1 and "task_counts" in statements[0]
+
+    # Each query has its own tag
+    response = client.get("/api/v1/tasks", headers=dict(headers, **{"If-None-Match": list_etag}), params={"limit": 5})
+    assert response.status_code == 200
+
+    response = client.post(
+        "/api/v1/tasks",
+        headers=headers,
+        json={"title": "Tagged", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"}
+    )
+    task_id = response.json()["id"]
+    response = client.get("/api/v1/tasks", headers=dict(headers, **{"If-None-Match": list_etag}))
+    assert response.status_code == 200
+    assert response.headers["ETag"] != list_etag
+
+    response = client.get(f"/api/v1/tasks/{task_id}", headers=headers)
+    task_etag = response.headers["ETag"]
+    response = client.get(f"/api/v1/tasks/{task_id}", headers=dict(headers, **{"If-None-Match": f"W/{task_etag}"}))
+    assert response.status_code == 304
+
+    response = client.patch(f"/api/v1/tasks/{task_id}", headers=dict(headers, **{"If-Match": task_etag}), json={"title": "Retagged"})
+    assert response.status_code == 200
+    new_etag = response.headers["ETag"]
+    assert new_etag != task_etag
+
+    # A write based on a stale version is refused
+    response = client.patch(f"/api/v1/tasks/{task_id}", headers=dict(headers, **{"If-Match": task_etag}), json={"title": "Lost update"})
+    assert response.status_code == 412
+    response = client.delete(f"/api/v1/tasks/{task_id}", headers=dict(headers, **{"If-Match": task_etag}))
+    assert response.status_code == 412
+    response = client.get(f"/api/v1/tasks/{task_id}", headers=dict(headers, **{"If-None-Match": task_etag}))
+    assert response.status_code == 200
+    assert response.json()["title"] == "Retagged"
+
+    response = client.delete(f"/api/v1/tasks/{task_id}", headers=dict(headers, **{"If-Match": new_etag}))
+    assert response.status_code == 200
+    response = client.put(
+        f"/api/v1/tasks/{task_id}",
+        headers=dict(headers, **{"If-Match": new_etag}),
+        json={"title": "Gone", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"}
+    )
+    assert response.status_code == 404
+
+def test_write_paths_without_returning(token, monkeypatch):
+    headers = {"Authorization": f"Bearer {token}"}
+    for kind in ("insert", "update", "delete", "insert_executemany"):
+        monkeypatch.setattr(test_engine.dialect, f"{kind}_returning", False)
+    monkeypatch.setattr(test_engine.dialect, "insert_executemany_returning_sort_by_parameter_order", False)
+
+    response = client.post(
+        "/api/v1/tasks",
+        headers=headers,
+        json={"title": "Fallback", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"}
+    )
+    assert response.status_code == 200
+    task_id = response.json()["id"]
+
+    response = client.patch(f"/api/v1/tasks/{task_id}", headers=headers, json={"title": "Fallback patched"})
+    assert response.json()["title"] == "Fallback patched"
+    assert client.patch("/api/v1/tasks/999999", headers=headers, json={"title": "Nope"}).status_code == 404
+
+    response = client.delete(f"/api/v1/tasks/{task_id}", headers=headers)
+    assert response.json()["title"] == "Fallback patched"
+    assert client.delete(f"/api/v1/tasks/{task_id}", headers=headers).status_code == 404
+
+    response = client.post(
+        "/api/v1/tasks/bulk",
+        headers=headers,
+        json={"create": [{"title": f"Bulk fallback {i}", "description": "Test Description", "status": "pending", "due_date": "2024-08-21"} for i in range(3)]}
+    )
+    assert response.status_code == 200
+    created = response.json()["created"]
+    assert [item["task"]["title"] for item in created] == [f"Bulk fallback {i}" for i in range(3)]
+    response = client.post("/api/v1/tasks/bulk", headers=headers, json={"delete": [item["id"] for item in created]})
+    assert [item["status"] for item in response.json()["deleted"]] == ["deleted"] * 3
+
 # Concurrency tests
 import threading
 
@@ -319,3 +1062,54 @@ def test_concurrent_task_creation_and_deletion(token):
     assert response.status_code == 200
     data = response.json()
     assert len(data) == 0  # All tasks should be deleted
+
+def test_concurrent_status_changes_keep_counts(token):
+    task_id = create_task(token, 0)
+    statuses = ["pending", "in_progress", "completed"]
+
+    def change_status(i):
+        response = client.patch(
+            f"/api/v1/tasks/{task_id}",
+            headers={"Authorization": f"Bearer {token}"},
+            json={"status": statuses[i % 3]}
+        )
+        assert response.status_code == 200
+
+    threads = [threading.Thread(target=change_status, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert_counts_match()
+    delete_task(token, task_id)
+
+def test_search_on_unsupported_database(token, monkeypatch):
+    def unsupported(dialect_name, *args):
+        raise ValueError(f"Task search is not available on '{dialect_name}' databases")
+
+    monkeypatch.setattr(search, "search_statement", unsupported)
+    response = client.get("/api/v1/tasks/search", headers={"Authorization": f"Bearer {token}"}, params={"q": "milk"})
+    assert response.status_code == 501
+    assert "not available" in response.json()["detail"]
+
+def test_device_registration(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    for _ in range(2):
+        response = client.post("/api/v1/devices", headers=headers, json={"token": "fcm-device-1"})
+        assert response.status_code == 204
+    assert client.post("/api/v1/devices", headers=headers, json={"token": ""}).status_code == 422
+
+    db = TestingSessionLocal()
+    try:
+        user = db.query(User).filter(User.email == "testuser1@example.com").one()
+        assert [device.user_id for device in db.query(DeviceToken).filter(DeviceToken.token == "fcm-device-1")] == [user.id]
+    finally:
+        db.close()
+
+    assert client.delete("/api/v1/devices/fcm-device-1", headers=headers).status_code == 204
+    db = TestingSessionLocal()
+    try:
+        assert db.query(DeviceToken).filter(DeviceToken.token == "fcm-device-1").count() == 0
+    finally:
+        db.close()
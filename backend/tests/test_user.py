@@ -1,9 +1,11 @@
 from fastapi.testclient import TestClient
 from backend.main import app
+from backend import auth
 from backend.dependencies import get_db
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from backend.models import Base
+from backend.models import Base, User
+from passlib.hash import bcrypt
 import pytest
 import os
 from dotenv import load_dotenv
@@ -15,7 +17,7 @@ database_url = os.getenv("DATABASE_URL")
 
 
 engine = create_engine(database_url)
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 # Dependency override
 def override_get_db():
@@ -76,3 +78,25 @@ def test_login_with_incorrect_password():
         "password": "wrongpassword"
     })
     assert response.status_code == 401
+
+def test_login_rehashes_outdated_password_hash():
+    db = TestingSessionLocal()
+    try:
+        db.add(User(email="oldcost@example.com", hashed_password=bcrypt.using(rounds=4).hash("password123"), full_name="Old Cost"))
+        db.commit()
+    finally:
+        db.close()
+
+    response = client.post("api/v1/login", data={
+        "username": "oldcost@example.com",
+        "password": "password123"
+    })
+    assert response.status_code == 200
+
+    db = TestingSessionLocal()
+    try:
+        user = db.query(User).filter(User.email == "oldcost@example.com").first()
+        assert not user.hashed_password.startswith("$2b$04$")
+        assert auth.pwd_context.verify("password123", user.hashed_password)
+    finally:
+        db.close()
@@ -1,6 +1,11 @@
+import asyncio
+import json
 import pytest
 from fastapi.testclient import TestClient
 from backend.main import app
+from backend.broker import InProcessBroker, RedisBroker, broker_from_url
+from backend import main
+from backend.connections import IDLE_CLOSE_CODE, REJECTED_CLOSE_CODE, SLOW_CONSUMER_CLOSE_CODE, ConnectionManager
 from fastapi import WebSocketDisconnect
 
 client = TestClient(app)
@@ -30,3 +35,395 @@ def test_websocket_disconnect():
             websocket.send_text("This should not go through")
         except Exception as e:
             assert isinstance(e, WebSocketDisconnect)
+
+# Stands in for a client socket; send_text waits while the client is stalled
+class FakeWebSocket:
+    def __init__(self, stalled: bool = False, broken: bool = False):
+        self.received = []
+        self.closed_with = None
+        self.broken = broken
+        self.inbox = asyncio.Queue()
+        self.flowing = asyncio.Event()
+        if not stalled:
+            self.flowing.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.broken:
+            raise RuntimeError("connection reset")
+        await self.flowing.wait()
+        self.received.append(message)
+
+    async def receive_text(self):
+        return await self.inbox.get()
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+def test_stalled_client_does_not_delay_broadcast():
+    async def scenario():
+        manager = ConnectionManager(queue_size=10)
+        stalled, broken, fast = FakeWebSocket(stalled=True), FakeWebSocket(broken=True), FakeWebSocket()
+        for websocket in (stalled, broken, fast):
+            await manager.connect(websocket)
+        for i in range(3):
+            await manager.broadcast(f"message {i}")
+        await settle()
+        assert fast.received == ["message 0", "message 1", "message 2"]
+        assert stalled.received == []
+        # A failed send only removes that client
+        assert broken not in manager.active_connections
+        assert manager.stats()["send_errors"] == 1
+
+        stalled.flowing.set()
+        await settle()
+        assert stalled.received == fast.received
+        manager.disconnect(fast)
+        manager.disconnect(stalled)
+        assert manager.stats()["connections"] == 0
+
+    asyncio.run(scenario())
+
+def test_slow_consumer_drops_oldest_messages():
+    async def scenario():
+        manager = ConnectionManager(queue_size=2, policy="drop_oldest")
+        websocket = FakeWebSocket(stalled=True)
+        await manager.connect(websocket)
+        await manager.broadcast("message 0")
+        await settle()
+        # message 0 is being written; the queue holds two more
+        for i in range(1, 5):
+            await manager.broadcast(f"message {i}")
+        websocket.flowing.set()
+        await settle()
+        assert websocket.received == ["message 0", "message 3", "message 4"]
+        assert manager.stats()["dropped"] == 2
+        manager.disconnect(websocket)
+
+    asyncio.run(scenario())
+
+def test_slow_consumer_is_disconnected():
+    async def scenario():
+        manager = ConnectionManager(queue_size=1, policy="disconnect")
+        slow, fast = FakeWebSocket(stalled=True), FakeWebSocket()
+        await manager.connect(slow)
+        await manager.connect(fast)
+        await manager.broadcast("message 0")
+        await settle()
+        # message 0 is being written, message 1 fills the queue, message 2
+        # overflows it; the fast client keeps up between messages
+        for i in range(1, 3):
+            await manager.broadcast(f"message {i}")
+            await settle()
+        assert slow not in manager.active_connections
+        assert slow.closed_with == SLOW_CONSUMER_CLOSE_CODE
+        assert fast.received == ["message 0", "message 1", "message 2"]
+        assert manager.stats()["slow_disconnects"] == 1
+        manager.disconnect(fast)
+
+    asyncio.run(scenario())
+
+def test_unknown_slow_consumer_policy():
+    with pytest.raises(ValueError):
+        ConnectionManager(policy="block")
+
+def test_websocket_chat_room():
+    with client.websocket_connect("/ws/chat/1?room=a") as first, \
+            client.websocket_connect("/ws/chat/2?room=a") as second, \
+            client.websocket_connect("/ws/chat/3?room=b") as other:
+        first.send_text("Hi room a")
+        assert first.receive_text() == "User 1 says: Hi room a"
+        assert second.receive_text() == "User 1 says: Hi room a"
+        other.send_text("Hi room b")
+        # Only room b's member hears it, and room a's message never reached it
+        assert other.receive_text() == "User 3 says: Hi room b"
+
+def test_send_to_user_and_room():
+    async def scenario():
+        manager = ConnectionManager()
+        phone, tablet, other = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await manager.connect(phone, user_id=1, rooms=["team"])
+        await manager.connect(tablet, user_id=1)
+        await manager.connect(other, user_id=2, rooms=["team"])
+
+        await manager.send_to_user(1, "for user 1")
+        await manager.send_to_room("team", "for the team")
+        await manager.send_to_user(3, "nobody")
+        await manager.send_to_room("empty", "nobody")
+        await settle()
+        assert phone.received == ["for user 1", "for the team"]
+        assert tablet.received == ["for user 1"]
+        assert other.received == ["for the team"]
+
+        manager.join(tablet, "team")
+        manager.leave(phone, "team")
+        await manager.send_to_room("team", "again")
+        await settle()
+        assert phone.received[-1] == "for the team"
+        assert tablet.received[-1] == "again"
+
+        manager.disconnect(tablet)
+        assert manager.user_connections == {1: {phone}, 2: {other}}
+        assert manager.rooms == {"team": {other}}
+        manager.disconnect(phone)
+        manager.disconnect(other)
+        # Indexes don't keep empty entries around
+        assert manager.user_connections == {} and manager.rooms == {}
+        assert manager.stats()["connections"] == 0
+
+    asyncio.run(scenario())
+
+def test_heartbeat_evicts_idle_connections():
+    async def scenario():
+        manager = ConnectionManager(ping_interval=0.02, idle_timeout=0.05)
+        quiet, alive = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(quiet, user_id=1)
+        await manager.connect(alive, user_id=2)
+        reader = asyncio.create_task(manager.receive_text(alive))
+        for _ in range(8):
+            await asyncio.sleep(0.02)
+            alive.inbox.put_nowait('{"type": "pong"}')
+        assert quiet.closed_with == IDLE_CLOSE_CODE
+        assert quiet not in manager.active_connections and 1 not in manager.user_connections
+        assert alive.closed_with is None and alive in manager.active_connections
+        assert '{"type": "ping"}' in alive.received
+        # Pongs are consumed; other messages reach the receive loop
+        assert not reader.done()
+        alive.inbox.put_nowait("hello")
+        assert await reader == "hello"
+        stats = manager.stats()
+        assert stats["connections"] == 1 and stats["evicted"] == 1 and stats["pings"] >= 2
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_connection_limits():
+    async def scenario():
+        manager = ConnectionManager(max_connections=3, max_per_user=2)
+        first, second, third = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        assert await manager.connect(first, user_id=1)
+        assert await manager.connect(second, user_id=1)
+        assert not await manager.connect(third, user_id=1)
+        assert third.closed_with == REJECTED_CLOSE_CODE
+        assert await manager.connect(third, user_id=2)
+        fourth = FakeWebSocket()
+        assert not await manager.connect(fourth)
+        assert fourth.closed_with == REJECTED_CLOSE_CODE
+        assert manager.stats()["rejected"] == 2
+        # A freed slot can be taken again
+        manager.disconnect(first)
+        assert await manager.connect(fourth, user_id=1)
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_websocket_chat_connection_limit(monkeypatch):
+    monkeypatch.setattr(main.manager, "max_per_user", 1)
+    with client.websocket_connect("/ws/chat/7") as websocket:
+        with client.websocket_connect("/ws/chat/7") as rejected:
+            with pytest.raises(WebSocketDisconnect) as closed:
+                rejected.receive_text()
+            assert closed.value.code == REJECTED_CLOSE_CODE
+        websocket.send_text("still here")
+        assert websocket.receive_text() == "User 7 says: still here"
+
+def test_reconnect_replays_missed_messages():
+    async def scenario():
+        manager = ConnectionManager()
+        phone = FakeWebSocket()
+        await manager.connect(phone, user_id=1, rooms=["team"], resume="")
+        await manager.send_to_user(1, "first")
+        await settle()
+        # A fresh client has nothing to catch up on
+        assert json.loads(phone.received[0])["type"] == "resync"
+        frame = json.loads(phone.received[1])
+        assert frame["type"] == "message" and frame["data"] == "first"
+        manager.disconnect(phone)
+
+        await manager.send_to_user(1, "second")
+        await manager.send_to_user(2, "not for phone")
+        await manager.send_to_room("team", "third")
+        await manager.send_to_room("other", "not for phone")
+        await manager.broadcast("fourth")
+
+        again = FakeWebSocket()
+        await manager.connect(again, user_id=1, rooms=["team"], resume=frame["id"])
+        await manager.broadcast("live")
+        await settle()
+        frames = [json.loads(message) for message in again.received]
+        assert [frame["data"] for frame in frames if frame["type"] == "message"] == ["second", "third", "fourth", "live"]
+        assert frames[3] == {"type": "replay", "id": frames[2]["id"], "replayed": 3}
+        # Clients that didn't ask for replay get plain messages
+        plain = FakeWebSocket()
+        await manager.connect(plain)
+        await manager.broadcast("plain")
+        await settle()
+        assert plain.received == ["plain"]
+
+        # Ids from another worker or from before a restart
+        stranger = FakeWebSocket()
+        await manager.connect(stranger, user_id=1, resume="elsewhere:3")
+        await settle()
+        assert json.loads(stranger.received[0])["type"] == "resync"
+        assert manager.stats()["replay"]["replayed"] == 3
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_reconnect_resyncs_when_gap_is_gone():
+    async def scenario():
+        manager = ConnectionManager(replay_messages=3)
+        phone = FakeWebSocket()
+        await manager.connect(phone, user_id=1, resume="")
+        await manager.send_to_user(1, "seen")
+        await settle()
+        seen = json.loads(phone.received[-1])["id"]
+        manager.disconnect(phone)
+        for i in range(4):
+            await manager.send_to_user(1, f"missed {i}")
+
+        again = FakeWebSocket()
+        await manager.connect(again, user_id=1, resume=seen)
+        await settle()
+        status = json.loads(again.received[-1])
+        assert status == {"type": "resync", "id": f"{manager.origin}:5"}
+        # From the resync id on, nothing is missed
+        manager.disconnect(again)
+        await manager.send_to_user(1, "after")
+        last = FakeWebSocket()
+        await manager.connect(last, user_id=1, resume=status["id"])
+        await settle()
+        assert json.loads(last.received[0])["data"] == "after"
+        assert manager.stats()["replay"]["messages"] == 3
+        await manager.stop()
+
+    asyncio.run(scenario())
+
+def test_websocket_chat_resume():
+    with TestClient(app) as live:
+        with live.websocket_connect("/ws/chat/8?room=resume&resume=") as websocket:
+            assert json.loads(websocket.receive_text())["type"] == "resync"
+            websocket.send_text("before")
+            last_id = json.loads(websocket.receive_text())["id"]
+        with live.websocket_connect("/ws/chat/9?room=resume") as other:
+            other.send_text("while away")
+            assert other.receive_text() == "User 9 says: while away"
+        with live.websocket_connect(f"/ws/chat/8?room=resume&resume={last_id}") as websocket:
+            frame = json.loads(websocket.receive_text())
+            assert frame["type"] == "message" and frame["data"] == "User 9 says: while away"
+            assert json.loads(websocket.receive_text())["type"] == "replay"
+
+# Two managers stand for two workers
+async def fan_out_across_workers(first_broker, second_broker, wait):
+    first, second = ConnectionManager(broker=first_broker), ConnectionManager(broker=second_broker)
+    alice, bob, carol = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    await first.connect(alice, user_id=1, rooms=["team"])
+    await second.connect(bob, user_id=2, rooms=["team"])
+    await second.connect(carol, user_id=1)
+
+    await first.broadcast("everyone")
+    await first.send_to_user(1, "alice's devices")
+    await first.send_to_user(3, "nobody")
+    # Each worker delivers its own messages first; there's no order across
+    # workers
+    await wait(lambda: len(carol.received) == 2)
+    await second.send_to_room("team", "the team")
+    await wait(lambda: len(alice.received) == 3 and len(bob.received) == 2 and len(carol.received) == 2)
+    assert alice.received == ["everyone", "alice's devices", "the team"]
+    assert bob.received == ["everyone", "the team"]
+    assert carol.received == ["everyone", "alice's devices"]
+
+    await first.stop()
+    await second.stop()
+
+async def settled(condition):
+    await settle()
+
+def test_in_process_broker_fans_out_across_managers():
+    broker = InProcessBroker()
+    asyncio.run(fan_out_across_workers(broker, broker, settled))
+    assert broker.stats() == {"subscribers": 0, "published": 4}
+
+def test_redis_broker_fans_out_across_workers():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def until(condition):
+        for _ in range(200):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("messages did not arrive")
+
+    async def scenario():
+        server = fakeredis.FakeServer()
+        brokers = [RedisBroker(fakeredis.aioredis.FakeRedis(server=server), batch_delay=0.01) for _ in range(2)]
+        await fan_out_across_workers(*brokers, until)
+        # Messages sent together cross over as one batch each
+        assert brokers[0].stats()["published"] == 3
+        assert brokers[0].stats()["batches"] == 1
+        assert brokers[1].stats()["received"] == 3
+        assert brokers[0].stats()["received"] == 1
+        for broker in brokers:
+            await broker.close()
+
+    asyncio.run(scenario())
+
+def test_redis_broker_survives_bad_batches():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    async def scenario():
+        client = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+        broker = RedisBroker(client)
+        delivered = []
+
+        def deliver(messages):
+            if messages[0]["message"] == "boom":
+                raise KeyError("room")
+            delivered.extend(messages)
+
+        await broker.subscribe("here", deliver)
+        await client.publish(broker.channel, "not json")
+        await client.publish(broker.channel, json.dumps({"messages": []}))
+        await client.publish(broker.channel, json.dumps({"origin": "there", "messages": [{"to": "all", "message": "boom"}]}))
+        await client.publish(broker.channel, json.dumps({"origin": "there", "messages": [{"to": "all", "message": "hi"}]}))
+        for _ in range(200):
+            if delivered:
+                break
+            await asyncio.sleep(0.01)
+        # The reader is still running after the bad batches
+        assert delivered == [{"to": "all", "message": "hi"}]
+        assert broker.stats()["errors"] == 3
+        await broker.close()
+
+    asyncio.run(scenario())
+
+def test_redis_broker_publishes_batches_in_order():
+    # The first publish is the slowest; a flush that doesn't wait for it
+    # would overtake it
+    class SlowClient:
+        def __init__(self):
+            self.published = []
+            self.delays = [0.05, 0.01, 0]
+
+        async def publish(self, channel, data):
+            await asyncio.sleep(self.delays.pop(0) if self.delays else 0)
+            self.published.append(json.loads(data)["messages"])
+
+    async def scenario():
+        client = SlowClient()
+        broker = RedisBroker(client, batch_size=1)
+        await asyncio.gather(*(broker.publish("here", {"to": "all", "message": str(i)}) for i in range(4)))
+        assert [message["message"] for batch in client.published for message in batch] == ["0", "1", "2", "3"]
+
+    asyncio.run(scenario())
+
+def test_broker_from_url():
+    assert broker_from_url("") is None
+    assert broker_from_url("memory://") is broker_from_url("memory://")
+    assert isinstance(broker_from_url("redis://localhost:6379/0"), RedisBroker)